@@ -0,0 +1,94 @@
+# ai/buffers.py
+from collections import defaultdict
+from decimal import Decimal
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from infrastructure.models import AIInteraction, AIUsageDaily
+from shared.buffers import WriteBehindBuffer
+from .services.ai_manager.usage import TokenUsage, estimate_cost, spend_guard
+
+_USAGE_COUNTERS = ('llamadas', 'llamadas_cache', 'errores', 'tokens_prompt', 'tokens_respuesta', 'costo')
+
+
+def rollup_daily_usage(interactions):
+    """
+    Suma las interacciones a AIUsageDaily: una fila por (tenant, día,
+    endpoint, proveedor, modelo), incrementada con F() para que varios
+    workers puedan vaciar a la vez.
+    """
+    totals = defaultdict(lambda: dict.fromkeys(_USAGE_COUNTERS, 0))
+    for interaction in interactions:
+        key = (
+            interaction.tenant_id, timezone.localdate(interaction.created_at),
+            interaction.endpoint, interaction.proveedor_usado, interaction.modelo,
+        )
+        row = totals[key]
+        row['llamadas'] += 1
+        row['llamadas_cache'] += int(interaction.desde_cache)
+        row['errores'] += int(bool(interaction.errores))
+        row['tokens_prompt'] += interaction.tokens_prompt
+        row['tokens_respuesta'] += interaction.tokens_respuesta
+        row['costo'] += Decimal(interaction.costo_estimado)
+
+    for (tenant_id, fecha, endpoint, proveedor, modelo), row in totals.items():
+        lookup = {'tenant_id': tenant_id, 'fecha': fecha, 'endpoint': endpoint, 'proveedor': proveedor, 'modelo': modelo}
+        increments = {field: F(field) + value for field, value in row.items()}
+        if AIUsageDaily.objects.filter(**lookup).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                AIUsageDaily.objects.create(**lookup, **row)
+        except IntegrityError:
+            # Otro worker creó la fila entre el UPDATE y el INSERT.
+            AIUsageDaily.objects.filter(**lookup).update(**increments)
+
+    spend_guard.invalidate({tenant_id for tenant_id, *_ in totals})
+
+
+class AIInteractionBuffer(WriteBehindBuffer):
+    """Cada vaciado escribe las interacciones, su historial y el agregado diario en una transacción."""
+    def _insert_one(self, obj):
+        with transaction.atomic():
+            super()._insert_one(obj)
+            rollup_daily_usage([obj])
+
+    def _bulk_insert(self, objs):
+        with transaction.atomic():
+            super()._bulk_insert(objs)
+            rollup_daily_usage(objs)
+
+
+# Auditoría de las llamadas a la IA: se escribe en segundo plano, junto con su
+# historial, en lugar de dos INSERT en la ruta de cada petición.
+ai_interaction_buffer = AIInteractionBuffer('infrastructure.AIInteraction', with_history=True)
+
+
+def _build_interaction(user, usage: Optional[TokenUsage] = None, **fields) -> AIInteraction:
+    interaction = AIInteraction(tenant_id=user.tenant_id, user=user, created_at=timezone.now(), **fields)
+    if usage is not None:
+        interaction.tokens_prompt = usage.prompt_tokens
+        interaction.tokens_respuesta = usage.completion_tokens
+        interaction.tokens_estimados = usage.estimated
+        interaction.desde_cache = usage.cached
+        interaction.latencia_ms = usage.latency_ms
+        interaction.costo_estimado = estimate_cost(interaction.proveedor_usado, interaction.modelo, usage)
+    # bulk_create_with_history toma de aquí el history_user de cada fila.
+    interaction._history_user = user
+    return interaction
+
+
+def record_interaction(user, **fields):
+    """
+    Encola un AIInteraction del usuario (y de su tenant) para el próximo
+    vaciado. Con usage (TokenUsage) se guardan los tokens y el coste según la
+    tabla de precios del proveedor y modelo.
+    """
+    ai_interaction_buffer.add(_build_interaction(user, **fields))
+
+
+async def arecord_interaction(user, **fields):
+    await ai_interaction_buffer.aadd(_build_interaction(user, **fields))
@@ -0,0 +1,17 @@
+# ai/http.py
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.response import Response
+
+from .services.ai_manager.rate_limit import RateLimitExceeded
+
+
+def provider_error_response(exc: RuntimeError, status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE) -> Response:
+    """
+    Traduce un RuntimeError de la capa de IA a la respuesta HTTP de la vista.
+    Un RateLimitExceeded se relanza como Throttled (429 con Retry-After); el
+    resto se devuelve como {"error": ...} con `status_code`.
+    """
+    if isinstance(exc, RateLimitExceeded):
+        raise Throttled(wait=exc.retry_after, detail=str(exc))
+    return Response({"error": str(exc)}, status=status_code)
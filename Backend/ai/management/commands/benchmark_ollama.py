@@ -0,0 +1,50 @@
+# ai/management/commands/benchmark_ollama.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from ai.services.ai_manager.fake_ollama import FakeOllamaServer
+from ai.services.ai_manager.providers.ollama_provider import OllamaProvider
+
+
+class Command(BaseCommand):
+    help = 'Compares pooled OllamaProvider requests against bare requests.post using a local fake Ollama server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--delay', type=float, default=0.0, help='Simulated model latency per request (seconds).')
+
+    def _run(self, call, total, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(total)))
+        return time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        total, concurrency = options['requests'], options['concurrency']
+
+        with FakeOllamaServer(delay=options['delay']) as server:
+            url = f"{server.endpoint}/api/generate"
+            bare = self._run(
+                lambda i: requests.post(url, json={"model": "bench", "prompt": str(i), "stream": False}).json(),
+                total, concurrency,
+            )
+            bare_connections = server.connections
+
+        with FakeOllamaServer(delay=options['delay']) as server:
+            provider = OllamaProvider(endpoint=server.endpoint, pool_size=concurrency)
+            pooled = self._run(lambda i: provider.generate_text(prompt=str(i), model="bench"), total, concurrency)
+            pooled_connections = server.connections
+            provider.close()
+
+        for label, seconds, connections in (
+            ('requests.post', bare, bare_connections),
+            ('OllamaProvider', pooled, pooled_connections),
+        ):
+            self.stdout.write(
+                f"{label:<16} {total} requests in {seconds:.3f}s "
+                f"({total / seconds:.0f} req/s, {connections} TCP connections)"
+            )
@@ -1,13 +1,21 @@
 # ai/services/ai_manager/ai_base_provider.py
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
  
-from typing import List, Optional, Literal
+from typing import Iterator, List, Optional, Literal, Tuple, Union
+
+from .usage import TokenUsage
 
 class AIBaseProvider(ABC):
     """
     Clase base abstracta para un proveedor de IA.
     Cada proveedor debe declarar sus capacidades.
     """
+    # Llamadas simultáneas como máximo en generate_text_batch por defecto
+    batch_concurrency = 8
+
     @property
     @abstractmethod
     def capabilities(self) -> List[str]:
@@ -25,5 +33,53 @@ class AIBaseProvider(ABC):
     def generate_image(self, prompt: str, model: str, **kwargs) -> Optional[str]:
         pass
 
+    def generate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
+        """
+        generate_text más los tokens consumidos. Por defecto se estiman a partir
+        del texto; los proveedores que informan el conteo real lo sobrescriben.
+        """
+        text = self.generate_text(prompt=prompt, model=model, **kwargs)
+        return text, TokenUsage.estimate(prompt, text)
+
+    def stream_text(self, prompt: str, model: str, **kwargs) -> Iterator[str]:
+        """
+        Genera texto fragmento a fragmento. Los proveedores con la capacidad
+        'text_stream' lo implementan de verdad; por defecto se emite el texto
+        completo como un único fragmento.
+        """
+        yield self.generate_text(prompt=prompt, model=model, **kwargs)
+
+    def generate_text_batch(self, prompts: List[str], model: str, **kwargs) -> List[Union[str, RuntimeError]]:
+        """
+        Genera un texto por prompt. Devuelve, en el orden de `prompts`, el
+        texto o el RuntimeError de cada elemento. Por defecto reparte las
+        llamadas en un pool de hilos de batch_concurrency hilos; un proveedor con
+        API de lotes nativa la sobrescribe.
+        """
+        def generate_one(prompt):
+            try:
+                return self.generate_text(prompt=prompt, model=model, **kwargs)
+            except RuntimeError as e:
+                return e
+
+        if len(prompts) <= 1:
+            return [generate_one(prompt) for prompt in prompts]
+        with ThreadPoolExecutor(max_workers=min(len(prompts), self.batch_concurrency), thread_name_prefix='ai-batch') as executor:
+            return list(executor.map(generate_one, prompts))
+
+    # Variantes asíncronas, usadas por las vistas async bajo ASGI. Por defecto
+    # delegan en la versión síncrona en un hilo del executor; los proveedores
+    # con un cliente async nativo las sobrescriben para no ocupar ningún hilo
+    # mientras esperan al modelo.
+    async def agenerate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return await sync_to_async(self.generate_text, thread_sensitive=False)(prompt=prompt, model=model, **kwargs)
+
+    async def agenerate_image(self, prompt: str, model: str, **kwargs) -> Optional[str]:
+        return await sync_to_async(self.generate_image, thread_sensitive=False)(prompt=prompt, model=model, **kwargs)
+
+    async def agenerate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
+        text = await self.agenerate_text(prompt=prompt, model=model, **kwargs)
+        return text, TokenUsage.estimate(prompt, text)
+
     # Se pueden añadir más métodos abstractos para otras capacidades (video, etc.)
  
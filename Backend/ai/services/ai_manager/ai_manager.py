@@ -1,14 +1,82 @@
 # ai/services/ai_manager/ai_manager.py
 import os
+import time
+import weakref
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 from .providers.gemini_provider import GeminiProvider
 from .providers.ollama_provider import OllamaProvider
 from .providers.dummy_provider import DummyProvider
 from .ai_base_provider import AIBaseProvider
+from .health import ProviderHealth
+from .response_cache import get_cache_settings, make_cache_key, response_cache
+from .rate_limit import RateLimitExceeded, estimate_tokens, get_rate_limit_settings, rate_limiter
+from .single_flight import single_flight
+from .usage import TokenUsage, spend_guard
 
 load_dotenv()
 
+def _env_number(name: str, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+@dataclass
+class BatchItem:
+    """Resultado de un elemento de execute_text_generation_batch: texto o error."""
+    text: Optional[str] = None
+    provider_name: Optional[str] = None
+    error: Optional[str] = None
+    usage: Optional[TokenUsage] = None
+
+
+class _BreakerOpen(Exception):
+    """El circuit breaker del proveedor no admite la llamada: se pasa al siguiente."""
+
+
+class _TenantQuota:
+    """
+    Cupo del tenant para una petición (rate_limit.py). Se toma una sola vez y
+    antes de unirse a una generación en curso (single_flight.py), así ningún
+    seguidor recibe el RateLimitExceeded del líder de otro tenant y cambiar de
+    proveedor no lo descuenta otra vez. El cupo del proveedor se sigue tomando
+    en _call_provider, solo en la llamada que llega al proveedor.
+    """
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self._lease = None
+
+    def take(self, tokens: int, requests: int = 1):
+        if self._lease is None and self.tenant_id is not None:
+            self._lease = rate_limiter.acquire(self.tenant_id, None, tokens, requests=requests)
+
+    async def atake(self, tokens: int, requests: int = 1):
+        if self._lease is None and self.tenant_id is not None:
+            self._lease = await rate_limiter.aacquire(self.tenant_id, None, tokens, requests=requests)
+
+    def release(self):
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
+
+    async def arelease(self):
+        if self._lease is not None:
+            lease, self._lease = self._lease, None
+            await lease.arelease()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.arelease()
+
+
 class AIManager:
     _instance = None
 
@@ -16,6 +84,7 @@ class AIManager:
         if cls._instance is None:
             cls._instance = super(AIManager, cls).__new__(cls)
             cls._instance.providers: List[AIBaseProvider] = []
+            cls._instance.health = {}
             cls._instance._initialize_providers()
         return cls._instance
 
@@ -32,7 +101,14 @@ class AIManager:
         ollama_endpoint = os.getenv("OLLAMA_ENDPOINT")
         if ollama_endpoint:
             try:
-                self.providers.append(OllamaProvider(endpoint=ollama_endpoint))
+                self.providers.append(OllamaProvider(
+                    endpoint=ollama_endpoint,
+                    pool_size=_env_number("OLLAMA_POOL_SIZE", int),
+                    connect_timeout=_env_number("OLLAMA_CONNECT_TIMEOUT"),
+                    read_timeout=_env_number("OLLAMA_READ_TIMEOUT"),
+                    max_retries=_env_number("OLLAMA_MAX_RETRIES", int),
+                    async_pool_size=_env_number("OLLAMA_ASYNC_POOL_SIZE", int),
+                ))
                 print("Ollama provider initialized.")
             except Exception as e:
                 print(f"Failed to initialize Ollama provider: {e}")
@@ -41,24 +117,395 @@ class AIManager:
             print("Warning: No AI providers initialized. Falling back to DummyProvider.")
             self.providers.append(DummyProvider())
 
+    def _health_for(self, provider: AIBaseProvider) -> ProviderHealth:
+        health = self.health.get(provider)
+        if health is None:
+            health = self.health.setdefault(provider, ProviderHealth(provider.__class__.__name__))
+        return health
+
+    def _candidates(self, capability: str) -> List[AIBaseProvider]:
+        """Proveedores con la capacidad, del más sano al menos (ver health.py)."""
+        capable = [provider for provider in self.providers if provider.has_capability(capability)]
+        return sorted(capable, key=lambda provider: self._health_for(provider).expected_latency())
+
     def _find_provider_for_capability(self, capability: str) -> Optional[AIBaseProvider]:
-        for provider in self.providers:
-            if provider.has_capability(capability):
-                return provider
+        candidates = self._candidates(capability)
+        return candidates[0] if candidates else None
+
+    def _cache_key(self, provider_name: str, model: str, prompt: str, kwargs: dict, use_cache: bool) -> Optional[str]:
+        if use_cache and get_cache_settings()['ENABLED']:
+            return make_cache_key(provider_name, model, prompt, kwargs)
         return None
 
-    def execute_text_generation(self, prompt: str, model: str, **kwargs) -> (str, str):
-        provider = self._find_provider_for_capability('text')
-        if not provider:
-            raise RuntimeError("No provider available for text generation.")
-        generated_text = provider.generate_text(prompt=prompt, model=model, **kwargs)
-        provider_name = provider.__class__.__name__
-        return generated_text, provider_name
-
-    def execute_image_generation(self, prompt: str, model: str, **kwargs) -> Optional[str]:
-        provider = self._find_provider_for_capability('image')
-        if not provider:
-            raise RuntimeError("No provider available for image generation.")
-        return provider.generate_image(prompt=prompt, model=model, **kwargs)
+    def _raise_unavailable(self, task: str, last_error: Optional[Exception]):
+        if isinstance(last_error, RateLimitExceeded):
+            # Todos los proveedores capaces estaban sin cupo: es un 429, no un fallo.
+            raise last_error
+        if last_error is None:
+            raise RuntimeError(f"No provider available for {task}.")
+        raise RuntimeError(f"All providers failed for {task}: {last_error}") from last_error
+
+    def provider_health(self) -> dict:
+        return {health.name: health.stats() for health in self.health.values()}
+
+    def _estimate_tokens(self, prompts: List[str]) -> int:
+        completion_tokens = get_rate_limit_settings()['ESTIMATED_COMPLETION_TOKENS']
+        return sum(estimate_tokens(prompt, completion_tokens) for prompt in prompts)
+
+    def _call_provider(self, provider: AIBaseProvider, generate, prompts: List[str] = ()):
+        """
+        Ejecuta generate() contra el proveedor, respetando y alimentando su
+        circuit breaker y consumiendo el cupo del proveedor (rate_limit.py) para
+        `prompts`; el del tenant lo toma antes _TenantQuota, una vez por
+        petición. Devuelve (resultado, latencia en segundos).
+        """
+        health = self._health_for(provider)
+        if not health.acquire():
+            raise _BreakerOpen()
+        try:
+            lease = rate_limiter.acquire(
+                None, provider.__class__.__name__, self._estimate_tokens(prompts), requests=len(prompts)
+            )
+        except BaseException:
+            # Sin cupo o cancelada (el cliente ASGI se desconectó): la llamada
+            # no llegó al proveedor, pero el permiso de prueba debe devolverse.
+            health.release()
+            raise
+        started = time.monotonic()
+        try:
+            result = generate()
+        except Exception:
+            health.record_failure(time.monotonic() - started)
+            raise
+        except BaseException:
+            # Una cancelación no dice nada de la salud del proveedor.
+            health.release()
+            raise
+        finally:
+            lease.release()
+        latency = time.monotonic() - started
+        health.record_success(latency)
+        return result, latency
+
+    async def _acall_provider(self, provider: AIBaseProvider, agenerate, prompts: List[str] = ()):
+        health = self._health_for(provider)
+        if not health.acquire():
+            raise _BreakerOpen()
+        try:
+            lease = await rate_limiter.aacquire(
+                None, provider.__class__.__name__, self._estimate_tokens(prompts), requests=len(prompts)
+            )
+        except BaseException:
+            # Sin cupo o cancelada (el cliente ASGI se desconectó): la llamada
+            # no llegó al proveedor, pero el permiso de prueba debe devolverse.
+            health.release()
+            raise
+        started = time.monotonic()
+        try:
+            result = await agenerate()
+        except Exception:
+            health.record_failure(time.monotonic() - started)
+            raise
+        except BaseException:
+            # Una cancelación no dice nada de la salud del proveedor.
+            health.release()
+            raise
+        finally:
+            await lease.arelease()
+        latency = time.monotonic() - started
+        health.record_success(latency)
+        return result, latency
+
+    def execute_text_generation(self, prompt: str, model: str, use_cache: bool = True, tenant_id=None, **kwargs) -> Tuple[str, str, TokenUsage]:
+        """
+        Genera texto con el proveedor más sano disponible y, si falla, con el
+        siguiente. Devuelve (texto, nombre del proveedor que respondió, consumo).
+
+        Las respuestas se cachean por (proveedor, modelo, prompt normalizado,
+        kwargs) y las llamadas concurrentes con la misma clave comparten una
+        única llamada al proveedor (single_flight.py). use_cache=False fuerza
+        una generación nueva (ej. cuando se quiere otra variante del mismo prompt).
+        Una respuesta de la caché o de otra llamada en curso no consume tokens.
+        """
+        spend_guard.check(tenant_id)
+        last_error = None
+        with _TenantQuota(tenant_id) as quota:
+            for provider in self._candidates('text'):
+                provider_name = provider.__class__.__name__
+                cache_key = self._cache_key(provider_name, model, prompt, kwargs, use_cache)
+                if cache_key:
+                    cached_text = response_cache.get(cache_key)
+                    if cached_text is not None:
+                        return cached_text, provider_name, TokenUsage.from_cache()
+
+                quota.take(self._estimate_tokens([prompt]))
+                # Solo la llamada que llega al proveedor deja aquí su consumo.
+                outcome = {}
+
+                def generate():
+                    (text, usage), latency = self._call_provider(
+                        provider, lambda: provider.generate_text_with_usage(prompt=prompt, model=model, **kwargs),
+                        prompts=[prompt],
+                    )
+                    if cache_key and text:
+                        response_cache.set(cache_key, text)
+                    outcome['usage'] = usage.with_latency(latency)
+                    return text
+
+                try:
+                    generated_text = single_flight.do(cache_key, generate, response_cache.peek) if cache_key else generate()
+                except _BreakerOpen:
+                    continue
+                except RuntimeError as e:
+                    last_error = e
+                    continue
+                return generated_text, provider_name, outcome.get('usage') or TokenUsage.from_cache()
+        self._raise_unavailable('text generation', last_error)
+
+    async def aexecute_text_generation(self, prompt: str, model: str, use_cache: bool = True, tenant_id=None, **kwargs) -> Tuple[str, str, TokenUsage]:
+        """Versión async de execute_text_generation, para las vistas servidas bajo ASGI."""
+        await spend_guard.acheck(tenant_id)
+        last_error = None
+        async with _TenantQuota(tenant_id) as quota:
+            for provider in self._candidates('text'):
+                provider_name = provider.__class__.__name__
+                cache_key = self._cache_key(provider_name, model, prompt, kwargs, use_cache)
+                if cache_key:
+                    cached_text = await response_cache.aget(cache_key)
+                    if cached_text is not None:
+                        return cached_text, provider_name, TokenUsage.from_cache()
+
+                await quota.atake(self._estimate_tokens([prompt]))
+                outcome = {}
+
+                async def agenerate():
+                    (text, usage), latency = await self._acall_provider(
+                        provider, lambda: provider.agenerate_text_with_usage(prompt=prompt, model=model, **kwargs),
+                        prompts=[prompt],
+                    )
+                    if cache_key and text:
+                        await response_cache.aset(cache_key, text)
+                    outcome['usage'] = usage.with_latency(latency)
+                    return text
+
+                try:
+                    if cache_key:
+                        generated_text = await single_flight.ado(cache_key, agenerate, response_cache.apeek)
+                    else:
+                        generated_text = await agenerate()
+                except _BreakerOpen:
+                    continue
+                except RuntimeError as e:
+                    last_error = e
+                    continue
+                return generated_text, provider_name, outcome.get('usage') or TokenUsage.from_cache()
+        self._raise_unavailable('text generation', last_error)
+
+    def execute_text_generation_batch(self, prompts: List[str], model: str, use_cache: bool = True, tenant_id=None, **kwargs) -> List[BatchItem]:
+        """
+        Genera un texto por prompt en una sola llamada al proveedor
+        (generate_text_batch). Devuelve un BatchItem por prompt, en el mismo
+        orden. Los aciertos de caché y los prompts repetidos dentro del lote no
+        se envían al proveedor; los elementos que fallan se reintentan con el
+        siguiente proveedor sano, y los que fallan en todos llevan su error.
+        El consumo de cada elemento se estima a partir de su texto (las APIs por
+        lotes no lo desglosan) y la latencia es la del lote completo.
+        """
+        spend_guard.check(tenant_id)
+        items = [BatchItem() for _ in prompts]
+        pending = list(range(len(prompts)))
+        last_error = None
+
+        with _TenantQuota(tenant_id) as quota:
+            for provider in self._candidates('text'):
+                if not pending:
+                    break
+                provider_name = provider.__class__.__name__
+
+                # Agrupa por clave de caché (o por prompt sin caché) para no generar dos veces lo mismo.
+                groups = {}
+                for index in pending:
+                    cache_key = self._cache_key(provider_name, model, prompts[index], kwargs, use_cache)
+                    cached_text = response_cache.get(cache_key) if cache_key else None
+                    if cached_text is not None:
+                        items[index] = BatchItem(text=cached_text, provider_name=provider_name, usage=TokenUsage.from_cache())
+                    else:
+                        groups.setdefault(cache_key or prompts[index], (cache_key, prompts[index], []))[2].append(index)
+                pending = []
+                if not groups:
+                    break
+
+                batch = list(groups.values())
+                batch_prompts = [prompt for _, prompt, _ in batch]
+
+                def generate():
+                    outputs = provider.generate_text_batch(batch_prompts, model=model, **kwargs)
+                    if all(isinstance(output, Exception) for output in outputs):
+                        error = outputs[0]
+                        # Igual que con una llamada simple: cualquier fallo del lote pasa al siguiente proveedor.
+                        if isinstance(error, RuntimeError):
+                            raise error
+                        raise RuntimeError(str(error)) from error
+                    return outputs
+
+                # El reintento con otro proveedor solo lleva los elementos fallidos: el cupo del tenant ya está tomado.
+                quota.take(self._estimate_tokens(batch_prompts), requests=len(batch_prompts))
+                try:
+                    outputs, latency = self._call_provider(provider, generate, prompts=batch_prompts)
+                except _BreakerOpen:
+                    pending = sorted(index for _, _, indexes in batch for index in indexes)
+                    continue
+                except RuntimeError as e:
+                    last_error = e
+                    pending = sorted(index for _, _, indexes in batch for index in indexes)
+                    continue
+
+                for (cache_key, prompt, indexes), output in zip(batch, outputs):
+                    if isinstance(output, Exception):
+                        last_error = output
+                        pending.extend(indexes)
+                        continue
+                    if cache_key and output:
+                        response_cache.set(cache_key, output)
+                    # Los repetidos del lote comparten la generación del primero.
+                    usage = TokenUsage.estimate(prompt, output, latency)
+                    for position, index in enumerate(indexes):
+                        items[index] = BatchItem(
+                            text=output, provider_name=provider_name, usage=usage if position == 0 else TokenUsage.from_cache()
+                        )
+                pending.sort()
+
+        for index in pending:
+            items[index].error = str(last_error) if last_error else "No provider available for text generation."
+        return items
+
+    def stream_text_generation(self, prompt: str, model: str, use_cache: bool = True, tenant_id=None, **kwargs) -> Tuple[Iterator[str], str]:
+        """
+        Igual que execute_text_generation pero devuelve un iterador de fragmentos.
+        Prefiere proveedores con 'text_stream'; los que solo tienen 'text' emiten
+        un único fragmento. El primer fragmento se pide aquí, así un proveedor
+        caído se sustituye antes de empezar a responder; un fallo a mitad del
+        stream ya no puede cambiar de proveedor y se propaga al consumidor.
+        Una respuesta cacheada se emite de una vez y un stream completo se
+        guarda en la caché. El consumo lo estima quien consume el stream (ver
+        TokenUsage.estimate), que es quien conoce el texto final.
+        """
+        spend_guard.check(tenant_id)
+        streaming = self._candidates('text_stream')
+        candidates = streaming + [provider for provider in self._candidates('text') if provider not in streaming]
+
+        last_error = None
+        quota = _TenantQuota(tenant_id)
+        streaming_quota = False
+        try:
+            for provider in candidates:
+                provider_name = provider.__class__.__name__
+                cache_key = self._cache_key(provider_name, model, prompt, kwargs, use_cache)
+                if cache_key:
+                    cached_text = response_cache.get(cache_key)
+                    if cached_text is not None:
+                        return iter([cached_text]), provider_name
+
+                tokens = self._estimate_tokens([prompt])
+                quota.take(tokens)
+                health = self._health_for(provider)
+                if not health.acquire():
+                    continue
+                try:
+                    lease = rate_limiter.acquire(None, provider_name, tokens)
+                except RateLimitExceeded as e:
+                    health.release()
+                    last_error = e
+                    continue
+                started = time.monotonic()
+                stream = provider.stream_text(prompt=prompt, model=model, **kwargs)
+                try:
+                    first_chunk = next(stream, None)
+                except Exception as e:
+                    lease.release()
+                    health.record_failure(time.monotonic() - started)
+                    if not isinstance(e, RuntimeError):
+                        raise
+                    last_error = e
+                    continue
+                # Para un stream la latencia relevante es la del primer fragmento.
+                health.record_success(time.monotonic() - started)
+                # El cupo del tenant se mantiene hasta que acaba el stream.
+                leases = (lease, quota)
+                chunks = self._stream_and_cache(health, leases, first_chunk, stream, cache_key)
+                # Si el iterador se descarta sin consumirse, el hueco de concurrencia se libera igual.
+                weakref.finalize(chunks, self._release_all, leases)
+                streaming_quota = True
+                return chunks, provider_name
+            self._raise_unavailable('text generation', last_error)
+        finally:
+            if not streaming_quota:
+                quota.release()
+
+    @staticmethod
+    def _release_all(leases):
+        for lease in leases:
+            lease.release()
+
+    def _stream_and_cache(self, health, leases, first_chunk, stream, cache_key) -> Iterator[str]:
+        try:
+            if first_chunk is None:
+                return
+            chunks = [first_chunk]
+            yield first_chunk
+            started = time.monotonic()
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            except RuntimeError:
+                health.record_failure(time.monotonic() - started)
+                raise
+            if cache_key:
+                response_cache.set(cache_key, ''.join(chunks))
+        finally:
+            self._release_all(leases)
+
+    def execute_image_generation(self, prompt: str, model: str, tenant_id=None, **kwargs) -> Tuple[Optional[str], str, TokenUsage]:
+        """
+        Genera una imagen con failover. Devuelve (imagen, nombre del proveedor,
+        consumo); del consumo solo se estiman los tokens del prompt.
+        """
+        spend_guard.check(tenant_id)
+        last_error = None
+        with _TenantQuota(tenant_id) as quota:
+            for provider in self._candidates('image'):
+                quota.take(self._estimate_tokens([prompt]))
+                try:
+                    image, latency = self._call_provider(
+                        provider, lambda: provider.generate_image(prompt=prompt, model=model, **kwargs),
+                        prompts=[prompt],
+                    )
+                except _BreakerOpen:
+                    continue
+                except RuntimeError as e:
+                    last_error = e
+                    continue
+                return image, provider.__class__.__name__, TokenUsage.estimate(prompt, '', latency)
+        self._raise_unavailable('image generation', last_error)
+
+    async def aexecute_image_generation(self, prompt: str, model: str, tenant_id=None, **kwargs) -> Tuple[Optional[str], str, TokenUsage]:
+        await spend_guard.acheck(tenant_id)
+        last_error = None
+        async with _TenantQuota(tenant_id) as quota:
+            for provider in self._candidates('image'):
+                await quota.atake(self._estimate_tokens([prompt]))
+                try:
+                    image, latency = await self._acall_provider(
+                        provider, lambda: provider.agenerate_image(prompt=prompt, model=model, **kwargs),
+                        prompts=[prompt],
+                    )
+                except _BreakerOpen:
+                    continue
+                except RuntimeError as e:
+                    last_error = e
+                    continue
+                return image, provider.__class__.__name__, TokenUsage.estimate(prompt, '', latency)
+        self._raise_unavailable('image generation', last_error)
 
 ai_manager = AIManager()
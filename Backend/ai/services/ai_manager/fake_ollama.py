@@ -0,0 +1,136 @@
+# ai/services/ai_manager/fake_ollama.py
+"""
+Servidor HTTP mínimo que imita la API de Ollama (/api/generate), para tests y
+para el benchmark de OllamaProvider (manage.py benchmark_ollama). No debe
+usarse fuera de esos contextos.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como el servidor real
+    # Cabeceras y cuerpo en un solo envío y sin Nagle: si no, el ACK retardado
+    # de TCP añade ~40 ms a cada petición sobre una conexión reutilizada.
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.requests += 1
+            reset = self.server.resets_pending > 0
+            if reset:
+                self.server.resets_pending -= 1
+        if reset:
+            # Cierra la conexión sin responder, como un servidor reiniciado.
+            self.close_connection = True
+            return
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        text = f"echo: {body.get('prompt', '')}"
+        if body.get('stream'):
+            self._send_stream(body.get('model'), text)
+        else:
+            self._send_json({
+                "model": body.get('model'), "response": text, "done": True,
+                # Conteo por palabras: suficiente para comprobar que se propaga.
+                "prompt_eval_count": len(body.get('prompt', '').split()), "eval_count": len(text.split()),
+            })
+
+    def _send_json(self, payload):
+        raw = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _send_stream(self, model, text):
+        """NDJSON con transfer-encoding chunked, una palabra por línea, como Ollama."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = text.split(' ')
+        for index, word in enumerate(words):
+            piece = word if index == len(words) - 1 else f"{word} "
+            self._write_chunk({"model": model, "response": piece, "done": False})
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+        self._write_chunk({"model": model, "response": "", "done": True})
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+
+class _FakeOllamaHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # La cola de listen por defecto (5) rechaza ráfagas de clientes concurrentes.
+    request_queue_size = 128
+
+
+class FakeOllamaServer:
+    """
+    Uso:
+        with FakeOllamaServer(delay=0.01) as server:
+            provider = OllamaProvider(endpoint=server.endpoint)
+    """
+    def __init__(self, delay: float = 0.0, chunk_delay: float = 0.0):
+        self._server = _FakeOllamaHTTPServer(('127.0.0.1', 0), _FakeOllamaHandler)
+        self._server.lock = threading.Lock()
+        self._server.connections = 0
+        self._server.requests = 0
+        self._server.resets_pending = 0
+        self._server.delay = delay
+        self._server.chunk_delay = chunk_delay
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def reset_next(self, count: int = 1):
+        """Las próximas `count` peticiones se cortan sin respuesta."""
+        with self._server.lock:
+            self._server.resets_pending += count
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
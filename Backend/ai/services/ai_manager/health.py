@@ -0,0 +1,117 @@
+# ai/services/ai_manager/health.py
+"""
+Salud de los proveedores de IA.
+
+Cada proveedor lleva una ventana de las últimas llamadas (latencia y éxito) y
+un circuit breaker:
+
+- closed: recibe tráfico normalmente.
+- open: tras FAILURE_THRESHOLD fallos consecutivos deja de recibir tráfico
+  durante OPEN_SECONDS.
+- half_open: pasado ese tiempo se deja pasar una única llamada de prueba; si
+  sale bien el breaker se cierra y si falla vuelve a abrirse.
+
+AIManager ordena los proveedores capaces por latencia esperada (la media de la
+ventana penalizada por su tasa de error) y prueba el siguiente si uno falla.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+DEFAULTS = {
+    'WINDOW': 50,
+    'FAILURE_THRESHOLD': 5,
+    'OPEN_SECONDS': 30,
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def get_health_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AI_PROVIDER_HEALTH', {})}
+
+
+class ProviderHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._samples = deque(maxlen=get_health_settings()['WINDOW'])
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def acquire(self) -> bool:
+        """
+        True si el proveedor puede recibir esta llamada. En half_open solo la
+        primera llamada obtiene permiso; las demás esperan al resultado de la prueba.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < get_health_settings()['OPEN_SECONDS']:
+                    return False
+                self.state = HALF_OPEN
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release(self):
+        """Devuelve el permiso de acquire sin registrar muestra (la llamada no llegó a hacerse)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._samples.append((latency, True))
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, latency: float):
+        config = get_health_settings()
+        with self._lock:
+            self._samples.append((latency, False))
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= config['FAILURE_THRESHOLD']:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def expected_latency(self) -> float:
+        """
+        Latencia media dividida por la tasa de éxito: un proveedor rápido que
+        falla la mitad de las veces cuesta, en promedio, el doble. Sin muestras
+        vale 0, así un proveedor nuevo recibe tráfico y se mide.
+        """
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            successes = sum(1 for _, ok in self._samples if ok)
+            mean_latency = sum(latency for latency, _ in self._samples) / len(self._samples)
+            return mean_latency / max(successes / len(self._samples), 0.05)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+            state, consecutive_failures = self.state, self.consecutive_failures
+        latencies = sorted(latency for latency, _ in samples)
+        return {
+            'state': state,
+            'consecutive_failures': consecutive_failures,
+            'calls': len(samples),
+            'error_rate': round(sum(1 for _, ok in samples if not ok) / len(samples), 3) if samples else 0.0,
+            'p50_latency': round(latencies[len(latencies) // 2], 4) if latencies else None,
+            'expected_latency': round(self.expected_latency(), 4),
+        }
@@ -1,15 +1,29 @@
 # ai/services/ai_manager/providers/dummy_provider.py
 from ..ai_base_provider import AIBaseProvider
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 class DummyProvider(AIBaseProvider):
     @property
     def capabilities(self) -> List[str]:
-        return ["text", "image"]
+        return ["text", "text_stream", "image"]
 
     def generate_text(self, prompt: str, model: str, **kwargs) -> str:
         return f"Dummy text for prompt: {prompt}"
 
+    def generate_text_batch(self, prompts: List[str], model: str, **kwargs) -> List[str]:
+        return [self.generate_text(prompt=prompt, model=model, **kwargs) for prompt in prompts]
+
+    async def agenerate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return self.generate_text(prompt=prompt, model=model, **kwargs)
+
+    def stream_text(self, prompt: str, model: str, **kwargs) -> Iterator[str]:
+        words = self.generate_text(prompt=prompt, model=model, **kwargs).split(' ')
+        for index, word in enumerate(words):
+            yield word if index == len(words) - 1 else f"{word} "
+
     def generate_image(self, prompt: str, model: str, **kwargs) -> Optional[str]:
         # This provider doesn't generate real images, so it returns None.
         return None
+
+    async def agenerate_image(self, prompt: str, model: str, **kwargs) -> Optional[str]:
+        return None
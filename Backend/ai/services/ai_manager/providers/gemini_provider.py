@@ -1,7 +1,8 @@
 # ai/services/ai_manager/providers/gemini_provider.py
 import google.generativeai as genai
 from ..ai_base_provider import AIBaseProvider
-from typing import Optional, Literal
+from ..usage import TokenUsage
+from typing import Optional, Literal, Tuple
 
 class GeminiProvider(AIBaseProvider):
     """
@@ -20,11 +21,33 @@ class GeminiProvider(AIBaseProvider):
             raise ValueError("Google Gemini API key is required.")
         genai.configure(api_key=api_key)
 
+    @staticmethod
+    def _text_and_usage(prompt: str, response) -> Tuple[str, TokenUsage]:
+        metadata = getattr(response, 'usage_metadata', None)
+        if not metadata or not metadata.prompt_token_count:
+            return response.text, TokenUsage.estimate(prompt, response.text)
+        return response.text, TokenUsage(metadata.prompt_token_count, metadata.candidates_token_count)
+
     def generate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return self.generate_text_with_usage(prompt=prompt, model=model, **kwargs)[0]
+
+    def generate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
         try:
             model_instance = genai.GenerativeModel(model)
             response = model_instance.generate_content(prompt)
-            return response.text
+            return self._text_and_usage(prompt, response)
+        except Exception as e:
+            print(f"Error generating text with Gemini: {e}")
+            raise RuntimeError("Failed to generate text using Gemini.") from e
+
+    async def agenerate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return (await self.agenerate_text_with_usage(prompt=prompt, model=model, **kwargs))[0]
+
+    async def agenerate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
+        try:
+            model_instance = genai.GenerativeModel(model)
+            response = await model_instance.generate_content_async(prompt)
+            return self._text_and_usage(prompt, response)
         except Exception as e:
             print(f"Error generating text with Gemini: {e}")
             raise RuntimeError("Failed to generate text using Gemini.") from e
@@ -46,3 +69,21 @@ class GeminiProvider(AIBaseProvider):
         except Exception as e:
             print(f"Error generating image with Gemini: {e}")
             raise RuntimeError("Failed to generate image using Gemini.") from e
+
+    async def agenerate_image(
+        self,
+        prompt: str,
+        model: str,
+        size: Optional[Literal['256x256', '512x512', '1024x1024']] = None,
+        **kwargs
+    ) -> Optional[str]:
+        try:
+            model_instance = genai.GenerativeModel(model)
+            response = await model_instance.generate_content_async(f"Generate an image of: {prompt}")
+            if response.text.startswith("data:image"):
+                return response.text
+            return None
+        except Exception as e:
+            print(f"Error generating image with Gemini: {e}")
+            raise RuntimeError("Failed to generate image using Gemini.") from e
+
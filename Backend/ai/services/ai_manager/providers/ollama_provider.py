@@ -1,37 +1,179 @@
 # ai/services/ai_manager/providers/ollama_provider.py
+import asyncio
+import json
+import weakref
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 from ..ai_base_provider import AIBaseProvider
-from typing import Optional, Literal
+from ..usage import TokenUsage, approx_tokens
+from typing import Iterator, Optional, Literal, Tuple
+
+
+class _ConnectionRetry(Retry):
+    """
+    Reintenta fallos de conexión (handshake rechazado, conexión keep-alive
+    cerrada por el servidor) incluso en POST, pero nunca un timeout de lectura:
+    la generación puede seguir en curso y repetirla duplicaría el trabajo.
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError):
+            raise error
+        return super().increment(method, url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+
 
 class OllamaProvider(AIBaseProvider):
     """
     Proveedor de IA para un servidor local de Ollama.
+    Reutiliza conexiones a través de una sesión con pool propia del proveedor.
+    Las variantes async usan un httpx.AsyncClient por event loop, con su propio
+    límite de conexiones (mucho mayor: no hay un hilo detrás de cada una).
     """
- 
-    _capabilities = ["text"]
+
+    _capabilities = ["text", "text_stream"]
+
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_CONNECT_TIMEOUT = 3.05
+    DEFAULT_READ_TIMEOUT = 120.0
+    DEFAULT_MAX_RETRIES = 2
+    DEFAULT_ASYNC_POOL_SIZE = 100
 
     @property
     def capabilities(self) -> list[str]:
         return self._capabilities
 
- 
-    def __init__(self, endpoint: str):
+
+    def __init__(
+        self,
+        endpoint: str,
+        pool_size: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        async_pool_size: Optional[int] = None,
+    ):
         if not endpoint:
             raise ValueError("Ollama endpoint is required.")
-        self.endpoint = f"{endpoint}/api"
+        self.endpoint = f"{endpoint.rstrip('/')}/api"
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else self.DEFAULT_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else self.DEFAULT_READ_TIMEOUT,
+        )
+        retries = max_retries if max_retries is not None else self.DEFAULT_MAX_RETRIES
+        pool_size = pool_size or self.DEFAULT_POOL_SIZE
+        self.max_retries = retries
+        # Ollama no tiene API de lotes: el reparto en hilos no debe exceder el pool.
+        self.batch_concurrency = pool_size
+        self.async_pool_size = async_pool_size or self.DEFAULT_ASYNC_POOL_SIZE
+        # Un cliente httpx no puede reutilizar conexiones entre event loops.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,  # un único host
+            pool_maxsize=pool_size,
+            pool_block=False,
+            max_retries=_ConnectionRetry(
+                total=retries, connect=retries, read=retries, status=0,
+                allowed_methods=frozenset({'POST'}), backoff_factor=0.1, raise_on_status=False,
+            ),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path: str, payload: dict) -> dict:
+        response = self.session.post(f"{self.endpoint}/{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.timeout
+            client = httpx.AsyncClient(
+                base_url=self.endpoint,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.async_pool_size),
+                # httpx solo reintenta fallos de conexión, nunca un timeout de lectura.
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _apost(self, path: str, payload: dict) -> dict:
+        response = await self._async_client().post(f"/{path}", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def _text_and_usage(prompt: str, data: dict) -> Tuple[str, TokenUsage]:
+        """
+        Ollama informa prompt_eval_count y eval_count; el primero falta cuando
+        el prompt ya estaba en su caché de contexto.
+        """
+        text = data.get("response", "")
+        if "eval_count" not in data:
+            return text, TokenUsage.estimate(prompt, text)
+        return text, TokenUsage(data.get("prompt_eval_count", approx_tokens(prompt)), data["eval_count"])
 
     def generate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return self.generate_text_with_usage(prompt=prompt, model=model, **kwargs)[0]
+
+    def generate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
+        try:
+            return self._text_and_usage(prompt, self._post("generate", {"model": model, "prompt": prompt, "stream": False}))
+        except requests.exceptions.RequestException as e:
+            print(f"Error generating text with Ollama: {e}")
+            raise RuntimeError("Failed to generate text using Ollama.") from e
+
+    async def agenerate_text(self, prompt: str, model: str, **kwargs) -> str:
+        return (await self.agenerate_text_with_usage(prompt=prompt, model=model, **kwargs))[0]
+
+    async def agenerate_text_with_usage(self, prompt: str, model: str, **kwargs) -> Tuple[str, TokenUsage]:
         try:
-            response = requests.post(
+            return self._text_and_usage(prompt, await self._apost("generate", {"model": model, "prompt": prompt, "stream": False}))
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error generating text with Ollama: {e}")
+            raise RuntimeError("Failed to generate text using Ollama.") from e
+
+    def stream_text(self, prompt: str, model: str, **kwargs) -> Iterator[str]:
+        """Lee la respuesta NDJSON de Ollama y emite cada fragmento en cuanto llega."""
+        try:
+            response = self.session.post(
                 f"{self.endpoint}/generate",
-                json={"model": model, "prompt": prompt, "stream": False},
+                json={"model": model, "prompt": prompt, "stream": True},
+                timeout=self.timeout,
+                stream=True,
             )
             response.raise_for_status()
-            return response.json().get("response", "")
         except requests.exceptions.RequestException as e:
             print(f"Error generating text with Ollama: {e}")
             raise RuntimeError("Failed to generate text using Ollama.") from e
 
+        with response:
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError as e:
+                        # Una línea corrupta es un fallo del proveedor: RuntimeError para que haya failover.
+                        raise RuntimeError("Ollama returned a malformed stream line.") from e
+                    if data.get("error"):
+                        raise RuntimeError(f"Ollama stream failed: {data['error']}")
+                    if data.get("response"):
+                        yield data["response"]
+                    # Tras 'done' se sigue leyendo hasta el final del cuerpo:
+                    # una respuesta leída a medias no puede volver al pool.
+            except requests.exceptions.RequestException as e:
+                print(f"Error streaming text with Ollama: {e}")
+                raise RuntimeError("Failed to generate text using Ollama.") from e
+
     def generate_image(
         self,
         prompt: str,
@@ -41,15 +183,39 @@ class OllamaProvider(AIBaseProvider):
     ) -> Optional[str]:
         print(f"Conceptual implementation for Ollama image generation with model {model}.")
         try:
-            response = requests.post(
-                f"{self.endpoint}/generate",
-                json={"model": model, "prompt": f"Generate an image of: {prompt}", "stream": False},
-            )
-            response.raise_for_status()
-            images = response.json().get("images")
+            images = self._post(
+                "generate", {"model": model, "prompt": f"Generate an image of: {prompt}", "stream": False}
+            ).get("images")
             if images and isinstance(images, list) and len(images) > 0:
                 return f"data:image/jpeg;base64,{images[0]}"
             return None
         except requests.exceptions.RequestException as e:
             print(f"Error generating image with Ollama: {e}")
             raise RuntimeError("Failed to generate image using Ollama.") from e
+
+    async def agenerate_image(
+        self,
+        prompt: str,
+        model: str,
+        size: Optional[Literal['256x256', '512x512', '1024x1024']] = None,
+        **kwargs
+    ) -> Optional[str]:
+        try:
+            images = (await self._apost(
+                "generate", {"model": model, "prompt": f"Generate an image of: {prompt}", "stream": False}
+            )).get("images")
+            if images and isinstance(images, list) and len(images) > 0:
+                return f"data:image/jpeg;base64,{images[0]}"
+            return None
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error generating image with Ollama: {e}")
+            raise RuntimeError("Failed to generate image using Ollama.") from e
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        """Cierra el cliente async del event loop actual."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
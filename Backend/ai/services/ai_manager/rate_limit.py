@@ -0,0 +1,365 @@
+# ai/services/ai_manager/rate_limit.py
+"""
+Límites de uso de los proveedores de IA por tenant y por proveedor.
+
+Cada llamada consume de varios token buckets a la vez (todo o nada):
+
+- tenant: peticiones/minuto y tokens/minuto del tenant, más un máximo de
+  llamadas simultáneas.
+- proveedor: peticiones/minuto y tokens/minuto del proveedor para todo el
+  sistema (la cuota contratada con Gemini, por ejemplo).
+
+Los tokens de una llamada se estiman antes de hacerla (ver estimate_tokens).
+AIManager toma el cupo del tenant una vez por petición, antes de unirse a una
+generación idéntica en curso y sin repetirlo al cambiar de proveedor (ver
+_TenantQuota en ai_manager.py), y el del proveedor en cada llamada que llega
+al proveedor.
+
+El estado vive en Redis si AI_RATE_LIMITS['SHARED_ALIAS'] apunta a un alias con
+RedisCache (un script Lua descuenta todos los buckets atómicamente); con otro
+backend, o si Redis no responde, se usa la memoria del proceso. Desde código
+async (aacquire, Lease.arelease) las llamadas a Redis se hacen en otro hilo.
+
+En modo 'reject' una llamada sin cupo lanza RateLimitExceeded al instante; en
+modo 'wait' espera a que haya cupo hasta MAX_WAIT segundos.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MODE': 'reject',  # 'reject' | 'wait'
+    'MAX_WAIT': 10,
+    'SHARED_ALIAS': 'default',
+    'KEY_PREFIX': 'ai:ratelimit:',
+    'ESTIMATED_COMPLETION_TOKENS': 256,
+    # None en cualquier límite significa sin límite
+    'TENANT': {'REQUESTS_PER_MINUTE': 60, 'TOKENS_PER_MINUTE': 60000, 'MAX_CONCURRENT': 8},
+    'TENANT_OVERRIDES': {},  # {tenant_id: {'REQUESTS_PER_MINUTE': ..., ...}}
+    'PROVIDERS': {},  # {'GeminiProvider': {'REQUESTS_PER_MINUTE': ..., 'TOKENS_PER_MINUTE': ...}}
+}
+
+# Seguro ante procesos que mueren con un hueco de concurrencia tomado
+SLOT_TTL = 300
+
+
+def get_rate_limit_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AI_RATE_LIMITS', {})}
+
+
+def estimate_tokens(prompt: str, completion_tokens: int) -> int:
+    """Estimación previa a la llamada: ~4 caracteres por token más la respuesta esperada."""
+    return max(1, len(prompt or '') // 4) + completion_tokens
+
+
+class RateLimitExceeded(RuntimeError):
+    """
+    Sin cupo. scope es 'tenant', 'provider' o 'budget' (presupuesto diario
+    agotado, ver usage.py); retry_after, los segundos hasta que haya cupo.
+    """
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"AI rate limit exceeded for {scope}; retry in {retry_after:.1f}s.")
+
+    def __reduce__(self):
+        return type(self), (self.scope, self.retry_after)
+
+
+@dataclass(frozen=True)
+class _Bucket:
+    key: str
+    scope: str
+    capacity: float
+    cost: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+            self._slots = {}
+
+    def take(self, buckets: List[_Bucket], now: float):
+        """Descuenta de todos los buckets o de ninguno. Devuelve None o (espera, bucket más limitante)."""
+        with self._lock:
+            levels = []
+            worst = None
+            for bucket in buckets:
+                tokens, stamp = self._buckets.get(bucket.key, (bucket.capacity, now))
+                tokens = min(bucket.capacity, tokens + max(0.0, now - stamp) * bucket.rate)
+                levels.append(tokens)
+                if tokens < bucket.cost:
+                    wait = (bucket.cost - tokens) / bucket.rate
+                    if worst is None or wait > worst[0]:
+                        worst = (wait, bucket)
+            if worst is not None:
+                return worst
+            for bucket, tokens in zip(buckets, levels):
+                self._buckets[bucket.key] = (tokens - bucket.cost, now)
+            return None
+
+    def acquire_slot(self, key: str, limit: int) -> bool:
+        with self._lock:
+            if self._slots.get(key, 0) >= limit:
+                return False
+            self._slots[key] = self._slots.get(key, 0) + 1
+            return True
+
+    def release_slot(self, key: str):
+        with self._lock:
+            self._slots[key] = max(0, self._slots.get(key, 0) - 1)
+
+
+class RedisBackend:
+    # Devuelve '' si concede, o 'espera|índice del bucket más limitante'.
+    TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local worst_wait, worst_index = -1, 0
+for i, key in ipairs(KEYS) do
+  local capacity, cost = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+  local rate = capacity / 60
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or capacity
+  local stamp = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - stamp) * rate)
+  levels[i] = tokens
+  if tokens < cost and (cost - tokens) / rate > worst_wait then
+    worst_wait, worst_index = (cost - tokens) / rate, i
+  end
+end
+if worst_index > 0 then
+  return tostring(worst_wait) .. '|' .. worst_index
+end
+for i, key in ipairs(KEYS) do
+  local capacity, cost = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+  redis.call('EXPIRE', key, 61)
+end
+return ''
+"""
+
+    def __init__(self, cache: RedisCache):
+        self._cache = cache
+        self._script = None
+
+    def _client(self):
+        return self._cache._cache.get_client(write=True)
+
+    def take(self, buckets: List[_Bucket], now: float):
+        client = self._client()
+        if self._script is None:
+            self._script = client.register_script(self.TAKE_SCRIPT)
+        args = [now]
+        for bucket in buckets:
+            args.extend([bucket.capacity, bucket.cost])
+        result = self._script(keys=[bucket.key for bucket in buckets], args=args, client=client)
+        if not result:
+            return None
+        wait, index = (result.decode() if isinstance(result, bytes) else result).split('|')
+        return float(wait), buckets[int(index) - 1]
+
+    def acquire_slot(self, key: str, limit: int) -> bool:
+        client = self._client()
+        count = client.incr(key)
+        client.expire(key, SLOT_TTL)
+        if count > limit:
+            client.decr(key)
+            return False
+        return True
+
+    def release_slot(self, key: str):
+        self._client().decr(key)
+
+
+class Lease:
+    """Cupo concedido; release() libera el hueco de concurrencia del tenant."""
+    def __init__(self, limiter=None, slot_key: Optional[str] = None):
+        self._limiter = limiter
+        self._slot_key = slot_key
+
+    def release(self):
+        if self._slot_key is not None:
+            self._limiter._release_slot(self._slot_key)
+            self._slot_key = None
+
+    async def arelease(self):
+        if self._slot_key is not None:
+            slot_key, self._slot_key = self._slot_key, None
+            await self._limiter._arelease_slot(slot_key)
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.memory = MemoryBackend()
+        self._redis = {}
+        self.reset_stats()
+
+    def reset(self):
+        self.memory.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {
+                'allowed': 0,
+                'rejected': {'tenant': 0, 'provider': 0},
+                'waited': 0,
+                'wait_seconds': 0.0,
+                'shared_backend_errors': 0,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'rejected': dict(self._stats['rejected'])}
+
+    def _count(self, field: str, amount=1, scope: Optional[str] = None):
+        with self._lock:
+            if scope is None:
+                self._stats[field] += amount
+            else:
+                self._stats[field][scope] += amount
+
+    def _backend(self, config):
+        alias = config['SHARED_ALIAS']
+        cache = caches[alias] if alias else None
+        if not isinstance(cache, RedisCache):
+            return self.memory
+        backend = self._redis.get(alias)
+        if backend is None:
+            backend = self._redis.setdefault(alias, RedisBackend(cache))
+        return backend
+
+    def _call_backend(self, config, method: str, *args):
+        backend = self._backend(config)
+        try:
+            return getattr(backend, method)(*args)
+        except Exception as e:
+            if backend is self.memory:
+                raise
+            # Sin Redis se sigue limitando, aunque solo dentro de este proceso.
+            logger.warning(f"AI rate limit shared backend unavailable, using process memory: {e}")
+            self._count('shared_backend_errors')
+            return getattr(self.memory, method)(*args)
+
+    def _tenant_limits(self, config, tenant_id) -> dict:
+        return {**config['TENANT'], **config['TENANT_OVERRIDES'].get(tenant_id, {})}
+
+    def _buckets(self, config, tenant_id, provider_name, tokens, requests) -> List[_Bucket]:
+        prefix = config['KEY_PREFIX']
+        scopes = []
+        if tenant_id is not None:
+            scopes.append(('tenant', f"{prefix}tenant:{tenant_id}", self._tenant_limits(config, tenant_id)))
+        provider_limits = config['PROVIDERS'].get(provider_name)
+        if provider_limits:
+            scopes.append(('provider', f"{prefix}provider:{provider_name}", provider_limits))
+
+        buckets = []
+        for scope, key, limits in scopes:
+            for name, cost in (('REQUESTS_PER_MINUTE', requests), ('TOKENS_PER_MINUTE', tokens)):
+                capacity = limits.get(name)
+                if capacity:
+                    # Una llamada mayor que el bucket entero pasa cuando está lleno.
+                    buckets.append(_Bucket(f"{key}:{name.lower()}", scope, float(capacity), float(min(cost, capacity))))
+        return buckets
+
+    def _try_acquire(self, config, tenant_id, provider_name, tokens, requests):
+        """Devuelve (Lease, None) o (None, (espera, scope))."""
+        slot_key = None
+        max_concurrent = self._tenant_limits(config, tenant_id).get('MAX_CONCURRENT') if tenant_id is not None else None
+        if max_concurrent:
+            slot_key = f"{config['KEY_PREFIX']}tenant:{tenant_id}:concurrent"
+            if not self._call_backend(config, 'acquire_slot', slot_key, max_concurrent):
+                # No se sabe cuándo acabará una llamada en curso: se reintenta en breve.
+                return None, (0.25, 'tenant')
+
+        buckets = self._buckets(config, tenant_id, provider_name, tokens, requests)
+        limited = self._call_backend(config, 'take', buckets, time.time()) if buckets else None
+        if limited is not None:
+            if slot_key is not None:
+                self._release_slot(slot_key)
+            wait, bucket = limited
+            return None, (wait, bucket.scope)
+        self._count('allowed')
+        return Lease(self, slot_key), None
+
+    def _release_slot(self, slot_key: str):
+        self._call_backend(get_rate_limit_settings(), 'release_slot', slot_key)
+
+    def _blocks(self, config) -> bool:
+        """True si el backend hace E/S de red (Redis): desde async se llama en otro hilo."""
+        return self._backend(config) is not self.memory
+
+    async def _arelease_slot(self, slot_key: str):
+        if self._blocks(get_rate_limit_settings()):
+            await sync_to_async(self._release_slot, thread_sensitive=False)(slot_key)
+        else:
+            self._release_slot(slot_key)
+
+    def _give_up(self, scope: str, wait: float):
+        self._count('rejected', scope=scope)
+        raise RateLimitExceeded(scope, math.ceil(wait * 10) / 10)
+
+    def acquire(self, tenant_id, provider_name: str, tokens: int, requests: int = 1) -> Lease:
+        config = get_rate_limit_settings()
+        if not config['ENABLED']:
+            return Lease()
+        deadline = time.monotonic() + config['MAX_WAIT']
+        while True:
+            lease, limited = self._try_acquire(config, tenant_id, provider_name, tokens, requests)
+            if lease is not None:
+                return lease
+            wait, scope = limited
+            if config['MODE'] != 'wait' or time.monotonic() + wait > deadline:
+                self._give_up(scope, wait)
+            self._count('waited')
+            self._count('wait_seconds', wait)
+            time.sleep(wait)
+
+    async def aacquire(self, tenant_id, provider_name: str, tokens: int, requests: int = 1) -> Lease:
+        config = get_rate_limit_settings()
+        if not config['ENABLED']:
+            return Lease()
+        deadline = time.monotonic() + config['MAX_WAIT']
+        # El script Lua de Redis es una llamada de red bloqueante: fuera del
+        # event loop, para no frenar al resto de corutinas del proceso.
+        try_acquire = sync_to_async(self._try_acquire, thread_sensitive=False) if self._blocks(config) else None
+        while True:
+            if try_acquire is not None:
+                lease, limited = await try_acquire(config, tenant_id, provider_name, tokens, requests)
+            else:
+                lease, limited = self._try_acquire(config, tenant_id, provider_name, tokens, requests)
+            if lease is not None:
+                return lease
+            wait, scope = limited
+            if config['MODE'] != 'wait' or time.monotonic() + wait > deadline:
+                self._give_up(scope, wait)
+            self._count('waited')
+            self._count('wait_seconds', wait)
+            await asyncio.sleep(wait)
+
+
+# Instancia global usada por AIManager
+rate_limiter = RateLimiter()
@@ -0,0 +1,165 @@
+# ai/services/ai_manager/response_cache.py
+"""
+Caché de respuestas de generación de texto.
+
+La clave es un hash del contenido: (proveedor, modelo, prompt normalizado,
+kwargs de generación). Hay dos niveles:
+
+- local: cachetools.TTLCache en memoria del proceso (expira por TTL y expulsa
+  por LRU al llenarse).
+- compartido: un alias de la caché de Django (AI_RESPONSE_CACHE['SHARED_ALIAS']).
+  En producción apunta a django.core.cache.backends.redis.RedisCache; en
+  desarrollo y tests, al LocMemCache por defecto, que hace de sustituto local.
+"""
+import hashlib
+import json
+import re
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LOCAL_MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 300,
+    'SHARED_ALIAS': 'default',  # None desactiva el nivel compartido
+    'SHARED_TTL': 3600,
+    'KEY_PREFIX': 'ai:text:',
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def get_cache_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AI_RESPONSE_CACHE', {})}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompts que solo difieren en espacios producen la misma clave."""
+    return _WHITESPACE.sub(' ', prompt or '').strip()
+
+
+def make_cache_key(provider_name: str, model: str, prompt: str, generation_kwargs: dict) -> str:
+    material = json.dumps(
+        [provider_name, model, normalize_prompt(prompt), generation_kwargs],
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = None
+        self._local_config = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    def _local_cache(self, config) -> TTLCache:
+        signature = (config['LOCAL_MAX_ENTRIES'], config['LOCAL_TTL'])
+        if self._local is None or self._local_config != signature:
+            self._local = TTLCache(maxsize=config['LOCAL_MAX_ENTRIES'], ttl=config['LOCAL_TTL'])
+            self._local_config = signature
+        return self._local
+
+    def _shared_cache(self, config):
+        return caches[config['SHARED_ALIAS']] if config['SHARED_ALIAS'] else None
+
+    def _get_local(self, config, key: str):
+        with self._lock:
+            value = self._local_cache(config).get(key)
+            if value is not None:
+                self.local_hits += 1
+            return value
+
+    def _record_shared_lookup(self, config, key: str, value):
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._local_cache(config)[key] = value
+        return value
+
+    def get(self, key: str):
+        """Devuelve el texto cacheado o None. Un acierto compartido se copia al nivel local."""
+        config = get_cache_settings()
+        value = self._get_local(config, key)
+        if value is not None:
+            return value
+        shared = self._shared_cache(config)
+        value = shared.get(config['KEY_PREFIX'] + key) if shared is not None else None
+        return self._record_shared_lookup(config, key, value)
+
+    async def aget(self, key: str):
+        """Como get, pero sin bloquear el event loop al consultar el nivel compartido."""
+        config = get_cache_settings()
+        value = self._get_local(config, key)
+        if value is not None:
+            return value
+        shared = self._shared_cache(config)
+        value = await shared.aget(config['KEY_PREFIX'] + key) if shared is not None else None
+        return self._record_shared_lookup(config, key, value)
+
+    def peek(self, key: str):
+        """Como get pero sin contar aciertos ni fallos (para sondeos repetidos)."""
+        config = get_cache_settings()
+        with self._lock:
+            value = self._local_cache(config).get(key)
+        shared = self._shared_cache(config)
+        if value is None and shared is not None:
+            value = shared.get(config['KEY_PREFIX'] + key)
+        return value
+
+    async def apeek(self, key: str):
+        config = get_cache_settings()
+        with self._lock:
+            value = self._local_cache(config).get(key)
+        shared = self._shared_cache(config)
+        if value is None and shared is not None:
+            value = await shared.aget(config['KEY_PREFIX'] + key)
+        return value
+
+    def set(self, key: str, value: str):
+        config = get_cache_settings()
+        with self._lock:
+            self._local_cache(config)[key] = value
+        shared = self._shared_cache(config)
+        if shared is not None:
+            shared.set(config['KEY_PREFIX'] + key, value, timeout=config['SHARED_TTL'])
+
+    async def aset(self, key: str, value: str):
+        config = get_cache_settings()
+        with self._lock:
+            self._local_cache(config)[key] = value
+        shared = self._shared_cache(config)
+        if shared is not None:
+            await shared.aset(config['KEY_PREFIX'] + key, value, timeout=config['SHARED_TTL'])
+
+    def clear_local(self):
+        with self._lock:
+            if self._local is not None:
+                self._local.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.local_hits + self.shared_hits
+            total = hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': round(hits / total, 3) if total else 0.0,
+                'local_size': len(self._local) if self._local is not None else 0,
+            }
+
+
+# Instancia global usada por AIManager
+response_cache = ResponseCache()
@@ -0,0 +1,207 @@
+# ai/services/ai_manager/single_flight.py
+"""
+Single-flight para generaciones idénticas concurrentes.
+
+Mientras una llamada con una clave (la misma clave de la caché de respuestas)
+está en curso, las demás llamadas con esa clave en el proceso no llaman al
+proveedor: esperan a la primera (como mucho WAIT_TIMEOUT; pasado ese tiempo
+llaman ellos mismos) y reciben su resultado o una copia de su error. Hilos y
+corutinas se deduplican por separado (un hilo no puede esperar un Future de
+asyncio ni al revés).
+
+Con SHARED_LOCK activado se deduplica también entre procesos: quien llega
+primero toma un lock en el alias de caché compartido (cache.add es atómico en
+Redis) y el resto de procesos sondean el resultado en la caché de respuestas
+hasta que aparece, el lock se libera o se agota WAIT_TIMEOUT; en los dos
+últimos casos generan ellos mismos.
+"""
+import asyncio
+import copy
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .response_cache import get_cache_settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SHARED_LOCK': False,
+    'LOCK_TIMEOUT': 120,  # segundos; debe superar la latencia máxima del proveedor
+    'POLL_INTERVAL': 0.1,
+    'WAIT_TIMEOUT': 60,
+    'KEY_PREFIX': 'ai:inflight:',
+}
+
+
+def get_single_flight_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AI_SINGLE_FLIGHT', {})}
+
+
+def _follower_error(error: BaseException) -> BaseException:
+    """
+    Copia de la excepción del líder para relanzarla en un seguidor: cada hilo o
+    corutina acumula su propio __traceback__ en vez de mutar el de la instancia
+    compartida. Si no se puede copiar, la envuelve en un RuntimeError.
+    """
+    try:
+        clone = copy.copy(error)
+    except Exception:
+        clone = None
+    if type(clone) is not type(error):
+        clone = RuntimeError(str(error))
+    return clone
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = weakref.WeakKeyDictionary()  # event loop -> {clave: Future}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.leaders = 0
+            self.coalesced = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+    def _shared_cache(self, config):
+        alias = get_cache_settings()['SHARED_ALIAS']
+        return caches[alias] if config['SHARED_LOCK'] and alias else None
+
+    def do(self, key: str, fn, peek_result):
+        """
+        Ejecuta fn() una sola vez por clave entre los hilos concurrentes del
+        proceso. peek_result(clave) consulta la caché de respuestas sin alterar
+        sus estadísticas; se usa para esperar a un líder de otro proceso.
+        """
+        config = get_single_flight_settings()
+        if not config['ENABLED']:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(config['WAIT_TIMEOUT']):
+                # El líder no termina: mejor generar que bloquear el hilo sin límite.
+                return fn()
+            if call.error is not None:
+                raise _follower_error(call.error) from call.error
+            return call.result
+
+        try:
+            call.result = self._run_leader(config, key, fn, peek_result)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_leader(self, config, key, fn, peek_result):
+        shared = self._shared_cache(config)
+        if shared is None:
+            return fn()
+        lock_key = config['KEY_PREFIX'] + key
+        deadline = time.monotonic() + config['WAIT_TIMEOUT']
+        while not shared.add(lock_key, 1, timeout=config['LOCK_TIMEOUT']):
+            # Otro proceso está generando: su resultado acabará en la caché.
+            result = peek_result(key)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return fn()
+            time.sleep(config['POLL_INTERVAL'])
+        try:
+            return fn()
+        finally:
+            shared.delete(lock_key)
+
+    async def ado(self, key: str, coro_fn, apeek_result):
+        """Versión async de do: deduplica las corutinas del mismo event loop."""
+        config = get_single_flight_settings()
+        if not config['ENABLED']:
+            return await coro_fn()
+
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        while key in calls:
+            future = calls[key]
+            with self._lock:
+                self.coalesced += 1
+            # asyncio.wait no cancela el futuro si este seguidor se cancela, y
+            # tampoco relanza la excepción del líder (que mutaría su traceback).
+            done, _ = await asyncio.wait((future,), timeout=config['WAIT_TIMEOUT'])
+            if not done:
+                return await coro_fn()
+            if future.cancelled():
+                # Se canceló el líder: otro toma el relevo.
+                continue
+            error = future.exception()
+            if error is not None:
+                raise _follower_error(error) from error
+            return future.result()
+
+        future = calls[key] = loop.create_future()
+        with self._lock:
+            self.leaders += 1
+        try:
+            result = await self._arun_leader(config, key, coro_fn, apeek_result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Marca la excepción como recuperada si no hay seguidores esperando.
+            future.exception()
+            raise
+        finally:
+            del calls[key]
+
+    async def _arun_leader(self, config, key, coro_fn, apeek_result):
+        shared = self._shared_cache(config)
+        if shared is None:
+            return await coro_fn()
+        lock_key = config['KEY_PREFIX'] + key
+        deadline = time.monotonic() + config['WAIT_TIMEOUT']
+        while not await shared.aadd(lock_key, 1, timeout=config['LOCK_TIMEOUT']):
+            result = await apeek_result(key)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return await coro_fn()
+            await asyncio.sleep(config['POLL_INTERVAL'])
+        try:
+            return await coro_fn()
+        finally:
+            await shared.adelete(lock_key)
+
+
+# Instancia global usada por AIManager
+single_flight = SingleFlight()
@@ -0,0 +1,164 @@
+# ai/services/ai_manager/usage.py
+"""
+Consumo y coste de las llamadas a la IA.
+
+- TokenUsage: tokens de entrada y salida y latencia de una llamada. Los
+  proveedores que informan el conteo real (Gemini, Ollama) lo devuelven desde
+  generate_text_with_usage; para el resto se estima (~4 caracteres por token).
+  Una respuesta servida desde la caché o compartida con otra llamada en curso
+  (single-flight) no consume tokens.
+- Tabla de precios por proveedor y modelo (AI_USAGE['PRICES'], en USD por 1000
+  tokens) para calcular AIInteraction.costo_estimado.
+- SpendGuard: presupuesto diario por tenant. El gasto del día sale de
+  AIUsageDaily (que se actualiza al vaciar el buffer de interacciones) y se
+  cachea BUDGET_CHECK_TTL segundos, así que el corte llega con ese retraso.
+"""
+import datetime
+from dataclasses import dataclass, replace
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.utils import timezone
+
+from .rate_limit import RateLimitExceeded
+
+DEFAULTS = {
+    # {proveedor: {modelo: {'PROMPT_PER_1K': ..., 'COMPLETION_PER_1K': ...}}}; '*' vale para cualquier modelo
+    'PRICES': {
+        'GeminiProvider': {
+            'gemini-1.5-flash': {'PROMPT_PER_1K': '0.000075', 'COMPLETION_PER_1K': '0.0003'},
+            'gemini-1.5-pro': {'PROMPT_PER_1K': '0.00125', 'COMPLETION_PER_1K': '0.005'},
+            '*': {'PROMPT_PER_1K': '0.000075', 'COMPLETION_PER_1K': '0.0003'},
+        },
+        # Ollama corre en infraestructura propia: sin coste por token.
+        'OllamaProvider': {'*': {'PROMPT_PER_1K': '0', 'COMPLETION_PER_1K': '0'}},
+        'DummyProvider': {'*': {'PROMPT_PER_1K': '0', 'COMPLETION_PER_1K': '0'}},
+    },
+    # USD por tenant y día; None desactiva el límite
+    'DAILY_BUDGET': None,
+    'TENANT_BUDGETS': {},  # {tenant_id: USD}
+    'BUDGET_CHECK_TTL': 60,
+    'SHARED_ALIAS': 'default',
+    'KEY_PREFIX': 'ai:spend:',
+}
+
+
+def get_usage_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'AI_USAGE', {})}
+
+
+def approx_tokens(text: str) -> int:
+    return (len(text) + 3) // 4 if text else 0
+
+
+@dataclass(frozen=True)
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: int = 0
+    estimated: bool = False  # el proveedor no informó el conteo
+    cached: bool = False  # no hubo llamada al proveedor
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def estimate(cls, prompt: str, completion: str, latency: float = 0.0) -> 'TokenUsage':
+        return cls(approx_tokens(prompt), approx_tokens(completion), round(latency * 1000), estimated=True)
+
+    @classmethod
+    def from_cache(cls) -> 'TokenUsage':
+        return cls(cached=True)
+
+    def with_latency(self, latency: float) -> 'TokenUsage':
+        return replace(self, latency_ms=round(latency * 1000))
+
+
+def price_for(provider_name: str, model: str) -> Optional[dict]:
+    prices = get_usage_settings()['PRICES'].get(provider_name, {})
+    return prices.get(model) or prices.get('*')
+
+
+def estimate_cost(provider_name: str, model: str, usage: TokenUsage) -> Decimal:
+    """Coste en USD según la tabla de precios; 0 si el modelo no tiene precio."""
+    price = price_for(provider_name, model)
+    if price is None or usage.cached:
+        return Decimal('0')
+    cost = (
+        Decimal(usage.prompt_tokens) * Decimal(str(price.get('PROMPT_PER_1K', 0)))
+        + Decimal(usage.completion_tokens) * Decimal(str(price.get('COMPLETION_PER_1K', 0)))
+    ) / 1000
+    return cost.quantize(Decimal('0.000001'))
+
+
+def _seconds_until_tomorrow() -> float:
+    now = timezone.localtime()
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+    return (tomorrow - now).total_seconds()
+
+
+class SpendGuard:
+    def budget_for(self, config, tenant_id) -> Optional[Decimal]:
+        budget = config['TENANT_BUDGETS'].get(tenant_id, config['DAILY_BUDGET'])
+        return Decimal(str(budget)) if budget is not None else None
+
+    def _key(self, config, tenant_id) -> str:
+        return f"{config['KEY_PREFIX']}{tenant_id}:{timezone.localdate().isoformat()}"
+
+    def _cache(self, config):
+        return caches[config['SHARED_ALIAS']] if config['SHARED_ALIAS'] else None
+
+    def spent_today(self, tenant_id) -> Decimal:
+        AIUsageDaily = apps.get_model('infrastructure', 'AIUsageDaily')
+        spent = AIUsageDaily.objects.filter(
+            tenant_id=tenant_id, fecha=timezone.localdate()
+        ).aggregate(total=Sum('costo'))['total']
+        return spent or Decimal('0')
+
+    def _exceeded(self, budget: Decimal, spent: Decimal):
+        if spent >= budget:
+            raise RateLimitExceeded('budget', _seconds_until_tomorrow())
+
+    def check(self, tenant_id):
+        """Lanza RateLimitExceeded (scope 'budget') si el tenant agotó su presupuesto del día."""
+        config = get_usage_settings()
+        budget = self.budget_for(config, tenant_id) if tenant_id is not None else None
+        if budget is None:
+            return
+        cache, key = self._cache(config), self._key(config, tenant_id)
+        spent = cache.get(key) if cache else None
+        if spent is None:
+            spent = self.spent_today(tenant_id)
+            if cache:
+                cache.set(key, spent, config['BUDGET_CHECK_TTL'])
+        self._exceeded(budget, spent)
+
+    async def acheck(self, tenant_id):
+        config = get_usage_settings()
+        budget = self.budget_for(config, tenant_id) if tenant_id is not None else None
+        if budget is None:
+            return
+        cache, key = self._cache(config), self._key(config, tenant_id)
+        spent = await cache.aget(key) if cache else None
+        if spent is None:
+            spent = await sync_to_async(self.spent_today)(tenant_id)
+            if cache:
+                await cache.aset(key, spent, config['BUDGET_CHECK_TTL'])
+        self._exceeded(budget, spent)
+
+    def invalidate(self, tenant_ids: Iterable):
+        """Olvida el gasto cacheado de estos tenants (tras actualizar AIUsageDaily)."""
+        config = get_usage_settings()
+        cache = self._cache(config)
+        if cache:
+            cache.delete_many([self._key(config, tenant_id) for tenant_id in tenant_ids])
+
+
+# Instancia global usada por AIManager
+spend_guard = SpendGuard()
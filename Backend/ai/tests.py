@@ -1,14 +1,18 @@
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 from infrastructure.models import Tenant, AIInteraction
+from .buffers import ai_interaction_buffer
 
 User = get_user_model()
 
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
 class AITextGenerationTests(APITestCase):
 
     def setUp(self):
+        ai_interaction_buffer.clear()
         self.tenant = Tenant.objects.create(name="Test Tenant")
         # Creamos un segundo tenant para asegurar que no hay ambigüedad
         self.other_tenant = Tenant.objects.create(name="Other Tenant")
@@ -29,12 +33,14 @@ class AITextGenerationTests(APITestCase):
         data = {'prompt': 'Hola mundo'}
 
         # Mockeamos el AIManager para no hacer una llamada real a la IA
+        from .services.ai_manager.usage import TokenUsage
         from .services.ai_manager.ai_manager import ai_manager
         import unittest.mock as mock
 
-        mock_return_value = ("  Respuesta de prueba.  ", "MockedProvider")
-        with mock.patch.object(ai_manager, 'execute_text_generation', return_value=mock_return_value) as mock_execute:
-            response = self.client.post(self.url, data, format='json')
+        mock_return_value = ("  Respuesta de prueba.  ", "MockedProvider", TokenUsage(12, 4, 250))
+        with mock.patch.object(ai_manager, 'aexecute_text_generation', return_value=mock_return_value) as mock_execute:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, data, format='json')
 
             # 1. Verificar que la respuesta de la API es correcta
             self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -42,9 +48,11 @@ class AITextGenerationTests(APITestCase):
             self.assertEqual(response.data['generated_text'], "Respuesta de prueba.") # Verifica la sanitización
 
             # 2. Verificar que se llamó al AIManager
-            mock_execute.assert_called_once_with(prompt='Hola mundo', model='default-text-model')
+            mock_execute.assert_called_once_with(prompt='Hola mundo', model='default-text-model', tenant_id=self.tenant.id)
 
-            # 3. Verificar que la interacción se guardó en la BD
+            # 3. Verificar que la interacción se encoló y se guarda al vaciar el buffer
+            self.assertEqual(AIInteraction.objects.count(), 0)
+            self.assertEqual(ai_interaction_buffer.flush(), 1)
             self.assertEqual(AIInteraction.objects.count(), 1)
             interaction = AIInteraction.objects.first()
             self.assertEqual(interaction.user, self.user)
@@ -72,7 +80,862 @@ class AITextGenerationTests(APITestCase):
         from .services.ai_manager.ai_manager import ai_manager
         import unittest.mock as mock
 
-        with mock.patch.object(ai_manager, 'execute_text_generation', side_effect=RuntimeError("No provider available")):
+        with mock.patch.object(ai_manager, 'aexecute_text_generation', side_effect=RuntimeError("No provider available")):
             response = self.client.post(self.url, data, format='json')
             self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
             self.assertEqual(AIInteraction.objects.count(), 0)
+
+    def test_interaction_keeps_the_time_of_the_call_not_of_the_flush(self):
+        """
+        Verifica que created_at es el instante en que se encoló la interacción
+        aunque el buffer se vacíe más tarde.
+        """
+        import datetime
+        import unittest.mock as mock
+        from django.utils import timezone
+        from .buffers import record_interaction
+
+        called_at = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=called_at), \
+                self.captureOnCommitCallbacks(execute=True):
+            record_interaction(self.user, proveedor_usado="MockedProvider", prompt_original="Hola")
+        with mock.patch('django.utils.timezone.now', return_value=called_at + datetime.timedelta(hours=1)):
+            self.assertEqual(ai_interaction_buffer.flush(), 1)
+
+        self.assertEqual(AIInteraction.objects.get().created_at, called_at)
+
+
+class AsyncAIViewTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        self.tenant = Tenant.objects.create(name="Async Tenant")
+        self.user = User.objects.create_user(email='async@example.com', password='testpassword', tenant=self.tenant)
+
+    def test_views_are_coroutines_under_asgi(self):
+        from asgiref.sync import iscoroutinefunction
+        from django.urls import resolve
+        for name in ('ai_text_generation', 'ai_chat_completion'):
+            self.assertTrue(iscoroutinefunction(resolve(reverse(name)).func), name)
+
+    @override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+    def test_chat_completion_generates_and_logs_without_a_thread(self):
+        ai_interaction_buffer.clear()
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('ai_chat_completion'), {'history': [{'parts': [{'text': 'Hola'}]}]}, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['response'].startswith("Dummy text for prompt: "))
+        ai_interaction_buffer.flush()
+        interaction = AIInteraction.objects.get()
+        self.assertEqual((interaction.tenant, interaction.proveedor_usado), (self.tenant, 'DummyProvider'))
+
+    def test_authentication_still_applies(self):
+        response = self.client.post(reverse('ai_text_generation'), {'prompt': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ollama_async_requests_run_concurrently(self):
+        import asyncio
+        import time
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        async def generate_many(provider):
+            try:
+                return await asyncio.gather(*(provider.agenerate_text(prompt=f"p{n}", model='m') for n in range(40)))
+            finally:
+                await provider.aclose()
+
+        with FakeOllamaServer(delay=0.2) as server:
+            provider = OllamaProvider(endpoint=server.endpoint)
+            started = time.monotonic()
+            results = asyncio.run(generate_many(provider))
+            elapsed = time.monotonic() - started
+            provider.close()
+
+        self.assertEqual(results, [f"echo: p{n}" for n in range(40)])
+        # En serie serían 8 s; en paralelo, poco más que una sola petición.
+        self.assertLess(elapsed, 2.0)
+
+
+class AIResponseCacheTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        response_cache.reset_stats()
+        self.response_cache = response_cache
+
+    def _provider(self):
+        from .services.ai_manager.ai_manager import ai_manager
+        return ai_manager, ai_manager._find_provider_for_capability('text')
+
+    def test_identical_prompts_are_served_from_cache(self):
+        import unittest.mock as mock
+        ai_manager, provider = self._provider()
+
+        with mock.patch.object(provider, 'generate_text', return_value="Texto generado") as generate:
+            first = ai_manager.execute_text_generation(prompt="Escribe  un email\n", model='m', temperature=0.2)
+            second = ai_manager.execute_text_generation(prompt="Escribe un email", model='m', temperature=0.2)
+            # Otro modelo u otros kwargs de generación son otra entrada.
+            ai_manager.execute_text_generation(prompt="Escribe un email", model='m', temperature=0.9)
+
+        self.assertEqual(first[:2], second[:2])
+        # El acierto de caché no consume tokens.
+        self.assertFalse(first[2].cached)
+        self.assertTrue(second[2].cached)
+        self.assertEqual(second[2].total_tokens, 0)
+        self.assertEqual(generate.call_count, 2)
+        stats = self.response_cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (1, 2))
+
+    def test_shared_tier_survives_a_cold_process_cache(self):
+        import unittest.mock as mock
+        ai_manager, provider = self._provider()
+
+        with mock.patch.object(provider, 'generate_text', return_value="Texto compartido") as generate:
+            ai_manager.execute_text_generation(prompt="Hola", model='m')
+            self.response_cache.clear_local()
+            text, _, _ = ai_manager.execute_text_generation(prompt="Hola", model='m')
+            ai_manager.execute_text_generation(prompt="Hola", model='m', use_cache=False)
+
+        self.assertEqual(text, "Texto compartido")
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(self.response_cache.stats()['shared_hits'], 1)
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+class AIStreamingTests(APITestCase):
+    def setUp(self):
+        ai_interaction_buffer.clear()
+        from django.core.cache import cache
+        from .services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        self.tenant = Tenant.objects.create(name="Stream Tenant")
+        self.user = User.objects.create_user(email='stream@example.com', password='testpassword', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def _events(self, response):
+        import json
+        events = []
+        for message in b''.join(response.streaming_content).decode('utf-8').strip().split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in message.split('\n'))
+            events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+        return events
+
+    def test_text_stream_emits_chunks_and_logs_once_at_the_end(self):
+        response = self.client.post(reverse('ai_text_generation_stream'), {'prompt': 'Hola mundo'}, format='json')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # Nada se registra hasta que el stream se consume.
+        self.assertEqual(ai_interaction_buffer.pending_count(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            events = self._events(response)
+        self.assertEqual(ai_interaction_buffer.flush(), 1)
+
+        chunks = [data['text'] for kind, data in events if kind == 'message']
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(events[-1], ('done', {'generated_text': "Dummy text for prompt: Hola mundo"}))
+        interaction = AIInteraction.objects.get()
+        self.assertEqual(interaction.resultado, ''.join(chunks))
+        self.assertEqual(interaction.proveedor_usado, 'DummyProvider')
+
+    def test_chat_stream_reports_provider_errors_as_an_event(self):
+        import unittest.mock as mock
+        from .services.ai_manager.ai_manager import ai_manager
+
+        def failing():
+            yield "Parcial "
+            raise RuntimeError("Proveedor caído")
+
+        with mock.patch.object(ai_manager, 'stream_text_generation', return_value=(failing(), 'MockedProvider')):
+            response = self.client.post(
+                reverse('ai_chat_completion_stream'),
+                {'history': [{'parts': [{'text': 'Hola'}]}]}, format='json'
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                events = self._events(response)
+
+        self.assertEqual(events[-1], ('error', {'error': "Proveedor caído"}))
+        ai_interaction_buffer.flush()
+        interaction = AIInteraction.objects.get()
+        self.assertEqual((interaction.resultado, interaction.errores), ("Parcial", "Proveedor caído"))
+
+    def test_ollama_stream_yields_ndjson_chunks(self):
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        with FakeOllamaServer() as server:
+            provider = OllamaProvider(endpoint=server.endpoint)
+            chunks = list(provider.stream_text(prompt="uno dos tres", model='m'))
+            # La conexión vuelve al pool tras el stream.
+            self.assertEqual(provider.generate_text(prompt="x", model='m'), "echo: x")
+            self.assertEqual(server.connections, 1)
+            provider.close()
+
+        self.assertEqual(chunks, ["echo: ", "uno ", "dos ", "tres"])
+
+    def test_ollama_malformed_stream_line_is_a_provider_failure(self):
+        import unittest.mock as mock
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        provider = OllamaProvider(endpoint='http://ollama.invalid')
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = [b'{"response": "Hola ", "done": false}', b'{"response": "mu']
+        with mock.patch.object(provider.session, 'post', return_value=response):
+            stream = provider.stream_text(prompt="x", model='m')
+            self.assertEqual(next(stream), "Hola ")
+            with self.assertRaises(RuntimeError):
+                next(stream)
+        provider.close()
+
+
+class SingleFlightTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .services.ai_manager.ai_manager import ai_manager
+        from .services.ai_manager.response_cache import response_cache
+        from .services.ai_manager.single_flight import single_flight
+        cache.clear()
+        response_cache.clear_local()
+        single_flight.reset_stats()
+        self.ai_manager = ai_manager
+        self.provider = ai_manager._find_provider_for_capability('text')
+        self.single_flight = single_flight
+
+    def test_concurrent_threads_share_one_provider_call(self):
+        import threading
+        import time
+        import unittest.mock as mock
+
+        release = threading.Event()
+        calls = []
+
+        def slow_generate(prompt, model, **kwargs):
+            calls.append(prompt)
+            release.wait(5)
+            return "Texto compartido"
+
+        results = []
+        with mock.patch.object(self.provider, 'generate_text', side_effect=slow_generate):
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    self.ai_manager.execute_text_generation(prompt="Oferta de verano", model='m')
+                ))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while self.single_flight.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result[:2] for result in results], [("Texto compartido", self.provider.__class__.__name__)] * 8)
+        # Solo el líder paga la llamada; los demás reciben su resultado.
+        self.assertEqual(sum(1 for _, _, usage in results if not usage.cached), 1)
+
+    def test_concurrent_coroutines_share_one_provider_call(self):
+        import asyncio
+        import unittest.mock as mock
+
+        calls = []
+
+        async def slow_agenerate(prompt, model, **kwargs):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return "Texto async"
+
+        async def generate_many():
+            return await asyncio.gather(*(
+                self.ai_manager.aexecute_text_generation(prompt="Oferta", model='m') for _ in range(10)
+            ))
+
+        with mock.patch.object(self.provider, 'agenerate_text', side_effect=slow_agenerate):
+            results = asyncio.run(generate_many())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({text for text, _, _ in results}, {"Texto async"})
+        self.assertEqual(sum(1 for _, _, usage in results if not usage.cached), 1)
+        self.assertEqual(self.single_flight.stats()['coalesced'], 9)
+
+    @override_settings(AI_SINGLE_FLIGHT={'SHARED_LOCK': True, 'POLL_INTERVAL': 0.01, 'WAIT_TIMEOUT': 5})
+    def test_waits_for_a_leader_in_another_process(self):
+        import threading
+        import unittest.mock as mock
+        from django.core.cache import cache
+        from .services.ai_manager.response_cache import make_cache_key
+
+        key = make_cache_key(self.provider.__class__.__name__, 'm', "Hola", {})
+        # Otro proceso tiene el lock y publicará su resultado en la caché compartida.
+        cache.add('ai:inflight:' + key, 1)
+        threading.Timer(0.1, lambda: cache.set('ai:text:' + key, "Del otro proceso")).start()
+
+        with mock.patch.object(self.provider, 'generate_text') as generate:
+            text, _, _ = self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+
+        self.assertEqual(text, "Del otro proceso")
+        generate.assert_not_called()
+
+    @override_settings(AI_SINGLE_FLIGHT={'WAIT_TIMEOUT': 0.05})
+    def test_follower_calls_itself_when_the_leader_hangs(self):
+        import threading
+        import time
+
+        release = threading.Event()
+        leader = threading.Thread(target=self.single_flight.do, args=('k', lambda: release.wait(5), None))
+        leader.start()
+        try:
+            while self.single_flight.stats()['in_flight'] == 0:
+                time.sleep(0.001)
+            self.assertEqual(self.single_flight.do('k', lambda: "Propio", None), "Propio")
+        finally:
+            release.set()
+            leader.join()
+
+    def test_followers_raise_their_own_copy_of_the_leader_error(self):
+        import asyncio
+        import threading
+        import time
+        from .services.ai_manager.rate_limit import RateLimitExceeded
+
+        release = threading.Event()
+        leader_error = RateLimitExceeded('provider', 3)
+
+        def failing():
+            release.wait(5)
+            raise leader_error
+
+        errors = []
+
+        def call():
+            try:
+                self.single_flight.do('k', failing, None)
+            except RateLimitExceeded as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.single_flight.stats()['coalesced'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        followers = [e for e in errors if e is not leader_error]
+        self.assertEqual(len(followers), 3)
+        self.assertEqual(len({id(e) for e in followers}), 3)
+        self.assertTrue(all((e.scope, e.retry_after, e.__cause__) == ('provider', 3, leader_error) for e in followers))
+
+        async def afailing():
+            await asyncio.sleep(0.01)
+            raise leader_error
+
+        async def acall_many():
+            return await asyncio.gather(
+                *(self.single_flight.ado('k', afailing, None) for _ in range(3)), return_exceptions=True
+            )
+
+        aerrors = asyncio.run(acall_many())
+        self.assertIs(aerrors[0], leader_error)
+        self.assertTrue(all(e is not leader_error and e.__cause__ is leader_error for e in aerrors[1:]))
+
+
+@override_settings(AI_RESPONSE_CACHE={'ENABLED': False})
+class RateLimitTests(APITestCase):
+    def setUp(self):
+        from .services.ai_manager.ai_manager import ai_manager
+        from .services.ai_manager.rate_limit import rate_limiter
+        rate_limiter.reset()
+        self.addCleanup(rate_limiter.reset)
+        self.ai_manager = ai_manager
+        self.rate_limiter = rate_limiter
+        self.tenant = Tenant.objects.create(name="Noisy Tenant")
+        self.user = User.objects.create_user(email='noisy@example.com', password='testpassword', tenant=self.tenant)
+
+    def _limits(self, **tenant):
+        return override_settings(AI_RATE_LIMITS={
+            'TENANT': {'REQUESTS_PER_MINUTE': None, 'TOKENS_PER_MINUTE': None, 'MAX_CONCURRENT': None, **tenant},
+        })
+
+    def test_tenant_requests_per_minute_reject_with_retry_after(self):
+        from .services.ai_manager.rate_limit import RateLimitExceeded
+
+        with self._limits(REQUESTS_PER_MINUTE=2):
+            for _ in range(2):
+                self.ai_manager.execute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+            with self.assertRaises(RateLimitExceeded) as raised:
+                self.ai_manager.execute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+            # Otro tenant y las llamadas de sistema no comparten el cupo.
+            self.ai_manager.execute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id + 1)
+            self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+
+        self.assertEqual(raised.exception.scope, 'tenant')
+        self.assertAlmostEqual(raised.exception.retry_after, 30, delta=1)
+        self.assertEqual(self.rate_limiter.stats()['rejected']['tenant'], 1)
+
+    def test_tokens_per_minute_counts_the_prompt_size(self):
+        from .services.ai_manager.rate_limit import RateLimitExceeded
+
+        with self.settings(AI_RATE_LIMITS={'ESTIMATED_COMPLETION_TOKENS': 100, 'TENANT': {'TOKENS_PER_MINUTE': 1000}}):
+            self.ai_manager.execute_text_generation(prompt="x" * 2000, model='m', tenant_id=self.tenant.id)  # 600
+            with self.assertRaises(RateLimitExceeded):
+                self.ai_manager.execute_text_generation(prompt="x" * 2000, model='m', tenant_id=self.tenant.id)
+            self.ai_manager.execute_text_generation(prompt="corto", model='m', tenant_id=self.tenant.id)  # 101
+
+    def test_wait_mode_queues_until_the_bucket_refills(self):
+        import unittest.mock as mock
+
+        clock = [1000.0]
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        with self.settings(AI_RATE_LIMITS={'MODE': 'wait', 'MAX_WAIT': 5, 'TENANT': {'REQUESTS_PER_MINUTE': 60}}), \
+                mock.patch('ai.services.ai_manager.rate_limit.time.time', side_effect=lambda: clock[0]), \
+                mock.patch('ai.services.ai_manager.rate_limit.time.sleep', side_effect=fake_sleep):
+            # La llamada 61 espera a que el bucket recupere una petición (1 s a 60/min).
+            for _ in range(61):
+                self.ai_manager.execute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+
+        self.assertEqual(len(sleeps), 1)
+        self.assertAlmostEqual(sleeps[0], 1.0, delta=0.05)
+        self.assertEqual(self.rate_limiter.stats()['waited'], 1)
+
+    def test_concurrency_cap_holds_a_slot_for_the_whole_call(self):
+        import unittest.mock as mock
+        from .services.ai_manager.rate_limit import RateLimitExceeded
+        provider = self.ai_manager._find_provider_for_capability('text')
+
+        def reentrant_generate(prompt, model, **kwargs):
+            # Mientras esta llamada sigue en curso, el tenant no tiene otro hueco.
+            with self.assertRaises(RateLimitExceeded):
+                self.ai_manager.execute_text_generation(prompt="otra", model='m', tenant_id=self.tenant.id)
+            return "ok"
+
+        with self._limits(MAX_CONCURRENT=1), \
+                mock.patch.object(provider, 'generate_text', side_effect=reentrant_generate):
+            self.ai_manager.execute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+        with self._limits(MAX_CONCURRENT=1):
+            self.ai_manager.execute_text_generation(prompt="después", model='m', tenant_id=self.tenant.id)
+
+    def test_tenant_quota_is_not_shared_through_single_flight(self):
+        import threading
+        import time
+        import unittest.mock as mock
+        from django.core.cache import cache
+        from .services.ai_manager.rate_limit import RateLimitExceeded
+        from .services.ai_manager.response_cache import response_cache
+        from .services.ai_manager.single_flight import single_flight
+        cache.clear()
+        response_cache.clear_local()
+        single_flight.reset_stats()
+        provider = self.ai_manager._find_provider_for_capability('text')
+        other_tenant = Tenant.objects.create(name="Quiet Tenant")
+        release = threading.Event()
+
+        def slow_generate(prompt, model, **kwargs):
+            release.wait(5)
+            return "Texto compartido"
+
+        limits = {
+            'TENANT': {'REQUESTS_PER_MINUTE': None, 'TOKENS_PER_MINUTE': None, 'MAX_CONCURRENT': None},
+            'TENANT_OVERRIDES': {self.tenant.id: {'REQUESTS_PER_MINUTE': 1}},
+        }
+        with self.settings(AI_RESPONSE_CACHE={'ENABLED': True}, AI_RATE_LIMITS=limits):
+            self.ai_manager.execute_text_generation(prompt="otra", model='m', tenant_id=self.tenant.id)
+
+            # El tenant sin cupo se rechaza antes de unirse a la generación en curso...
+            with self.assertRaises(RateLimitExceeded):
+                self.ai_manager.execute_text_generation(prompt="Oferta", model='m', tenant_id=self.tenant.id)
+            self.assertEqual(single_flight.stats()['leaders'], 1)
+
+            # ...así que no lidera una generación cuyo error recibirían los demás,
+            # ni se cuela como seguidor de la de otro tenant.
+            results, errors = [], []
+
+            def generate(tenant_id):
+                try:
+                    results.append(self.ai_manager.execute_text_generation(prompt="Oferta", model='m', tenant_id=tenant_id))
+                except RateLimitExceeded as e:
+                    errors.append((tenant_id, e.scope))
+
+            with mock.patch.object(provider, 'generate_text', side_effect=slow_generate):
+                threads = [threading.Thread(target=generate, args=(other_tenant.id,)) for _ in range(4)]
+                threads += [threading.Thread(target=generate, args=(self.tenant.id,)) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                deadline = time.monotonic() + 5
+                while (single_flight.stats()['coalesced'] < 3 or len(errors) < 4) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                release.set()
+                for thread in threads:
+                    thread.join()
+
+        self.assertEqual(errors, [(self.tenant.id, 'tenant')] * 4)
+        self.assertEqual([text for text, _, _ in results], ["Texto compartido"] * 4)
+        self.assertEqual(single_flight.stats()['coalesced'], 3)
+
+    def test_image_and_stream_failover_charge_the_tenant_once(self):
+        import unittest.mock as mock
+        from .services.ai_manager.providers.dummy_provider import DummyProvider
+
+        class BrokenProvider(DummyProvider):
+            def generate_image(self, prompt, model, **kwargs):
+                raise RuntimeError("Broken image.")
+
+            def stream_text(self, prompt, model, **kwargs):
+                raise RuntimeError("Broken stream.")
+                yield
+
+        class SpareProvider(DummyProvider):
+            pass
+
+        with mock.patch.object(self.ai_manager, 'providers', [BrokenProvider(), SpareProvider()]), \
+                mock.patch.object(self.ai_manager, 'health', {}), \
+                self._limits(REQUESTS_PER_MINUTE=2, MAX_CONCURRENT=1):
+            _, provider_name, _ = self.ai_manager.execute_image_generation(prompt="Hotel", model='m', tenant_id=self.tenant.id)
+            self.assertEqual(provider_name, 'SpareProvider')
+
+            chunks, provider_name = self.ai_manager.stream_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+            self.assertEqual(provider_name, 'SpareProvider')
+            # El hueco de concurrencia del tenant sigue tomado mientras dura el stream.
+            self.assertEqual(self.rate_limiter.memory._slots, {'ai:ratelimit:tenant:%s:concurrent' % self.tenant.id: 1})
+            self.assertEqual(''.join(chunks), "Dummy text for prompt: Hola")
+            self.assertEqual(self.rate_limiter.memory._slots, {'ai:ratelimit:tenant:%s:concurrent' % self.tenant.id: 0})
+
+        self.assertEqual(self.rate_limiter.stats()['rejected']['tenant'], 0)
+
+    def test_async_acquire_calls_a_shared_backend_off_the_event_loop(self):
+        import asyncio
+        import threading
+        import unittest.mock as mock
+        from .services.ai_manager.rate_limit import MemoryBackend
+
+        calls = []
+
+        class SharedBackend(MemoryBackend):
+            # Sustituye a Redis: cada llamada anota en qué hilo se ejecutó.
+            def take(self, buckets, now):
+                calls.append(('take', threading.get_ident()))
+                return super().take(buckets, now)
+
+            def acquire_slot(self, key, limit):
+                calls.append(('acquire_slot', threading.get_ident()))
+                return super().acquire_slot(key, limit)
+
+            def release_slot(self, key):
+                calls.append(('release_slot', threading.get_ident()))
+                super().release_slot(key)
+
+        async def generate():
+            await self.ai_manager.aexecute_text_generation(prompt="Hola", model='m', tenant_id=self.tenant.id)
+            return threading.get_ident()
+
+        with self._limits(REQUESTS_PER_MINUTE=10, MAX_CONCURRENT=2), \
+                mock.patch.object(self.rate_limiter, '_backend', return_value=SharedBackend()):
+            loop_thread = asyncio.run(generate())
+
+        self.assertEqual([name for name, _ in calls], ['acquire_slot', 'take', 'release_slot'])
+        self.assertNotIn(loop_thread, [thread for _, thread in calls])
+
+    def test_provider_quota_fails_over_to_another_provider(self):
+        import unittest.mock as mock
+        from .services.ai_manager.providers.dummy_provider import DummyProvider
+
+        class QuotaProvider(DummyProvider):
+            pass
+
+        class SpareProvider(DummyProvider):
+            pass
+
+        with mock.patch.object(self.ai_manager, 'providers', [QuotaProvider(), SpareProvider()]), \
+                mock.patch.object(self.ai_manager, 'health', {}), \
+                self.settings(AI_RATE_LIMITS={'PROVIDERS': {'QuotaProvider': {'REQUESTS_PER_MINUTE': 1}}}):
+            used = [self.ai_manager.execute_text_generation(prompt="Hola", model='m')[1] for _ in range(3)]
+
+        self.assertIn('SpareProvider', used)
+        self.assertEqual(used.count('QuotaProvider'), 1)
+
+    def test_view_answers_429_with_retry_after(self):
+        self.client.force_authenticate(user=self.user)
+        with self._limits(REQUESTS_PER_MINUTE=1):
+            self.client.post(reverse('ai_text_generation'), {'prompt': 'Hola'}, format='json')
+            response = self.client.post(reverse('ai_text_generation'), {'prompt': 'Hola'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+
+
+@override_settings(AI_RESPONSE_CACHE={'ENABLED': False}, AI_PROVIDER_HEALTH={'FAILURE_THRESHOLD': 3, 'OPEN_SECONDS': 60})
+class ProviderFailoverTests(APITestCase):
+    def setUp(self):
+        import unittest.mock as mock
+        from .services.ai_manager.ai_manager import ai_manager
+        from .services.ai_manager.providers.dummy_provider import DummyProvider
+
+        class BrokenProvider(DummyProvider):
+            calls = 0
+
+            def generate_text(self, prompt, model, **kwargs):
+                BrokenProvider.calls += 1
+                raise RuntimeError("Failed to generate text using Broken.")
+
+        class BackupProvider(DummyProvider):
+            pass
+
+        self.broken, self.backup = BrokenProvider(), BackupProvider()
+        self.ai_manager = ai_manager
+        for patcher in (
+            mock.patch.object(ai_manager, 'providers', [self.broken, self.backup]),
+            mock.patch.object(ai_manager, 'health', {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fails_over_within_the_request_and_reports_the_real_provider(self):
+        text, provider_name, _ = self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+        self.assertEqual((text, provider_name), ("Dummy text for prompt: Hola", 'BackupProvider'))
+
+        # Con un fallo registrado, el proveedor sano pasa a ser el preferido.
+        self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+        self.assertEqual(type(self.broken).calls, 1)
+        self.assertIs(self.ai_manager._find_provider_for_capability('text'), self.backup)
+
+    def test_breaker_opens_after_consecutive_failures_and_allows_one_probe(self):
+        import unittest.mock as mock
+
+        self.ai_manager.providers.remove(self.backup)
+        for _ in range(3):
+            with self.assertRaisesMessage(RuntimeError, "All providers failed for text generation"):
+                self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+        self.assertEqual(self.ai_manager.provider_health()['BrokenProvider']['state'], 'open')
+
+        # Con el breaker abierto falla rápido, sin llamar al proveedor.
+        with self.assertRaisesMessage(RuntimeError, "No provider available for text generation."):
+            self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+        self.assertEqual(type(self.broken).calls, 3)
+
+        # Pasado OPEN_SECONDS se deja pasar una sola llamada de prueba.
+        health = self.ai_manager.health[self.broken]
+        with mock.patch('ai.services.ai_manager.health.time.monotonic', return_value=health.opened_at + 61):
+            self.assertTrue(health.acquire())
+            self.assertFalse(health.acquire())
+
+    def test_cancelled_half_open_probe_returns_its_permit(self):
+        import asyncio
+        import unittest.mock as mock
+
+        self.ai_manager.providers.remove(self.backup)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                self.ai_manager.execute_text_generation(prompt="Hola", model='m')
+        health = self.ai_manager.health[self.broken]
+        health.opened_at -= 61  # pasado OPEN_SECONDS: la próxima llamada es la prueba
+        started = asyncio.Event()
+
+        async def hanging_agenerate(prompt, model, **kwargs):
+            started.set()
+            await asyncio.sleep(60)
+
+        async def cancel_probe():
+            task = asyncio.create_task(self.ai_manager.aexecute_text_generation(prompt="Hola", model='m'))
+            await started.wait()
+            # Lo que hace Django cuando el cliente ASGI se desconecta.
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(self.broken, 'agenerate_text', side_effect=hanging_agenerate):
+            asyncio.run(cancel_probe())
+
+        # Sin devolver el permiso, el proveedor quedaría fuera de rotación para siempre.
+        self.assertEqual(health.state, 'half_open')
+        self.assertTrue(health.acquire())
+
+@override_settings(AI_RESPONSE_CACHE={'ENABLED': False})
+class TextGenerationBatchTests(APITestCase):
+    def setUp(self):
+        from .services.ai_manager.ai_manager import ai_manager
+        self.ai_manager = ai_manager
+
+    def test_preserves_order_and_sends_repeated_prompts_once(self):
+        import unittest.mock as mock
+        provider = self.ai_manager._find_provider_for_capability('text')
+
+        with mock.patch.object(provider, 'generate_text_batch', wraps=provider.generate_text_batch) as batch:
+            items = self.ai_manager.execute_text_generation_batch(prompts=["a", "b", "a", "c"], model='m')
+
+        batch.assert_called_once_with(["a", "b", "c"], model='m')
+        self.assertEqual([item.text for item in items], [f"Dummy text for prompt: {p}" for p in "abac"])
+        self.assertTrue(all(item.error is None for item in items))
+
+    def test_failed_items_fail_over_and_unrecoverable_ones_carry_their_error(self):
+        import unittest.mock as mock
+        from .services.ai_manager.providers.dummy_provider import DummyProvider
+
+        class PickyProvider(DummyProvider):
+            def generate_text_batch(self, prompts, model, **kwargs):
+                return [RuntimeError("Picky refused.") if 'x' in p else f"picky {p}" for p in prompts]
+
+        class BackupProvider(DummyProvider):
+            def generate_text_batch(self, prompts, model, **kwargs):
+                return [RuntimeError("Backup refused.") if p == 'xx' else f"backup {p}" for p in prompts]
+
+        with mock.patch.object(self.ai_manager, 'providers', [PickyProvider(), BackupProvider()]), \
+                mock.patch.object(self.ai_manager, 'health', {}):
+            items = self.ai_manager.execute_text_generation_batch(prompts=["ok", "x", "xx"], model='m')
+
+        self.assertEqual(
+            [(item.text, item.provider_name, item.error) for item in items],
+            [("picky ok", 'PickyProvider', None), ("backup x", 'BackupProvider', None), (None, None, "Backup refused.")],
+        )
+
+    def test_batch_failing_with_a_non_runtime_error_fails_over(self):
+        import unittest.mock as mock
+        from .services.ai_manager.providers.dummy_provider import DummyProvider
+
+        class TimeoutProvider(DummyProvider):
+            def generate_text_batch(self, prompts, model, **kwargs):
+                return [TimeoutError("timed out") for _ in prompts]
+
+        with mock.patch.object(self.ai_manager, 'providers', [TimeoutProvider(), DummyProvider()]), \
+                mock.patch.object(self.ai_manager, 'health', {}):
+            items = self.ai_manager.execute_text_generation_batch(prompts=["a", "b"], model='m')
+
+        self.assertEqual([(item.provider_name, item.error) for item in items], [('DummyProvider', None)] * 2)
+
+    def test_ollama_batch_fans_out_over_the_pool(self):
+        import time
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        with FakeOllamaServer(delay=0.2) as server:
+            provider = OllamaProvider(endpoint=server.endpoint, pool_size=10)
+            started = time.monotonic()
+            outputs = provider.generate_text_batch([f"p{n}" for n in range(20)], model='m')
+            elapsed = time.monotonic() - started
+            provider.close()
+
+        self.assertEqual(outputs, [f"echo: p{n}" for n in range(20)])
+        # 20 llamadas de 0.2 s en serie serían 4 s; con 10 en paralelo, dos rondas.
+        self.assertLess(elapsed, 1.5)
+
+
+@override_settings(
+    WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0},
+    AI_USAGE={'PRICES': {'DummyProvider': {'m': {'PROMPT_PER_1K': '1', 'COMPLETION_PER_1K': '2'}}}},
+)
+class AIUsageAccountingTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        ai_interaction_buffer.clear()
+        self.tenant = Tenant.objects.create(name="Usage Tenant")
+        self.user = User.objects.create_user(email='usage@example.com', password='testpassword', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def _generate(self, prompt):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('ai_text_generation'), {'prompt': prompt, 'model': 'm'}, format='json')
+
+    def test_interactions_carry_tokens_and_cost_and_roll_up_per_day(self):
+        from decimal import Decimal
+        from infrastructure.models import AIUsageDaily
+
+        self._generate("Escribe un asunto")  # 5 + 10 tokens estimados
+        self._generate("Escribe un asunto")  # desde la caché
+        self.assertEqual(ai_interaction_buffer.flush(), 2)
+
+        first, second = AIInteraction.objects.order_by('id')
+        self.assertEqual((first.modelo, first.endpoint), ('m', 'ai_text_generation'))
+        self.assertEqual((first.tokens_prompt, first.tokens_respuesta, first.tokens_estimados), (5, 10, True))
+        self.assertEqual(first.costo_estimado, Decimal('0.025'))  # (5 * 1 + 10 * 2) / 1000
+        self.assertTrue(second.desde_cache)
+        self.assertEqual((second.tokens_prompt, second.costo_estimado), (0, 0))
+
+        usage = AIUsageDaily.objects.get(tenant=self.tenant)
+        self.assertEqual((usage.endpoint, usage.proveedor, usage.modelo), ('ai_text_generation', 'DummyProvider', 'm'))
+        self.assertEqual((usage.llamadas, usage.llamadas_cache, usage.tokens_prompt, usage.tokens_respuesta), (2, 1, 5, 10))
+        self.assertEqual(usage.costo, Decimal('0.025'))
+
+        # Un segundo vaciado incrementa la misma fila.
+        self._generate("Otro asunto")
+        ai_interaction_buffer.flush()
+        usage.refresh_from_db()
+        self.assertEqual(usage.llamadas, 3)
+
+    def test_daily_budget_blocks_generation_until_tomorrow(self):
+        from decimal import Decimal
+        from django.core.cache import cache
+        from django.utils import timezone
+        from infrastructure.models import AIUsageDaily
+
+        AIUsageDaily.objects.create(
+            tenant=self.tenant, fecha=timezone.localdate(), proveedor='DummyProvider', costo=Decimal('1.5')
+        )
+        with override_settings(AI_USAGE={'DAILY_BUDGET': 1}):
+            response = self._generate("Hola")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # El gasto del día queda cacheado BUDGET_CHECK_TTL segundos.
+        cache.clear()
+        with override_settings(AI_USAGE={'DAILY_BUDGET': 1, 'TENANT_BUDGETS': {self.tenant.id: 5}}):
+            self.assertEqual(self._generate("Hola").status_code, status.HTTP_200_OK)
+
+    def test_ollama_reports_real_token_counts(self):
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        with FakeOllamaServer() as server:
+            provider = OllamaProvider(endpoint=server.endpoint)
+            text, usage = provider.generate_text_with_usage(prompt="uno dos tres", model='m')
+            provider.close()
+
+        self.assertEqual(text, "echo: uno dos tres")
+        self.assertEqual((usage.prompt_tokens, usage.completion_tokens, usage.estimated), (3, 4, False))
+
+
+class OllamaProviderConnectionTests(APITestCase):
+    def test_connections_are_reused_and_resets_are_retried(self):
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        with FakeOllamaServer() as server:
+            provider = OllamaProvider(endpoint=server.endpoint, max_retries=2)
+            for n in range(10):
+                self.assertEqual(provider.generate_text(prompt=f"p{n}", model='m'), f"echo: p{n}")
+            self.assertEqual(server.connections, 1)
+
+            server.reset_next()
+            self.assertEqual(provider.generate_text(prompt="again", model='m'), "echo: again")
+            provider.close()
+
+    def test_read_timeout_is_not_retried(self):
+        from .services.ai_manager.fake_ollama import FakeOllamaServer
+        from .services.ai_manager.providers.ollama_provider import OllamaProvider
+
+        with FakeOllamaServer(delay=0.5) as server:
+            provider = OllamaProvider(endpoint=server.endpoint, read_timeout=0.1, max_retries=3)
+            with self.assertRaises(RuntimeError):
+                provider.generate_text(prompt="slow", model='m')
+            self.assertEqual(server.requests, 1)
+            provider.close()
@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import TextGenerationView, ChatCompletionView
+from .views import TextGenerationView, ChatCompletionView, TextGenerationStreamView, ChatCompletionStreamView
 
 urlpatterns = [
     path('text', TextGenerationView.as_view(), name='ai_text_generation'),
+    path('text/stream', TextGenerationStreamView.as_view(), name='ai_text_generation_stream'),
     path('chat/', ChatCompletionView.as_view(), name='ai_chat_completion'),
+    path('chat/stream/', ChatCompletionStreamView.as_view(), name='ai_chat_completion_stream'),
 ]
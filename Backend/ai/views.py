@@ -1,58 +1,119 @@
+import time
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 
+from .buffers import record_interaction, arecord_interaction
+from .http import provider_error_response
 from .services.ai_manager.ai_manager import ai_manager
+from .services.ai_manager.usage import TokenUsage
 from .services.sanitizers import sanitize_plain_text
-from infrastructure.models import AIInteraction, Tenant
+from infrastructure.models import Tenant
+from shared.http import sse_event, sse_response
+from shared.views import AsyncAPIView
+
+
+def _build_chat_prompt(history) -> str:
+    # El último mensaje es el del usuario
+    user_prompt = history[-1]['parts'][0]['text']
+
+    # Podríamos añadir un prompt de sistema para dar contexto al chatbot
+    system_prompt = "Eres un asistente de marketing. Responde de forma breve y útil."
+    return f"{system_prompt}\n\nHistorial:\n{history}\n\nUsuario: {user_prompt}"
+
+
+def _stream_generation(request, prompt, model, result_key):
+    """
+    Respuesta SSE para una generación: un evento por fragmento y un evento
+    'done' con el texto sanitizado bajo `result_key`. La interacción se
+    registra una sola vez, al terminar el stream (o al fallar o abandonarlo el
+    cliente), con lo generado hasta ese momento y su consumo estimado.
+    """
+    started = time.monotonic()
+    try:
+        stream, provider_name = ai_manager.stream_text_generation(
+            prompt=prompt, model=model, tenant_id=request.user.tenant_id
+        )
+    except RuntimeError as e:
+        return provider_error_response(e)
+
+    user, endpoint = request.user, request.resolver_match.url_name
+
+    def events():
+        chunks = []
+        error_message = ""
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield sse_event({"text": chunk})
+            yield sse_event({result_key: sanitize_plain_text(''.join(chunks))}, event='done')
+        except RuntimeError as e:
+            error_message = str(e)
+            yield sse_event({"error": error_message}, event='error')
+        except GeneratorExit:
+            error_message = "Stream cancelado por el cliente."
+            raise
+        finally:
+            record_interaction(
+                user,
+                proveedor_usado=provider_name,
+                modelo=model,
+                endpoint=endpoint,
+                prompt_original=prompt,
+                resultado=sanitize_plain_text(''.join(chunks)),
+                errores=error_message,
+                usage=TokenUsage.estimate(prompt, ''.join(chunks), time.monotonic() - started)
+            )
+
+    return sse_response(events())
+
 
-class ChatCompletionView(APIView):
+class ChatCompletionView(AsyncAPIView):
     """
     Endpoint para gestionar conversaciones de chatbot.
     """
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         history = request.data.get('history', [])
         if not history:
             return Response({"error": "El campo 'history' es requerido."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # El último mensaje es el del usuario
-        user_prompt = history[-1]['parts'][0]['text']
-
-        # Podríamos añadir un prompt de sistema para dar contexto al chatbot
-        system_prompt = "Eres un asistente de marketing. Responde de forma breve y útil."
-        full_prompt = f"{system_prompt}\n\nHistorial:\n{history}\n\nUsuario: {user_prompt}"
+        full_prompt = _build_chat_prompt(history)
 
         try:
             model = request.data.get('model', 'default-text-model')
-            raw_text, provider_name = ai_manager.execute_text_generation(prompt=full_prompt, model=model)
+            raw_text, provider_name, usage = await ai_manager.aexecute_text_generation(
+                prompt=full_prompt, model=model, tenant_id=request.user.tenant_id
+            )
             sanitized_text = sanitize_plain_text(raw_text)
 
-            AIInteraction.objects.create(
-                tenant=request.user.tenant,
-                user=request.user,
+            await arecord_interaction(
+                request.user,
                 proveedor_usado=provider_name,
+                modelo=model,
+                endpoint=request.resolver_match.url_name,
                 prompt_original=full_prompt,
                 resultado=sanitized_text,
-                costo_estimado=0.0
+                usage=usage
             )
 
             return Response({"response": sanitized_text}, status=status.HTTP_200_OK)
         except RuntimeError as e:
-            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return provider_error_response(e)
         except Exception as e:
             return Response({"error": f"Ocurrió un error inesperado: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class TextGenerationView(APIView):
+class TextGenerationView(AsyncAPIView):
     """
     Endpoint para la generación de texto simple.
     """
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         prompt = request.data.get('prompt')
         model = request.data.get('model', 'default-text-model') # El frontend puede especificar un modelo
 
@@ -63,35 +124,75 @@ class TextGenerationView(APIView):
             )
 
         try:
-            tenant = request.user.tenant
-            if not tenant:
+            tenant_id = request.user.tenant_id
+            if not tenant_id:
                  return Response({"error": "El usuario no tiene un tenant asociado."}, status=status.HTTP_400_BAD_REQUEST)
 
 
             # 1. Ejecutar la generación de texto a través del AIManager
-            raw_text, provider_name = ai_manager.execute_text_generation(prompt=prompt, model=model)
+            raw_text, provider_name, usage = await ai_manager.aexecute_text_generation(
+                prompt=prompt, model=model, tenant_id=tenant_id
+            )
 
             # 2. Sanitizar la respuesta de la IA
             sanitized_text = sanitize_plain_text(raw_text)
 
-            # 3. Persistir la interacción con el resultado ya sanitizado
-            AIInteraction.objects.create(
-                tenant=tenant,
-                user=request.user,
+            # 3. Registrar la interacción con el resultado ya sanitizado (write-behind)
+            await arecord_interaction(
+                request.user,
                 proveedor_usado=provider_name,
+                modelo=model,
+                endpoint=request.resolver_match.url_name,
                 prompt_original=prompt,
                 resultado=sanitized_text, # Guardar el texto limpio
-                costo_estimado=0.0 # TODO: Calcular costo real
+                usage=usage # Tokens y coste según la tabla de precios
             )
 
             return Response({"generated_text": sanitized_text}, status=status.HTTP_200_OK)
 
         except RuntimeError as e:
             # Error si no hay proveedor disponible
-            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return provider_error_response(e)
         except Exception as e:
             # Captura de otros errores inesperados
             return Response(
                 {"error": f"Ocurrió un error inesperado: {e}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class ChatCompletionStreamView(APIView):
+    """
+    Variante de ChatCompletionView que emite la respuesta como server-sent events.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        history = request.data.get('history', [])
+        if not history:
+            return Response({"error": "El campo 'history' es requerido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        model = request.data.get('model', 'default-text-model')
+        return _stream_generation(request, _build_chat_prompt(history), model, result_key='response')
+
+
+class TextGenerationStreamView(APIView):
+    """
+    Variante de TextGenerationView que emite el texto como server-sent events.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        prompt = request.data.get('prompt')
+        model = request.data.get('model', 'default-text-model')
+
+        if not prompt:
+            return Response(
+                {"error": "El 'prompt' es un campo requerido."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not request.user.tenant_id:
+            return Response({"error": "El usuario no tiene un tenant asociado."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return _stream_generation(request, prompt, model, result_key='generated_text')
+
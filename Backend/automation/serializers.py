@@ -1,5 +1,6 @@
 # automation/serializers.py
 from rest_framework import serializers
+from shared.bulk import TempIdMap, bulk_create_level
 from .models import AgentPersona, Workflow, Node, Edge
 
 class AgentPersonaSerializer(serializers.ModelSerializer):
@@ -42,17 +43,17 @@ class WorkflowCreateSerializer(serializers.ModelSerializer):
         edges_data = validated_data.pop('edges')
         workflow = Workflow.objects.create(**validated_data)
 
-        node_map = {}
-        for node_data in nodes_data:
-            temp_id = node_data.pop('id', None)
-            node = Node.objects.create(workflow=workflow, **node_data)
-            if temp_id:
-                node_map[temp_id] = node
-
-        for edge_data in edges_data:
-            source_node = node_map.get(edge_data['source_node'])
-            target_node = node_map.get(edge_data['target_node'])
-            if source_node and target_node:
-                Edge.objects.create(workflow=workflow, source_node=source_node, target_node=target_node)
+        # Un bulk_create por nivel: primero los nodos y luego las aristas, cuyos
+        # extremos llegan como ids temporales de los nodos.
+        temp_ids = TempIdMap()
+        bulk_create_level(Node, [{**node_data, 'workflow': workflow} for node_data in nodes_data], temp_ids)
+        bulk_create_level(Edge, [
+            {
+                'workflow': workflow,
+                'source_node': edge_data.get('source_node'),
+                'target_node': edge_data.get('target_node'),
+            }
+            for edge_data in edges_data
+        ], temp_ids, references={'source_node': Node, 'target_node': Node}, skip_unresolved=True)
 
         return workflow
@@ -2,6 +2,8 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from infrastructure.models import Tenant
 from .models import Workflow, Node, Edge
 
@@ -47,3 +49,23 @@ class AutomationAPITests(APITestCase):
 
         self.assertEqual(edge.source_node, trigger_node)
         self.assertEqual(edge.target_node, action_node)
+
+    def test_create_workflow_query_count_does_not_grow_with_graph_size(self):
+        def create(size):
+            workflow_data = {
+                "name": f"Workflow {size}",
+                "is_active": True,
+                "nodes": [{"id": f"n{i}", "node_type": "action", "config_json": {}} for i in range(size)],
+                "edges": [{"source_node": f"n{i}", "target_node": f"n{i + 1}"} for i in range(size - 1)]
+                         + [{"source_node": "n0", "target_node": "unknown"}],
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, workflow_data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create(2), create(30))
+        workflow = Workflow.objects.get(name="Workflow 30")
+        self.assertEqual(workflow.nodes.count(), 30)
+        # La arista hacia un nodo desconocido se descarta, como antes.
+        self.assertEqual(workflow.edges.count(), 29)
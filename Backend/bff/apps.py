@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BffConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bff'
+
+    def ready(self):
+        # Registrar la invalidación de la respuesta pública materializada
+        from . import signals  # noqa: F401
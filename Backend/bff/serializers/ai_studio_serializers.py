@@ -9,6 +9,17 @@ class GenerateTextSerializer(serializers.Serializer):
     model = serializers.CharField(required=False) # El AIManager podría elegir
     # Otros parámetros como tono, formato, etc. se pueden añadir aquí.
 
+class GenerateTextBatchSerializer(serializers.Serializer):
+    """
+    Varias generaciones de texto en una sola petición (ej. variantes de un copy).
+    """
+    MAX_PROMPTS = 50
+
+    prompts = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False, max_length=MAX_PROMPTS
+    )
+    model = serializers.CharField(required=False)
+
 class GenerateImageSerializer(serializers.Serializer):
     prompt = serializers.CharField(required=True)
     model = serializers.CharField(required=False)
@@ -1,7 +1,8 @@
 # bff/serializers/funnel_serializers.py
+from django.db.models import Prefetch
 from rest_framework import serializers
 from funnels.models import Funnel, FunnelVersion, FunnelPage
-from infrastructure.models import Bloque, LandingPage, Pagina
+from infrastructure.models import Bloque, Embudo, LandingPage, Pagina
 
 class BloqueSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,12 +16,15 @@ class PaginaSerializer(serializers.ModelSerializer):
         fields = ['id', 'tipo', 'orden', 'bloques']
 
 class FunnelPageSerializer(serializers.ModelSerializer):
-    bloques = BloqueSerializer(many=True, read_only=True)
+    # Los bloques de un FunnelPage viven en su schema (no hay relación 'bloques'),
+    # que forma parte del schema de la versión.
+    page_schema_json = serializers.JSONField(source='get_page_schema', read_only=True)
     class Meta:
         model = FunnelPage
-        fields = ['id', 'page_type', 'order_index', 'bloques']
+        fields = ['id', 'page_type', 'order_index', 'page_schema_json']
 
 class FunnelVersionSerializer(serializers.ModelSerializer):
+    schema_json = serializers.JSONField(source='get_schema', read_only=True)
     pages = FunnelPageSerializer(many=True, read_only=True)
     class Meta:
         model = FunnelVersion
@@ -32,12 +36,39 @@ class FunnelSerializer(serializers.ModelSerializer):
         model = Funnel
         fields = ['id', 'name', 'status', 'created_at', 'updated_at', 'versions']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Plan de consultas para el árbol embudo -> versiones -> páginas:
+        tres consultas en total, independientemente del tamaño del listado. Las
+        cadenas delta están entre las versiones precargadas, así que sus schemas
+        (y los de sus páginas) se reconstruyen en memoria.
+        """
+        return queryset.prefetch_related(
+            Prefetch('versions', queryset=FunnelVersion.objects.with_schemas().prefetch_related(
+                Prefetch('pages', queryset=FunnelPage.objects.order_by('order_index'))
+            ))
+        )
+
+class EmbudoPublicSerializer(serializers.ModelSerializer):
+    paginas = PaginaSerializer(many=True, read_only=True)
+    class Meta:
+        model = Embudo
+        fields = ['id', 'nombre', 'paginas']
+
 class LandingPagePublicSerializer(serializers.ModelSerializer):
-    funnel = FunnelSerializer(read_only=True)
+    funnel = EmbudoPublicSerializer(source='embudo', read_only=True)
     class Meta:
         model = LandingPage
         fields = ['slug', 'funnel']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Plan de consultas: landing + embudo en una consulta, páginas y bloques en una cada una."""
+        return queryset.select_related('embudo').prefetch_related(
+            Prefetch('embudo__paginas', queryset=Pagina.objects.prefetch_related('bloques'))
+        )
+
 class FunnelCreateSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=255)
     landing_page_id = serializers.IntegerField()
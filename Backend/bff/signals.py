@@ -0,0 +1,44 @@
+# bff/signals.py
+"""
+Invalidación de la respuesta pública materializada (published_payload y
+published_etag de LandingPage, ver bff/views/public_views.py).
+
+Cualquier escritura de la landing page, su embudo, sus páginas o sus bloques
+descarta la respuesta, venga de las vistas del constructor, del admin o de un
+servicio; así el ETag nunca sobrevive a un cambio del contenido y los clientes
+no reciben un 304 con datos viejos. Cada invalidación es un único UPDATE sin
+leer antes las filas relacionadas.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from infrastructure.models import Bloque, Embudo, LandingPage, Pagina
+from bff.views.public_views import invalidate_public_landing_page
+
+# Campos que escribe la propia materialización: no cambian el contenido
+_MATERIALIZED_FIELDS = {'published_payload', 'published_etag'}
+
+
+@receiver(post_save, sender=LandingPage)
+def invalidate_on_landing_page_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= _MATERIALIZED_FIELDS:
+        return
+    invalidate_public_landing_page(id=instance.id)
+
+
+@receiver(post_save, sender=Embudo)
+@receiver(post_delete, sender=Embudo)
+def invalidate_on_embudo_change(sender, instance, **kwargs):
+    invalidate_public_landing_page(id=instance.landing_page_id)
+
+
+@receiver(post_save, sender=Pagina)
+@receiver(post_delete, sender=Pagina)
+def invalidate_on_pagina_change(sender, instance, **kwargs):
+    invalidate_public_landing_page(embudo__id=instance.embudo_id)
+
+
+@receiver(post_save, sender=Bloque)
+@receiver(post_delete, sender=Bloque)
+def invalidate_on_bloque_change(sender, instance, **kwargs):
+    invalidate_public_landing_page(embudo__paginas__id=instance.pagina_id)
@@ -1,3 +1,326 @@
-from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from ai.buffers import ai_interaction_buffer
+from funnels.models import Funnel, FunnelVersion, FunnelPage
+from infrastructure.models import Tenant, Categoria, Subcategoria, LandingPage, Embudo, Pagina, Bloque
 
-# Create your tests here.
+User = get_user_model()
+
+class PublicFunnelViewTests(APITestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="BFF Tenant")
+        self.user = User.objects.create_user(email='bff_user@example.com', password='password', tenant=self.tenant)
+        categoria = Categoria.objects.create(tenant=self.tenant, nombre="Turismo")
+        subcategoria = Subcategoria.objects.create(categoria=categoria, nombre="Hoteles")
+        self.landing_page = LandingPage.objects.create(subcategoria=subcategoria, slug="hotel-landing")
+        self.embudo = Embudo.objects.create(landing_page=self.landing_page, nombre="Embudo Hotel")
+        pagina = Pagina.objects.create(embudo=self.embudo, tipo="landing", orden=0)
+        self.bloque = Bloque.objects.create(pagina=pagina, tipo="hero", orden=0, config_json={"title": "Hola"})
+
+    def test_publish_materializes_public_payload(self):
+        self.client.force_authenticate(user=self.user)
+        # Los nombres de ruta coinciden con los de la app funnels; usamos la URL literal.
+        publish_url = f'/api/bff/builder/funnels/{self.embudo.pk}/publish/'
+        response = self.client.post(publish_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=None)
+
+        self.landing_page.refresh_from_db()
+        self.assertTrue(self.landing_page.published_etag)
+
+        url = '/api/bff/public/funnel/hotel-landing/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], self.landing_page.published_etag)
+        data = response.json()
+        self.assertEqual(data['funnel']['paginas'][0]['bloques'][0]['config_json'], {"title": "Hola"})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=self.landing_page.published_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_editing_a_block_after_publish_refreshes_the_public_payload(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.post(f'/api/bff/builder/funnels/{self.embudo.pk}/publish/')
+        self.client.force_authenticate(user=None)
+        url = '/api/bff/public/funnel/hotel-landing/'
+        old_etag = self.client.get(url)['ETag']
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch(
+            f'/api/bff/builder/blocks/{self.bloque.pk}/', {'config_json': {"title": "Adiós"}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=None)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], old_etag)
+        self.assertEqual(response.json()['funnel']['paginas'][0]['bloques'][0]['config_json'], {"title": "Adiós"})
+
+    def _publish(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.post(f'/api/bff/builder/funnels/{self.embudo.pk}/publish/')
+        self.client.force_authenticate(user=None)
+
+    def test_editing_the_embudo_after_publish_refreshes_the_public_payload(self):
+        self._publish()
+        url = '/api/bff/public/funnel/hotel-landing/'
+        old_etag = self.client.get(url)['ETag']
+
+        self.embudo.nombre = "Embudo Hotel Renovado"
+        self.embudo.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], old_etag)
+        self.assertEqual(response.json()['funnel']['nombre'], "Embudo Hotel Renovado")
+
+    def test_editing_the_landing_page_after_publish_refreshes_the_public_payload(self):
+        self._publish()
+        old_etag = self.client.get('/api/bff/public/funnel/hotel-landing/')['ETag']
+
+        self.landing_page.refresh_from_db()
+        self.landing_page.slug = "hotel-playa"
+        self.landing_page.save()
+
+        response = self.client.get('/api/bff/public/funnel/hotel-playa/', HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], old_etag)
+        self.assertEqual(response.json()['slug'], "hotel-playa")
+
+    def test_unpublished_landing_page_is_not_found(self):
+        url = '/api/bff/public/funnel/hotel-landing/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BuilderFunnelListTests(APITestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Builder Tenant")
+        self.user = User.objects.create_user(email='builder@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/bff/builder/funnels/'
+
+    def _create_funnels(self, count, versions_per_funnel, pages_per_version):
+        for i in range(count):
+            funnel = Funnel.objects.create(tenant=self.tenant, name=f"Builder Funnel {i}")
+            for number in range(1, versions_per_funnel + 1):
+                version = FunnelVersion.objects.create(funnel=funnel, version_number=number)
+                FunnelPage.objects.bulk_create([
+                    FunnelPage(funnel_version=version, page_type='landing', order_index=index)
+                    for index in range(pages_per_version)
+                ])
+
+    def test_list_query_count_is_independent_of_tree_size(self):
+        self._create_funnels(1, versions_per_funnel=1, pages_per_version=1)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        self._create_funnels(8, versions_per_funnel=4, pages_per_version=3)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(large), len(small))
+        # Presupuesto: tenant del usuario, embudos, versiones y páginas.
+        self.assertLessEqual(len(large), 4)
+        self.assertEqual(len(response.data[-1]['versions'][0]['pages']), 3)
+
+    def test_list_rebuilds_delta_versions_without_extra_queries(self):
+        from funnels.models import PAGE_SCHEMAS_KEY
+        from funnels.versioning import create_funnel_version, schema_cache
+        # La caché de schemas es por id de versión y los ids se reutilizan entre tests.
+        schema_cache.clear()
+
+        def create_delta_funnels(count):
+            for i in range(count):
+                funnel = Funnel.objects.create(tenant=self.tenant, name=f"Delta Funnel {i}")
+                for number in range(3):
+                    blocks = [{"id": f"b{n}", "text": "x" * 50} for n in range(20)]
+                    schema = {PAGE_SCHEMAS_KEY: [{"title": f"{i}-{number}", "blocks": blocks}]}
+                    version = create_funnel_version(funnel, schema)
+                    FunnelPage.objects.create(funnel_version=version, page_type='landing', order_index=0)
+
+        create_delta_funnels(1)
+        schema_cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        create_delta_funnels(8)
+        schema_cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+
+        self.assertEqual(FunnelVersion.objects.filter(schema_json__isnull=True).count(), 18)
+        self.assertEqual(len(large), len(small))
+        self.assertLessEqual(len(large), 4)
+        latest = response.data[-1]['versions'][0]
+        self.assertEqual(latest['pages'][0]['page_schema_json']['title'], "7-2")
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+class GenerateTextStreamTests(APITestCase):
+    def setUp(self):
+        ai_interaction_buffer.clear()
+        from django.core.cache import cache
+        from ai.services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        self.tenant = Tenant.objects.create(name="Studio Tenant")
+        self.user = User.objects.create_user(email='studio@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def test_stream_ends_with_the_full_result_and_one_interaction(self):
+        from infrastructure.models import AIInteraction
+
+        response = self.client.post('/api/bff/ai/text/stream/', {'prompt': 'Un eslogan'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            body = b''.join(response.streaming_content).decode('utf-8')
+        ai_interaction_buffer.flush()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(body.endswith('event: done\ndata: {"result": "Dummy text for prompt: Un eslogan"}\n\n'))
+        interaction = AIInteraction.objects.get()
+        self.assertEqual(interaction.proveedor_usado, 'DummyProvider')
+        self.assertEqual(interaction.resultado, "Dummy text for prompt: Un eslogan")
+
+    def test_stream_without_provider_answers_503(self):
+        import unittest.mock as mock
+        from ai.services.ai_manager.ai_manager import ai_manager
+
+        with mock.patch.object(ai_manager, 'stream_text_generation', side_effect=RuntimeError("No provider available")):
+            response = self.client.post('/api/bff/ai/text/stream/', {'prompt': 'Un eslogan'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+class GenerateTextViewTests(APITestCase):
+    def setUp(self):
+        ai_interaction_buffer.clear()
+        from django.core.cache import cache
+        from ai.services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        self.tenant = Tenant.objects.create(name="Writer Tenant")
+        self.user = User.objects.create_user(email='writer@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def test_async_view_returns_the_result_and_logs_the_provider(self):
+        from infrastructure.models import AIInteraction
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/bff/ai/text/', {'prompt': 'Un titular'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"result": "Dummy text for prompt: Un titular"})
+        ai_interaction_buffer.flush()
+        interaction = AIInteraction.objects.get()
+        self.assertEqual((interaction.tenant, interaction.proveedor_usado), (self.tenant, 'DummyProvider'))
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+class GenerateTextBatchViewTests(APITestCase):
+    def setUp(self):
+        ai_interaction_buffer.clear()
+        from django.core.cache import cache
+        from ai.services.ai_manager.response_cache import response_cache
+        cache.clear()
+        response_cache.clear_local()
+        self.tenant = Tenant.objects.create(name="Batch Tenant")
+        self.user = User.objects.create_user(email='batch@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def test_returns_one_result_per_prompt_and_logs_them_in_bulk(self):
+        from infrastructure.models import AIInteraction, AIUsageDaily
+
+        prompts = [f"Variante {n}" for n in range(5)]
+        with CaptureQueriesContext(connection) as request_queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/bff/ai/text/batch/', {'prompts': prompts}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['results'],
+            [{"result": f"Dummy text for prompt: {prompt}", "error": None} for prompt in prompts]
+        )
+        # La petición no escribe: las interacciones esperan en el buffer.
+        self.assertFalse([query for query in request_queries.captured_queries if query['sql'].startswith('INSERT')])
+
+        with CaptureQueriesContext(connection) as flush_queries:
+            self.assertEqual(ai_interaction_buffer.flush(), 5)
+        self.assertEqual(AIInteraction.objects.filter(tenant=self.tenant).count(), 5)
+        self.assertEqual(AIInteraction.history.filter(history_user=self.user, history_type='+').count(), 5)
+        inserts = [query for query in flush_queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)  # interacciones + historial + agregado diario
+        usage = AIUsageDaily.objects.get(tenant=self.tenant)
+        self.assertEqual((usage.endpoint, usage.llamadas), ('text_generation_batch', 5))
+
+    def test_rejects_oversized_batches(self):
+        response = self.client.post('/api/bff/ai/text/batch/', {'prompts': ["p"] * 51}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+class GenerateCampaignViewTests(APITestCase):
+    def setUp(self):
+        ai_interaction_buffer.clear()
+        self.tenant = Tenant.objects.create(name="Campaign Tenant")
+        self.user = User.objects.create_user(email='campaign@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def test_returns_the_generated_campaign(self):
+        import unittest.mock as mock
+        from ai.services.ai_manager.ai_manager import ai_manager
+
+        plan = '[{"day": 1, "platform": "instagram", "content": "Hola", "media_suggestion": "foto"}]'
+        with mock.patch.object(ai_manager, 'execute_text_generation', return_value=(plan, 'DummyProvider', None)):
+            response = self.client.post('/api/bff/ai/campaign/', {'business_goal': 'Vender más'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['day'], 1)
+
+    def test_rate_limited_campaign_answers_429(self):
+        import unittest.mock as mock
+        from ai.services.ai_manager.ai_manager import ai_manager
+        from ai.services.ai_manager.rate_limit import RateLimitExceeded
+
+        with mock.patch.object(ai_manager, 'execute_text_generation', side_effect=RateLimitExceeded('tenant', 12)):
+            response = self.client.post('/api/bff/ai/campaign/', {'business_goal': 'Vender más'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '12')
+
+
+class AIUsageViewTests(APITestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Usage Tenant")
+        self.user = User.objects.create_user(email='usage@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=self.user)
+
+    def test_lists_endpoints_by_tokens_for_the_tenant_only(self):
+        import datetime
+        from django.utils import timezone
+        from infrastructure.models import AIUsageDaily
+
+        today = timezone.localdate()
+        other_tenant = Tenant.objects.create(name="Other")
+        AIUsageDaily.objects.bulk_create([
+            AIUsageDaily(tenant=self.tenant, fecha=today, endpoint='text_generation', proveedor='P', llamadas=2, tokens_prompt=10, tokens_respuesta=20, costo='0.5'),
+            AIUsageDaily(tenant=self.tenant, fecha=today - datetime.timedelta(days=1), endpoint='text_generation', proveedor='Q', llamadas=1, tokens_prompt=5, tokens_respuesta=5),
+            AIUsageDaily(tenant=self.tenant, fecha=today, endpoint='automatic_campaign', proveedor='P', llamadas=1, tokens_prompt=100, tokens_respuesta=300, costo='1'),
+            AIUsageDaily(tenant=self.tenant, fecha=today - datetime.timedelta(days=40), endpoint='image_generation', proveedor='P', llamadas=9, tokens_prompt=999),
+            AIUsageDaily(tenant=other_tenant, fecha=today, endpoint='text_generation', proveedor='P', llamadas=7, tokens_prompt=7000),
+        ])
+
+        response = self.client.get('/api/bff/ai/usage/', {'days': 30})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        endpoints = [(row['endpoint'], row['calls'], row['total_tokens']) for row in response.data['endpoints']]
+        self.assertEqual(endpoints, [('automatic_campaign', 1, 400), ('text_generation', 3, 40)])
+        self.assertEqual(float(response.data['spent_today']), 1.5)
+        self.assertIsNone(response.data['daily_budget'])
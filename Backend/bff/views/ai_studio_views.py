@@ -1,35 +1,105 @@
 # bff/views/ai_studio_views.py
+import datetime
+
+from django.db.models import F, Sum
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from bff.serializers.ai_studio_serializers import GenerateTextSerializer, GenerateImageSerializer, GenerateVideoSerializer
-from domain.services import text_generation_service, image_generation_service, video_generation_service
-from infrastructure.models import AsyncTask
-
-class GenerateTextView(APIView):
+from ai.http import provider_error_response
+from ai.services.ai_manager.usage import get_usage_settings, spend_guard
+from bff.serializers.ai_studio_serializers import (
+    GenerateTextSerializer, GenerateTextBatchSerializer, GenerateImageSerializer, GenerateVideoSerializer
+)
+from domain.services import (
+    text_generation_service, image_generation_service, video_generation_service, campaign_generation_service
+)
+from infrastructure.models import AIUsageDaily, AsyncTask
+from shared.http import sse_event, sse_response
+from shared.views import AsyncAPIView
+
+class GenerateTextView(AsyncAPIView):
     """
     Vista del BFF para el Asistente de Redacción (Generación de Texto).
     """
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         serializer = GenerateTextSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
             try:
-                result = text_generation_service.generate_text_with_memory(
+                result = await text_generation_service.agenerate_text_with_memory(
                     user=request.user,
                     prompt=data['prompt'],
                     model=data.get('model', 'default-text-model') # El AIManager elegirá
                 )
                 return Response({"result": result}, status=status.HTTP_200_OK)
             except RuntimeError as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return provider_error_response(e, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class GenerateTextStreamView(APIView):
+    """
+    Igual que GenerateTextView pero emite el texto como server-sent events:
+    un evento por fragmento y un evento 'done' con el resultado completo.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = GenerateTextSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        try:
+            stream = text_generation_service.stream_text_with_memory(
+                user=request.user,
+                prompt=data['prompt'],
+                model=data.get('model', 'default-text-model')
+            )
+        except RuntimeError as e:
+            return provider_error_response(e)
+
+        def events():
+            chunks = []
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield sse_event({"text": chunk})
+            except RuntimeError as e:
+                yield sse_event({"error": str(e)}, event='error')
+                return
+            yield sse_event({"result": text_generation_service.sanitize_ai_output(''.join(chunks))}, event='done')
+
+        return sse_response(events())
+
+
+class GenerateTextBatchView(APIView):
+    """
+    Genera varios textos (hasta GenerateTextBatchSerializer.MAX_PROMPTS) en una
+    sola llamada por lotes al proveedor. Un elemento fallido no invalida el resto.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = GenerateTextBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        try:
+            results = text_generation_service.generate_text_batch_with_memory(
+                user=request.user,
+                prompts=data['prompts'],
+                model=data.get('model', 'default-text-model')
+            )
+        except RuntimeError as e:
+            return provider_error_response(e, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class GenerateImageView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -45,7 +115,7 @@ class GenerateImageView(APIView):
                 )
                 return Response({"asset_id": asset.id, "content_url": asset.content}, status=status.HTTP_201_CREATED)
             except RuntimeError as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return provider_error_response(e, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -68,7 +138,7 @@ class GenerateCampaignView(APIView):
             )
             return Response(campaign_json, status=status.HTTP_200_OK)
         except RuntimeError as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return provider_error_response(e, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class GenerateVideoView(APIView):
@@ -98,3 +168,42 @@ class VideoStatusView(APIView):
             })
         except AsyncTask.DoesNotExist:
             return Response({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class AIUsageView(APIView):
+    """
+    Consumo de IA del tenant en los últimos `days` días (máx. 90), por
+    endpoint y de mayor a menor consumo de tokens, más el gasto de hoy frente
+    al presupuesto diario. Lo aún pendiente en el buffer de interacciones no
+    aparece hasta el siguiente vaciado.
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_DAYS = 90
+
+    def get(self, request, *args, **kwargs):
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), self.MAX_DAYS)
+        except ValueError:
+            return Response({"error": "days must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        tenant_id = request.user.tenant_id
+        today = timezone.localdate()
+        rows = AIUsageDaily.objects.filter(
+            tenant_id=tenant_id, fecha__gt=today - datetime.timedelta(days=days)
+        ).values('endpoint').annotate(
+            calls=Sum('llamadas'),
+            cached_calls=Sum('llamadas_cache'),
+            errors=Sum('errores'),
+            prompt_tokens=Sum('tokens_prompt'),
+            completion_tokens=Sum('tokens_respuesta'),
+            total_tokens=Sum(F('tokens_prompt') + F('tokens_respuesta')),
+            cost=Sum('costo'),
+        ).order_by('-total_tokens', 'endpoint')
+
+        budget = spend_guard.budget_for(get_usage_settings(), tenant_id)
+        return Response({
+            "days": days,
+            "endpoints": list(rows),
+            "spent_today": spend_guard.spent_today(tenant_id),
+            "daily_budget": budget,
+        }, status=status.HTTP_200_OK)
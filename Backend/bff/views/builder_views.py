@@ -8,6 +8,7 @@ from bff.serializers.funnel_serializers import FunnelSerializer
 from domain.services import funnel_service
 from infrastructure.models import Pagina, Bloque
 from bff.serializers.funnel_serializers import PaginaSerializer, BloqueSerializer
+from bff.views.public_views import materialize_public_landing_page
 
 class EmbudoViewSet(viewsets.ModelViewSet):
     """
@@ -23,7 +24,7 @@ class EmbudoViewSet(viewsets.ModelViewSet):
         # Asumiendo que Embudo tiene una FK a Tenant.
         # Filtra los embudos para que solo pertenezcan al tenant del usuario.
         user_tenant = self.request.user.tenant
-        return Funnel.objects.filter(tenant=user_tenant)
+        return FunnelSerializer.setup_eager_loading(Funnel.objects.filter(tenant=user_tenant))
 
     def retrieve(self, request, *args, **kwargs):
         tenant_id = request.user.tenant.id
@@ -53,7 +54,8 @@ class EmbudoViewSet(viewsets.ModelViewSet):
         Acción para publicar una Landing Page asociada a un embudo.
         """
         try:
-            funnel_service.publish_funnel(request.user.tenant, pk)
+            landing_page = funnel_service.publish_funnel(request.user.tenant, pk)
+            materialize_public_landing_page(landing_page.slug)
             return Response({"status": "published"}, status=status.HTTP_200_OK)
         except ValueError as e:
             return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
@@ -5,9 +5,11 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 
-from domain.services.funnel_service import get_full_funnel_builder_data, create_new_funnel_version
+from domain.services.funnel_service import get_full_funnel_builder_data
 from bff.serializers.funnel_builder_serializers import FunnelBuilderDataSerializer, FunnelContentSerializer
 from funnels.models import Funnel, FunnelVersion, FunnelPublication, LandingPage
+from funnels.publishing import publish_version
+from funnels.versioning import create_funnel_version
 from django.db import transaction
 
 class FunnelBuilderDataView(APIView):
@@ -28,7 +30,7 @@ class FunnelCreateView(APIView):
         try:
             landing_page = get_object_or_404(LandingPage, id=lp_id, subcategoria__categoria__cadena__tenant=tenant)
             new_funnel = Funnel.objects.create(tenant=tenant, landing_page=landing_page, name=funnel_name)
-            create_new_funnel_version(funnel=new_funnel, schema_json=funnel_schema)
+            create_funnel_version(new_funnel, funnel_schema)
             serializer = FunnelContentSerializer(new_funnel)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except LandingPage.DoesNotExist:
@@ -41,7 +43,7 @@ class FunnelSchemaUpdateView(APIView):
         funnel_schema = request.data
         try:
             funnel = get_object_or_404(Funnel, id=funnel_id, tenant=tenant)
-            create_new_funnel_version(funnel=funnel, schema_json=funnel_schema)
+            create_funnel_version(funnel, funnel_schema)
             return Response({"status": "Funnel version saved successfully."}, status=status.HTTP_200_OK)
         except Funnel.DoesNotExist:
             return Response({"error": "Funnel not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -55,10 +57,10 @@ class FunnelPublishView(APIView):
         try:
             funnel = get_object_or_404(Funnel, id=funnel_id, tenant=tenant)
             version_to_publish = get_object_or_404(FunnelVersion, id=version_id, funnel=funnel)
-            funnel.publications.update(is_active=False)
-            publication = FunnelPublication.objects.create(funnel=funnel, version=version_to_publish, is_active=True)
-            funnel.status = 'published'
-            funnel.save()
+            try:
+                publication = publish_version(funnel, version_to_publish)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             return Response({"status": "Funnel publicado exitosamente.", "public_url_slug": publication.public_url_slug}, status=status.HTTP_200_OK)
         except (Funnel.DoesNotExist, FunnelVersion.DoesNotExist):
             return Response({"error": "Funnel o versión no encontrada."}, status=status.HTTP_404_NOT_FOUND)
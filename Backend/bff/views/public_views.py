@@ -2,18 +2,56 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from domain.services import funnel_service
+from infrastructure.models import LandingPage
+from shared.http import materialize_json, etag_json_response
 from bff.serializers.funnel_serializers import LandingPagePublicSerializer
 
+def materialize_public_landing_page(slug: str) -> tuple:
+    """
+    Renderiza la estructura pública del embudo y la guarda en su LandingPage.
+    Se invoca al publicar; las peticiones públicas ya no pasan por los serializadores.
+    """
+    landing_page = LandingPagePublicSerializer.setup_eager_loading(
+        LandingPage.objects.filter(slug=slug, estado='publicado')
+    ).first()
+    if landing_page is None:
+        raise ValueError("Funnel not found.")
+    body, etag = materialize_json(LandingPagePublicSerializer(landing_page).data)
+    LandingPage.objects.filter(id=landing_page.id).update(published_payload=body, published_etag=etag)
+    return body, etag
+
+def invalidate_public_landing_page(**lookup):
+    """
+    Descarta la respuesta materializada de las landing pages que cumplan
+    `lookup` tras editar su contenido publicado (ver bff/signals.py); la
+    siguiente petición pública la vuelve a renderizar con un ETag nuevo.
+    """
+    LandingPage.objects.filter(**lookup).exclude(published_etag='').update(published_payload='', published_etag='')
+
 class PublicFunnelView(APIView):
     """
     Vista pública para obtener la estructura completa de un embudo por su slug.
+    Sirve la respuesta materializada al publicar, con ETag y Cache-Control.
     No requiere autenticación.
     """
+    authentication_classes = []
+    permission_classes = []
+
     def get(self, request, slug, *args, **kwargs):
-        try:
-            embudo = funnel_service.get_public_funnel_by_slug(slug)
-            serializer = LandingPagePublicSerializer(embudo.landing_page)
-            return Response(serializer.data)
-        except ValueError as e:
-            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        row = (
+            LandingPage.objects.filter(slug=slug, estado='publicado')
+            .values_list('published_etag', 'published_payload')
+            .first()
+        )
+        if row is None:
+            return Response({"error": "Funnel not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag, body = row
+        if not etag:
+            # Landing publicada antes de la materialización: se renderiza una vez.
+            try:
+                body, etag = materialize_public_landing_page(slug)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        return etag_json_response(request, body, etag)
@@ -1,7 +1,11 @@
 # domain/services/campaign_generation_service.py
 import json
-from infrastructure.models import User, AIInteraction
+from infrastructure.models import User
+from ai.buffers import record_interaction
 from ai.services.ai_manager.ai_manager import ai_manager
+from ai.services.ai_manager.rate_limit import RateLimitExceeded
+
+CAMPAIGN_MODEL = 'gemini-1.5-flash'
 
 def _is_valid_campaign_json(data: str) -> bool:
     """Valida si el string es un JSON con la estructura de campaña esperada."""
@@ -26,9 +30,14 @@ def generate_automatic_campaign(user: User, business_goal: str, max_retries: int
     for attempt in range(max_retries):
         raw_result = ""
         error_message = ""
+        provider_name = 'default'
+        usage = None
         try:
             # 1. Generar el resultado
-            raw_result = ai_manager.execute_text_generation(prompt=prompt, model='gemini-1.5-flash') # Modelo puede ser dinámico
+            # Los reintentos no usan la caché: devolvería la misma respuesta inválida.
+            raw_result, provider_name, usage = ai_manager.execute_text_generation(
+                prompt=prompt, model=CAMPAIGN_MODEL, use_cache=attempt == 0, tenant_id=user.tenant_id
+            ) # Modelo puede ser dinámico
 
             # 2. Validar
             if _is_valid_campaign_json(raw_result):
@@ -37,18 +46,24 @@ def generate_automatic_campaign(user: User, business_goal: str, max_retries: int
                 error_message = "Invalid JSON structure received from AI."
                 print(f"Attempt {attempt + 1} failed: {error_message}")
 
+        except RateLimitExceeded as e:
+            # Reintentar sin cupo solo gastaría más intentos.
+            error_message = str(e)
+            raise
         except RuntimeError as e:
             error_message = str(e)
             print(f"Attempt {attempt + 1} failed with runtime error: {e}")
         finally:
             # 3. Registrar cada intento
-            AIInteraction.objects.create(
-                tenant=user.tenant,
-                user=user,
-                proveedor_usado='default',
+            record_interaction(
+                user,
+                proveedor_usado=provider_name,
+                modelo=CAMPAIGN_MODEL,
+                endpoint='automatic_campaign',
                 prompt_original=prompt,
                 resultado=raw_result,
-                errores=error_message
+                errores=error_message,
+                usage=usage
             )
 
     raise RuntimeError(f"Failed to generate a valid campaign after {max_retries} attempts.")
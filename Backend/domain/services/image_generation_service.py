@@ -1,5 +1,6 @@
 # domain/services/image_generation_service.py
-from infrastructure.models import User, AIInteraction, ContentAsset
+from infrastructure.models import User, ContentAsset
+from ai.buffers import record_interaction
 from ai.services.ai_manager.ai_manager import ai_manager
 
 def generate_image_with_memory(user: User, prompt: str, model: str) -> ContentAsset:
@@ -9,8 +10,10 @@ def generate_image_with_memory(user: User, prompt: str, model: str) -> ContentAs
     """
     result_url = ""
     error_message = ""
+    provider_name = 'default_image'
+    usage = None
     try:
-        result_url = ai_manager.execute_image_generation(prompt=prompt, model=model)
+        result_url, provider_name, usage = ai_manager.execute_image_generation(prompt=prompt, model=model, tenant_id=user.tenant_id)
         if not result_url:
             raise RuntimeError("AI provider did not return an image.")
 
@@ -24,11 +27,13 @@ def generate_image_with_memory(user: User, prompt: str, model: str) -> ContentAs
         error_message = str(e)
         raise
     finally:
-        AIInteraction.objects.create(
-            tenant=user.tenant,
-            user=user,
-            proveedor_usado='default_image',
+        record_interaction(
+            user,
+            proveedor_usado=provider_name,
+            modelo=model,
+            endpoint='image_generation',
             prompt_original=prompt,
             resultado=result_url or "",
-            errores=error_message
+            errores=error_message,
+            usage=usage
         )
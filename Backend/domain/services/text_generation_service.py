@@ -1,9 +1,13 @@
 # domain/services/text_generation_service.py
 import re
-from infrastructure.models import User, AIInteraction
+import time
+from typing import Iterator, List
+from infrastructure.models import User
+from ai.buffers import record_interaction, arecord_interaction
 from ai.services.ai_manager.ai_manager import ai_manager
+from ai.services.ai_manager.usage import TokenUsage
 
-def _sanitize_ai_output(text: str) -> str:
+def sanitize_ai_output(text: str) -> str:
     """Limpia la salida de texto de la IA, removiendo bloques de código y espacios."""
     text = re.sub(r'```(json|markdown)?', '', text)
     text = text.strip()
@@ -20,22 +24,117 @@ def generate_text_with_memory(
     """
     result = ""
     error_message = ""
-    interaction = None
+    provider_name = 'default'
+    usage = None
     try:
         # 1. Llamar al orquestador de IA
-        result = ai_manager.execute_text_generation(prompt=prompt, model=model)
-        result = _sanitize_ai_output(result)
+        result, provider_name, usage = ai_manager.execute_text_generation(prompt=prompt, model=model, tenant_id=user.tenant_id)
+        result = sanitize_ai_output(result)
         return result
     except RuntimeError as e:
         error_message = str(e)
         raise
     finally:
-        # 2. Registrar la interacción (siempre)
-        interaction = AIInteraction.objects.create(
-            tenant=user.tenant,
-            user=user,
-            proveedor_usado='default', # El AIManager podría exponer esto
+        # 2. Registrar la interacción (siempre; se escribe en segundo plano)
+        record_interaction(
+            user,
+            proveedor_usado=provider_name,
+            modelo=model,
+            endpoint='text_generation',
             prompt_original=prompt,
             resultado=result,
-            errores=error_message
+            errores=error_message,
+            usage=usage
         )
+
+
+async def agenerate_text_with_memory(
+    user: User,
+    prompt: str,
+    model: str,
+    task: str = "text"
+) -> str:
+    """Versión async de generate_text_with_memory, para las vistas servidas bajo ASGI."""
+    result = ""
+    error_message = ""
+    provider_name = 'default'
+    usage = None
+    try:
+        result, provider_name, usage = await ai_manager.aexecute_text_generation(prompt=prompt, model=model, tenant_id=user.tenant_id)
+        result = sanitize_ai_output(result)
+        return result
+    except RuntimeError as e:
+        error_message = str(e)
+        raise
+    finally:
+        await arecord_interaction(
+            user,
+            proveedor_usado=provider_name,
+            modelo=model,
+            endpoint='text_generation',
+            prompt_original=prompt,
+            resultado=result,
+            errores=error_message,
+            usage=usage
+        )
+
+
+def generate_text_batch_with_memory(user: User, prompts: List[str], model: str) -> List[dict]:
+    """
+    Genera un texto por prompt con una sola llamada por lotes al AIManager y
+    registra una interacción por elemento (el buffer las inserta en bloque).
+    Devuelve, en orden, {"result": texto o None, "error": mensaje o None}.
+    """
+    items = ai_manager.execute_text_generation_batch(prompts=prompts, model=model, tenant_id=user.tenant_id)
+    results = []
+    for prompt, item in zip(prompts, items):
+        result = sanitize_ai_output(item.text) if item.error is None else ""
+        record_interaction(
+            user,
+            proveedor_usado=item.provider_name or 'default',
+            modelo=model,
+            endpoint='text_generation_batch',
+            prompt_original=prompt,
+            resultado=result,
+            errores=item.error or "",
+            usage=item.usage
+        )
+        results.append({"result": result if item.error is None else None, "error": item.error})
+    return results
+
+
+def stream_text_with_memory(user: User, prompt: str, model: str) -> Iterator[str]:
+    """
+    Variante en streaming de generate_text_with_memory. Los errores al elegir
+    proveedor se lanzan antes del primer fragmento; la interacción se registra
+    una sola vez, cuando el stream termina, falla o el cliente lo abandona.
+    """
+    started = time.monotonic()
+    stream, provider_name = ai_manager.stream_text_generation(prompt=prompt, model=model, tenant_id=user.tenant_id)
+
+    def generate():
+        chunks = []
+        error_message = ""
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        except RuntimeError as e:
+            error_message = str(e)
+            raise
+        except GeneratorExit:
+            error_message = "Stream cancelado por el cliente."
+            raise
+        finally:
+            record_interaction(
+                user,
+                proveedor_usado=provider_name,
+                modelo=model,
+                endpoint='text_generation_stream',
+                prompt_original=prompt,
+                resultado=sanitize_ai_output(''.join(chunks)),
+                errores=error_message,
+                usage=TokenUsage.estimate(prompt, ''.join(chunks), time.monotonic() - started)
+            )
+
+    return generate()
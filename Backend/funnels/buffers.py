@@ -0,0 +1,7 @@
+# funnels/buffers.py
+from shared.buffers import WriteBehindBuffer
+
+# Telemetría append-only de los endpoints públicos: se escribe en segundo plano
+# con bulk_create en lugar de un INSERT por petición.
+lead_event_buffer = WriteBehindBuffer('funnels.LeadEvent')
+funnel_event_buffer = WriteBehindBuffer('funnels.FunnelEvent')
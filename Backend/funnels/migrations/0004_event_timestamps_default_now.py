@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 06:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0003_lead_leadevent_leadstate"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="funnelevent",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="leadevent",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
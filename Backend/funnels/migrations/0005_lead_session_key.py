@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0004_event_timestamps_default_now"),
+        ("infrastructure", "0006_alter_user_options_alter_user_managers_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lead",
+            name="session_key",
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="lead",
+            index=models.Index(
+                fields=["funnel", "session_key"], name="funnels_lead_session_idx"
+            ),
+        ),
+    ]
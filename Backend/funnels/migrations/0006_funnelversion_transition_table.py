@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0005_lead_session_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="funnelversion",
+            name="transition_table",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0006_funnelversion_transition_table"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="funnelpublication",
+            name="payload_etag",
+            field=models.CharField(blank=True, default="", max_length=66),
+        ),
+        migrations.AddField(
+            model_name="funnelpublication",
+            name="rendered_payload",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
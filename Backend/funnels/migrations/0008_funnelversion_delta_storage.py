@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0007_funnelpublication_payload_etag_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="funnelversion",
+            name="base_version",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.RESTRICT,
+                related_name="deltas",
+                to="funnels.funnelversion",
+            ),
+        ),
+        migrations.AddField(
+            model_name="funnelversion",
+            name="delta_depth",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="funnelversion",
+            name="schema_delta",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="funnelversion",
+            name="schema_json",
+            field=models.JSONField(blank=True, default=dict, null=True),
+        ),
+    ]
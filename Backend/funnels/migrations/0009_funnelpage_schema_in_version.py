@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("funnels", "0008_funnelversion_delta_storage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="funnelpage",
+            name="page_schema_json",
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
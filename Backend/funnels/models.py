@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from infrastructure.models import Tenant
 
 class CadenaTurismo(models.Model):
@@ -36,31 +37,97 @@ class Funnel(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     def __str__(self): return self.name
 
+# Clave del schema de la versión con el schema de cada página, por order_index
+PAGE_SCHEMAS_KEY = 'page_schemas'
+
+class FunnelVersionQuerySet(models.QuerySet):
+    """
+    with_schemas() reconstruye en bloque, al evaluar la consulta, los schemas
+    de las versiones guardadas como delta (ver versioning.preload_schemas), en
+    lugar de una consulta por versión al serializar un listado.
+    """
+    _with_schemas = False
+
+    def with_schemas(self):
+        clone = self._chain()
+        clone._with_schemas = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_schemas = self._with_schemas
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super()._fetch_all()
+        if fetched and self._with_schemas and self._iterable_class is models.query.ModelIterable:
+            from .versioning import preload_schemas
+            preload_schemas(self._result_cache)
+
 class FunnelVersion(models.Model):
     funnel = models.ForeignKey(Funnel, on_delete=models.CASCADE, related_name='versions')
     version_number = models.PositiveIntegerField()
-    schema_json = models.JSONField(default=dict)
+    # Schema completo (snapshot). Es nulo cuando la versión se guarda como delta:
+    # usar get_schema() para leerlo (ver funnels/versioning.py).
+    schema_json = models.JSONField(default=dict, null=True, blank=True)
+    # JSON Patch (RFC 6902) respecto de base_version, para versiones guardadas como delta
+    schema_delta = models.JSONField(null=True, blank=True)
+    base_version = models.ForeignKey('self', on_delete=models.RESTRICT, null=True, blank=True, related_name='deltas')
+    # Número de deltas encadenados desde el último snapshot (0 para un snapshot)
+    delta_depth = models.PositiveSmallIntegerField(default=0)
+    # Tabla de transiciones precompilada al publicar (ver funnels/runtime/transitions.py)
+    transition_table = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=False)
+
+    objects = FunnelVersionQuerySet.as_manager()
+
     class Meta:
         unique_together = ('funnel', 'version_number')
         ordering = ['-version_number']
     def __str__(self): return f"{self.funnel.name} - v{self.version_number}"
 
+    @property
+    def is_snapshot(self) -> bool:
+        return self.schema_json is not None
+
+    def get_schema(self) -> dict:
+        """Schema completo de la versión, reconstruido si está guardada como delta."""
+        if self.schema_json is not None:
+            return self.schema_json
+        # Reconstruido por FunnelVersionQuerySet.with_schemas()
+        reconstructed = getattr(self, '_reconstructed_schema', None)
+        if reconstructed is not None:
+            return reconstructed
+        from .versioning import reconstruct_schema
+        return reconstruct_schema(self)
+
 class FunnelPage(models.Model):
     funnel_version = models.ForeignKey(FunnelVersion, on_delete=models.CASCADE, related_name='pages')
     page_type = models.CharField(max_length=100)
-    page_schema_json = models.JSONField(default=dict)
+    # Solo páginas anteriores al almacenamiento delta; las nuevas leen su schema
+    # del de la versión (PAGE_SCHEMAS_KEY), que se guarda como delta.
+    page_schema_json = models.JSONField(null=True, blank=True, default=None)
     order_index = models.PositiveIntegerField()
     class Meta: ordering = ['order_index']
     def __str__(self): return f"Page {self.order_index} ({self.page_type}) for {self.funnel_version}"
 
+    def get_page_schema(self) -> dict:
+        if self.page_schema_json is not None:
+            return self.page_schema_json
+        page_schemas = self.funnel_version.get_schema().get(PAGE_SCHEMAS_KEY, [])
+        return page_schemas[self.order_index] if self.order_index < len(page_schemas) else {}
+
 class FunnelPublication(models.Model):
     funnel = models.ForeignKey(Funnel, on_delete=models.CASCADE, related_name='publications')
     version = models.ForeignKey(FunnelVersion, on_delete=models.CASCADE, related_name='publications')
     public_url_slug = models.SlugField(unique=True, default=uuid.uuid4)
     published_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    # Respuesta pública renderizada al publicar (la versión publicada es inmutable)
+    rendered_payload = models.TextField(blank=True, default='')
+    payload_etag = models.CharField(max_length=66, blank=True, default='')
     def __str__(self): return f"Publication of {self.funnel.name} v{self.version.version_number} at /{self.public_url_slug}"
 
 class LeadCapture(models.Model):
@@ -77,7 +144,9 @@ class FunnelEvent(models.Model):
     version = models.ForeignKey(FunnelVersion, on_delete=models.CASCADE, related_name='events')
     event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
     metadata_json = models.JSONField(default=dict)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # default en lugar de auto_now_add: la fila se inserta en diferido y debe
+    # conservar el instante del evento, no el del vaciado del buffer.
+    created_at = models.DateTimeField(default=timezone.now)
     def __str__(self): return f"Event '{self.event_type}' on {self.funnel.name}"
 
 # Importar los modelos de runtime al final para evitar importaciones circulares.
@@ -0,0 +1,43 @@
+# funnels/publishing.py
+from django.db import transaction
+from shared.http import materialize_json
+from .models import Funnel, FunnelVersion, FunnelPublication
+from .serializers import FunnelVersionSerializer
+from .runtime.cache import invalidate_published_funnel
+from .runtime.transitions import store_transition_table
+from .versioning import materialize_version
+
+@transaction.atomic
+def publish_version(funnel: Funnel, version: FunnelVersion) -> FunnelPublication:
+    """
+    Publica una versión de un embudo. Todo lo que el tráfico público necesita
+    se calcula aquí, una sola vez: la tabla de transiciones del runtime y la
+    respuesta JSON de PublicFunnelView con su ETag, y el schema completo si la
+    versión estaba guardada como delta.
+    Lanza ValueError si el schema de la versión no es publicable.
+    """
+    materialize_version(version)
+    store_transition_table(version)
+
+    # Desactivar publicaciones anteriores de este funnel
+    funnel.publications.update(is_active=False)
+    invalidate_published_funnel(funnel.id)
+
+    rendered_payload, payload_etag = render_public_payload(version)
+    publication = FunnelPublication.objects.create(
+        funnel=funnel,
+        version=version,
+        is_active=True,
+        rendered_payload=rendered_payload,
+        payload_etag=payload_etag
+    )
+
+    # Actualizar el estado del funnel
+    funnel.status = 'published'
+    funnel.save()
+
+    return publication
+
+
+def render_public_payload(version: FunnelVersion) -> tuple:
+    return materialize_json(FunnelVersionSerializer(version).data)
@@ -0,0 +1,143 @@
+# funnels/runtime/cache.py
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from funnels.models import FunnelPublication
+from .transitions import TABLE_FORMAT_VERSION, compile_transition_table, evaluate_transition
+
+# Tiempo máximo (segundos) que un grafo compilado vive en memoria. Acota cuánto
+# tarda otro proceso en ver una publicación desactivada.
+DEFAULT_TTL_SECONDS = 300
+
+
+@dataclass(frozen=True)
+class CompiledFunnel:
+    """
+    Representación inmutable y precompilada de una versión publicada de un embudo.
+    Contiene todo lo que el motor necesita para procesar un evento sin volver a
+    consultar las tablas de publicación ni recorrer el schema_json.
+    """
+    publication_slug: str
+    publication_id: int
+    funnel_id: int
+    tenant_id: int
+    version_id: int
+    start_page_id: Optional[str]
+    pages: Mapping[str, dict]
+    blocks: Mapping[str, str]  # block_id -> page_id
+    transition_table: Mapping  # ver funnels/runtime/transitions.py; no debe mutarse
+    terminal_pages: frozenset
+
+    def has_page(self, page_id: str) -> bool:
+        return page_id in self.pages
+
+    def is_terminal(self, page_id: str) -> bool:
+        return page_id in self.terminal_pages
+
+    def transition(self, page_id: str, event_type: str, context: dict) -> Optional[str]:
+        return evaluate_transition(self.transition_table, page_id, event_type, context)
+
+
+def compile_funnel(publication: FunnelPublication) -> CompiledFunnel:
+    """
+    Recorre una única vez el schema_json de la versión publicada y construye
+    los índices de páginas y bloques. La tabla de transiciones se toma de la
+    versión (compilada al publicar); solo se compila aquí para publicaciones
+    anteriores a ella.
+    """
+    version = publication.version
+    schema = version.get_schema() or {}
+    raw_pages = [page for page in schema.get('pages', []) if isinstance(page, dict) and page.get('id')]
+
+    pages = {}
+    blocks = {}
+    for page in raw_pages:
+        page_id = str(page['id'])
+        pages[page_id] = page
+        for block in page.get('blocks', []) or []:
+            if isinstance(block, dict) and block.get('id'):
+                blocks[str(block['id'])] = page_id
+
+    table = version.transition_table
+    if not table or table.get('format') != TABLE_FORMAT_VERSION:
+        table = compile_transition_table(schema)
+
+    return CompiledFunnel(
+        publication_slug=str(publication.public_url_slug),
+        publication_id=publication.id,
+        funnel_id=publication.funnel_id,
+        tenant_id=publication.funnel.tenant_id,
+        version_id=publication.version_id,
+        start_page_id=table['start'],
+        pages=MappingProxyType(pages),
+        blocks=MappingProxyType(blocks),
+        transition_table=MappingProxyType(table),
+        terminal_pages=frozenset(table['terminal']),
+    )
+
+
+class CompiledFunnelCache:
+    """
+    Caché en memoria, por proceso, de embudos publicados compilados,
+    indexada por public_url_slug.
+    """
+    def __init__(self):
+        self._entries = {}  # slug -> (expires_at, CompiledFunnel)
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> float:
+        return getattr(settings, 'FUNNEL_RUNTIME_CACHE_TTL', DEFAULT_TTL_SECONDS)
+
+    def get(self, publication_slug: str) -> CompiledFunnel:
+        """
+        Devuelve el embudo compilado para el slug. Solo consulta la base de datos
+        si no está en caché o si la entrada expiró.
+        Lanza ValueError si no existe una publicación activa con ese slug.
+        """
+        slug = str(publication_slug)
+        now = time.monotonic()
+        entry = self._entries.get(slug)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        try:
+            publication = FunnelPublication.objects.select_related('funnel', 'version').get(
+                public_url_slug=slug, is_active=True
+            )
+        except FunnelPublication.DoesNotExist:
+            raise ValueError(f"Active publication with slug '{slug}' not found.")
+
+        compiled = compile_funnel(publication)
+        with self._lock:
+            self._entries[slug] = (now + self.ttl, compiled)
+        return compiled
+
+    def invalidate_funnel(self, funnel_id: int):
+        """Elimina de la caché todas las publicaciones de un embudo."""
+        with self._lock:
+            stale = [slug for slug, (_, compiled) in self._entries.items() if compiled.funnel_id == funnel_id]
+            for slug in stale:
+                del self._entries[slug]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instancia global para ser usada por el motor y las vistas de publicación
+compiled_funnel_cache = CompiledFunnelCache()
+
+
+def invalidate_published_funnel(funnel_id: int):
+    """
+    Invalida la caché del embudo cuando la transacción que desactiva sus
+    publicaciones se confirma, para no volver a poblarla con datos viejos.
+    """
+    transaction.on_commit(lambda: compiled_funnel_cache.invalidate_funnel(funnel_id))
@@ -1,50 +1,146 @@
 # funnels/runtime/engine.py
 from django.db import transaction
 from .events import FunnelEventType, is_event_supported
-from .executor import execute_form_submit, find_start_page_id
-from funnels.models import FunnelPublication, FunnelVersion, Lead, LeadState, LeadEvent
+from .executor import execute_form_submit, build_form_submit, execute_page_view
+from .cache import compiled_funnel_cache
+from .sessions import remember_lead_session
+from funnels.models import Lead, LeadState, LeadEvent
+from funnels.buffers import lead_event_buffer
 
 @transaction.atomic
 def process_event(publication_slug: str, event_type: str, payload: dict):
     """
     Punto de entrada principal del motor de ejecución.
-    Procesa un evento para un embudo publicado.
+    Procesa un evento para un embudo publicado y devuelve el id del lead
+    afectado (o None si el evento no está asociado a ningún lead).
     """
     if not is_event_supported(event_type):
         raise ValueError(f"Event type '{event_type}' is not supported.")
 
-    try:
-        publication = FunnelPublication.objects.select_related('funnel', 'version').get(public_url_slug=publication_slug, is_active=True)
-    except FunnelPublication.DoesNotExist:
-        raise ValueError(f"Active publication with slug '{publication_slug}' not found.")
+    # El grafo compilado se sirve desde la caché del proceso; solo la primera
+    # petición (o la que sigue a una invalidación) consulta las publicaciones.
+    funnel = compiled_funnel_cache.get(publication_slug)
+    session_key = payload.get('session_key')
 
-    funnel = publication.funnel
-    version = publication.version
-    schema = version.schema_json
-
-    # Para el MVP, nos centramos en el evento que crea un Lead.
     if event_type == FunnelEventType.FORM_SUBMIT:
         # El executor se encarga de la lógica específica del evento
         lead, lead_state = execute_form_submit(
-            tenant=funnel.tenant,
             funnel=funnel,
-            version=version,
             form_data=payload.get('form_data', {}),
-            page_id=payload.get('page_id')
+            page_id=payload.get('page_id'),
+            session_key=session_key
         )
+        lead_id = lead.id
+        if session_key:
+            transaction.on_commit(lambda: remember_lead_session(funnel.funnel_id, session_key, lead_id))
 
-        # Registrar el evento
-        LeadEvent.objects.create(
-            lead=lead,
-            event_type=event_type,
-            payload=payload,
-            page_id=lead_state.current_page_id
-        )
+    elif event_type == FunnelEventType.PAGE_VIEW:
+        # Sin lead (visitante que aún no envió un formulario) no hay estado que avanzar.
+        lead_id = execute_page_view(funnel, payload.get('page_id'), session_key)
+        if not lead_id:
+            return None
+
+    else:
+        return None
+
+    # Registrar el evento (write-behind: se inserta en lote tras el commit)
+    lead_event_buffer.add(LeadEvent(
+        lead_id=lead_id,
+        event_type=event_type,
+        payload=payload,
+        page_id=payload.get('page_id')
+    ))
+
+    return lead_id
+
+
+def process_events_batch(events: list) -> list:
+    """
+    Procesa un lote de eventos (de distintos embudos y tipos) en una sola pasada.
+    Cada evento se valida de forma independiente; los válidos se persisten con
+    un bulk_create por tabla dentro de una única transacción.
+    Devuelve un resultado por evento, en el mismo orden de entrada.
+    """
+    results = []
+    leads, lead_states, lead_events = [], [], []
+    # (funnel_id, session_key) -> LeadState creado en este mismo lote
+    batch_sessions = {}
+    deferred_page_views = []
+
+    for index, event in enumerate(events):
+        try:
+            if not isinstance(event, dict):
+                raise ValueError("Each event must be an object.")
+
+            publication_slug = event.get('publication_slug')
+            event_type = event.get('event_type')
+            payload = event.get('payload') or {}
+            if not all([publication_slug, event_type]):
+                raise ValueError("'publication_slug' and 'event_type' are required fields.")
+            if not is_event_supported(event_type):
+                raise ValueError(f"Event type '{event_type}' is not supported.")
+
+            funnel = compiled_funnel_cache.get(publication_slug)
+            session_key = payload.get('session_key')
+            page_id = payload.get('page_id')
+
+            if event_type == FunnelEventType.FORM_SUBMIT:
+                lead, lead_state = build_form_submit(
+                    funnel=funnel,
+                    form_data=payload.get('form_data', {}),
+                    page_id=page_id,
+                    session_key=session_key
+                )
+                leads.append(lead)
+                lead_states.append(lead_state)
+                lead_events.append(LeadEvent(
+                    lead=lead,
+                    event_type=event_type,
+                    payload=payload,
+                    page_id=page_id
+                ))
+                if session_key:
+                    batch_sessions[(funnel.funnel_id, session_key)] = lead_state
+                results.append({"index": index, "status": "processed", "lead_id": lead.id})
+
+            elif event_type == FunnelEventType.PAGE_VIEW:
+                if not page_id:
+                    raise ValueError("page_id is required for PAGE_VIEW.")
+                if not funnel.has_page(page_id):
+                    raise ValueError(f"Page '{page_id}' does not exist in this funnel.")
+
+                result = {"index": index, "status": "received"}
+                pending_state = batch_sessions.get((funnel.funnel_id, session_key)) if session_key else None
+                if pending_state is not None:
+                    # El lead se crea en este mismo lote: basta con ajustar el estado pendiente.
+                    pending_state.current_page_id = page_id
+                    if funnel.is_terminal(page_id):
+                        pending_state.current_status = 'completed'
+                    lead_events.append(LeadEvent(lead=pending_state.lead, event_type=event_type, payload=payload, page_id=page_id))
+                    result.update(status="processed", lead_id=pending_state.lead.id)
+                elif session_key:
+                    deferred_page_views.append((result, funnel, page_id, session_key, event_type, payload))
+                results.append(result)
+
+            else:
+                results.append({"index": index, "status": "received"})
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
 
-        return lead
+    if leads or deferred_page_views:
+        with transaction.atomic():
+            Lead.objects.bulk_create(leads)
+            LeadState.objects.bulk_create(lead_states)
+            for result, funnel, page_id, session_key, event_type, payload in deferred_page_views:
+                lead_id = execute_page_view(funnel, page_id, session_key)
+                if lead_id:
+                    lead_events.append(LeadEvent(lead_id=lead_id, event_type=event_type, payload=payload, page_id=page_id))
+                    result.update(status="processed", lead_id=lead_id)
+            LeadEvent.objects.bulk_create(lead_events)
 
-    # Lógica para otros eventos (ej. PAGE_VIEW) se añadiría aquí.
-    # Por ejemplo, encontrar un lead existente por un ID de sesión en el payload
-    # y actualizar su estado.
+            for (funnel_id, session_key), lead_state in batch_sessions.items():
+                transaction.on_commit(
+                    lambda f=funnel_id, s=session_key, l=lead_state.lead_id: remember_lead_session(f, s, l)
+                )
 
-    return None # O el lead actualizado si corresponde
+    return results
@@ -1,5 +1,8 @@
 # funnels/runtime/executor.py
-from funnels.models import Tenant, Funnel, FunnelVersion, Lead, LeadState
+from django.utils import timezone
+from funnels.models import Lead, LeadState
+from .events import FunnelEventType
+from .sessions import resolve_lead_id, forget_lead_session
 
 def find_start_page_id(schema: dict) -> str | None:
     """
@@ -11,30 +14,77 @@ def find_start_page_id(schema: dict) -> str | None:
         return pages[0].get('id')
     return None
 
-def execute_form_submit(tenant: Tenant, funnel: Funnel, version: FunnelVersion, form_data: dict, page_id: str):
+def build_form_submit(funnel, form_data: dict, page_id: str, session_key: str = None):
     """
-    Ejecuta la lógica para un evento FORM_SUBMIT.
-    Para el MVP, esto siempre crea un nuevo Lead y su estado inicial.
+    Construye (sin guardar) el Lead y su estado inicial para un FORM_SUBMIT.
+    El estado se coloca en la página destino de la transición FORM_SUBMIT
+    de la página donde se envió el formulario (o en ella misma si no hay).
+    Permite que el procesamiento por lotes los persista con bulk_create.
     """
     if not page_id:
         raise ValueError("page_id is required for FORM_SUBMIT.")
+    if not funnel.has_page(page_id):
+        raise ValueError(f"Page '{page_id}' does not exist in this funnel.")
 
-    # 1. Crear el Lead
-    lead = Lead.objects.create(
-        tenant=tenant,
-        funnel=funnel,
-        initial_version=version,
-        form_data=form_data
+    lead = Lead(
+        tenant_id=funnel.tenant_id,
+        funnel_id=funnel.funnel_id,
+        initial_version_id=funnel.version_id,
+        form_data=form_data,
+        session_key=session_key or None
     )
 
-    # 2. Crear el estado inicial del Lead.
-    # Para un FORM_SUBMIT, el estado actual es la página donde se envió el formulario.
-    # En un flujo más complejo, podríamos buscar la siguiente página.
-    lead_state = LeadState.objects.create(
+    context = {"form_data": form_data}
+    next_page_id = funnel.transition(page_id, FunnelEventType.FORM_SUBMIT, context) or page_id
+
+    lead_state = LeadState(
         lead=lead,
-        current_page_id=page_id,
-        current_status='active', # O 'completed' si este es el final del embudo
-        version=version
+        current_page_id=next_page_id,
+        current_status='completed' if funnel.is_terminal(next_page_id) else 'active',
+        execution_context={
+            **context,
+            "last_event": FunnelEventType.FORM_SUBMIT,
+            "submitted_page_id": page_id,
+        },
+        version_id=funnel.version_id
     )
 
     return lead, lead_state
+
+def execute_form_submit(funnel, form_data: dict, page_id: str, session_key: str = None):
+    """
+    Ejecuta la lógica para un evento FORM_SUBMIT sobre un embudo compilado
+    (ver funnels.runtime.cache.CompiledFunnel).
+    Para el MVP, esto siempre crea un nuevo Lead y su estado inicial.
+    """
+    lead, lead_state = build_form_submit(funnel, form_data, page_id, session_key)
+    lead.save(force_insert=True)
+    lead_state.save(force_insert=True)
+    return lead, lead_state
+
+def execute_page_view(funnel, page_id: str, session_key: str):
+    """
+    Ejecuta la lógica para un evento PAGE_VIEW.
+    Resuelve el lead de la sesión y avanza su current_page_id con un UPDATE
+    por clave única (lead_id); si la página es terminal el lead queda completado.
+    Devuelve el id del lead o None si la sesión todavía no tiene un lead
+    (visitante anónimo).
+    """
+    if not page_id:
+        raise ValueError("page_id is required for PAGE_VIEW.")
+    if not funnel.has_page(page_id):
+        raise ValueError(f"Page '{page_id}' does not exist in this funnel.")
+
+    lead_id = resolve_lead_id(funnel.funnel_id, session_key)
+    if not lead_id:
+        return None
+
+    changes = {"current_page_id": page_id, "updated_at": timezone.now()}
+    if funnel.is_terminal(page_id):
+        changes["current_status"] = 'completed'
+    updated = LeadState.objects.filter(lead_id=lead_id).update(**changes)
+    if not updated:
+        # La entrada de la caché apuntaba a un lead que ya no existe.
+        forget_lead_session(funnel.funnel_id, session_key)
+        return None
+    return lead_id
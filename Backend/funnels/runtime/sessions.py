@@ -0,0 +1,52 @@
+# funnels/runtime/sessions.py
+from typing import Optional
+from django.conf import settings
+from django.core.cache import cache
+from funnels.models import Lead
+
+# Los leads de una sesión cambian poco; un TTL corto basta para absorber
+# ráfagas de PAGE_VIEW sin servir datos obsoletos mucho tiempo.
+DEFAULT_TTL_SECONDS = 60
+
+
+def _cache_key(funnel_id: int, session_key: str) -> str:
+    return f"funnels:lead-session:{funnel_id}:{session_key}"
+
+
+def _ttl() -> int:
+    return getattr(settings, 'FUNNEL_LEAD_SESSION_CACHE_TTL', DEFAULT_TTL_SECONDS)
+
+
+def remember_lead_session(funnel_id: int, session_key: str, lead_id):
+    """Registra en la caché el lead asociado a una sesión recién creada."""
+    if session_key:
+        cache.set(_cache_key(funnel_id, session_key), str(lead_id), _ttl())
+
+
+def forget_lead_session(funnel_id: int, session_key: str):
+    cache.delete(_cache_key(funnel_id, session_key))
+
+
+def resolve_lead_id(funnel_id: int, session_key: str) -> Optional[str]:
+    """
+    Resuelve el lead más reciente de una sesión dentro de un embudo.
+    Primero consulta la caché y, si no está, usa el índice (funnel, session_key).
+    """
+    if not session_key:
+        return None
+
+    key = _cache_key(funnel_id, session_key)
+    lead_id = cache.get(key)
+    if lead_id:
+        return lead_id
+
+    lead_id = (
+        Lead.objects.filter(funnel_id=funnel_id, session_key=session_key)
+        .order_by('-created_at')
+        .values_list('id', flat=True)
+        .first()
+    )
+    if lead_id:
+        lead_id = str(lead_id)
+        cache.set(key, lead_id, _ttl())
+    return lead_id
@@ -0,0 +1,135 @@
+# funnels/runtime/transitions.py
+"""
+Compilación del schema_json de un embudo en una tabla de transiciones.
+
+Formato de la tabla (serializable a JSON, se guarda en FunnelVersion.transition_table):
+
+    {
+        "start": "page-1",
+        "pages": {
+            "page-1": {"FORM_SUBMIT": [{"to": "page-2", "conditions": [...]}, ...]},
+            "page-2": {}
+        },
+        "terminal": ["page-2"]
+    }
+
+Cada página puede declarar en el schema sus transiciones explícitas:
+
+    {"id": "page-1", "transitions": [
+        {"event": "FORM_SUBMIT", "to": "page-vip", "conditions": [{"field": "form_data.plan", "op": "eq", "value": "pro"}]},
+        {"event": "FORM_SUBMIT", "to": "page-2"}
+    ]}
+
+Si no las declara, un FORM_SUBMIT avanza a `next_page_id` o, en su defecto, a la
+página siguiente en orden. Una página sin transiciones salientes es terminal.
+"""
+from typing import Optional
+from .events import FunnelEventType
+
+TABLE_FORMAT_VERSION = 1
+
+_MISSING = object()
+
+OPERATORS = {
+    'eq': lambda actual, expected: actual == expected,
+    'neq': lambda actual, expected: actual != expected,
+    'in': lambda actual, expected: actual in (expected or []),
+    'gt': lambda actual, expected: actual is not None and actual > expected,
+    'lt': lambda actual, expected: actual is not None and actual < expected,
+    'exists': lambda actual, expected: (actual is not None) == (expected is not False),
+}
+
+
+def compile_transition_table(schema: dict) -> dict:
+    """
+    Recorre el schema una sola vez y devuelve la tabla página -> evento -> transiciones.
+    Lanza ValueError si una transición apunta a una página inexistente o usa un
+    operador desconocido, para que el error aparezca al publicar y no en runtime.
+    """
+    schema = schema or {}
+    raw_pages = [page for page in schema.get('pages', []) if isinstance(page, dict) and page.get('id')]
+    page_ids = [str(page['id']) for page in raw_pages]
+    known_pages = set(page_ids)
+
+    pages = {}
+    for index, page in enumerate(raw_pages):
+        page_id = page_ids[index]
+        events = {}
+
+        explicit = page.get('transitions')
+        if explicit:
+            for transition in explicit:
+                event_type = transition.get('event', FunnelEventType.FORM_SUBMIT)
+                target = str(transition.get('to', ''))
+                if target not in known_pages:
+                    raise ValueError(f"Transition from page '{page_id}' targets unknown page '{target}'.")
+                conditions = transition.get('conditions') or []
+                for condition in conditions:
+                    if condition.get('op', 'eq') not in OPERATORS:
+                        raise ValueError(f"Unknown condition operator '{condition.get('op')}' in page '{page_id}'.")
+                events.setdefault(event_type, []).append({"to": target, "conditions": conditions})
+        else:
+            next_page = page.get('next_page_id')
+            if next_page is None and index + 1 < len(page_ids):
+                next_page = page_ids[index + 1]
+            if next_page is not None:
+                if str(next_page) not in known_pages:
+                    raise ValueError(f"Page '{page_id}' points to unknown next page '{next_page}'.")
+                events[FunnelEventType.FORM_SUBMIT] = [{"to": str(next_page), "conditions": []}]
+
+        pages[page_id] = events
+
+    return {
+        "format": TABLE_FORMAT_VERSION,
+        "start": page_ids[0] if page_ids else None,
+        "pages": pages,
+        "terminal": [page_id for page_id, events in pages.items() if not events],
+    }
+
+
+def _resolve_field(context: dict, path: str):
+    value = context
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part, _MISSING)
+        if value is _MISSING:
+            return None
+    return value
+
+
+def _conditions_match(conditions: list, context: dict) -> bool:
+    for condition in conditions:
+        actual = _resolve_field(context, condition.get('field', ''))
+        try:
+            if not OPERATORS[condition.get('op', 'eq')](actual, condition.get('value')):
+                return False
+        except TypeError:
+            # Comparaciones entre tipos incompatibles (ej. str > int) no cumplen la condición.
+            return False
+    return True
+
+
+def evaluate_transition(table: dict, page_id: str, event_type: str, context: dict) -> Optional[str]:
+    """
+    Devuelve la página destino para un evento ocurrido en page_id, o None si el
+    evento no provoca transición. La búsqueda página/evento es O(1); solo se
+    evalúan las condiciones de las transiciones candidatas, en orden.
+    """
+    candidates = table['pages'].get(page_id, {}).get(event_type)
+    if not candidates:
+        return None
+    for transition in candidates:
+        if _conditions_match(transition['conditions'], context):
+            return transition['to']
+    return None
+
+
+def store_transition_table(version) -> dict:
+    """
+    Compila y guarda la tabla de transiciones junto a la versión.
+    Se invoca al publicar: las versiones publicadas son inmutables.
+    """
+    version.transition_table = compile_transition_table(version.get_schema())
+    version.save(update_fields=['transition_table'])
+    return version.transition_table
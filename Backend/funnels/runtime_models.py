@@ -1,6 +1,7 @@
 # funnels/runtime_models.py
 import uuid
 from django.db import models
+from django.utils import timezone
 from infrastructure.models import Tenant, User
 from .models import Funnel, FunnelVersion
 
@@ -16,9 +17,18 @@ class Lead(models.Model):
     # Almacena los datos del formulario que crearon el lead
     form_data = models.JSONField(default=dict)
 
+    # Identificador de sesión/visitante enviado por la landing. Permite resolver
+    # el lead en eventos posteriores (ej. PAGE_VIEW) sin escanear form_data.
+    session_key = models.CharField(max_length=128, null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['funnel', 'session_key'], name='funnels_lead_session_idx'),
+        ]
+
     def __str__(self):
         return f"Lead {self.id} in {self.funnel.name}"
 
@@ -55,7 +65,8 @@ class LeadEvent(models.Model):
     page_id = models.CharField(max_length=255, null=True, blank=True)
     block_id = models.CharField(max_length=255, null=True, blank=True)
 
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Se fija al crear la instancia: el INSERT llega en diferido desde el buffer write-behind.
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['timestamp']
@@ -1,8 +1,9 @@
 # funnels/runtime_urls.py
 from django.urls import path
-from .runtime_views import FunnelEventView, LeadDetailView
+from .runtime_views import FunnelEventView, FunnelEventBatchView, LeadDetailView
 
 urlpatterns = [
     path('events/', FunnelEventView.as_view(), name='runtime-event'),
+    path('events/batch/', FunnelEventBatchView.as_view(), name='runtime-event-batch'),
     path('leads/<uuid:lead_id>/', LeadDetailView.as_view(), name='runtime-lead-detail'),
 ]
@@ -2,9 +2,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 
-from .runtime.engine import process_event
+from .runtime.engine import process_event, process_events_batch
 from .runtime_models import Lead, LeadState
 
 class FunnelEventView(APIView):
@@ -27,14 +28,14 @@ class FunnelEventView(APIView):
             )
 
         try:
-            lead = process_event(
+            lead_id = process_event(
                 publication_slug=publication_slug,
                 event_type=event_type,
                 payload=payload
             )
 
-            if lead:
-                return Response({"status": "Event processed successfully.", "lead_id": lead.id}, status=status.HTTP_202_ACCEPTED)
+            if lead_id:
+                return Response({"status": "Event processed successfully.", "lead_id": lead_id}, status=status.HTTP_202_ACCEPTED)
             else:
                 return Response({"status": "Event received."}, status=status.HTTP_202_ACCEPTED)
 
@@ -45,6 +46,38 @@ class FunnelEventView(APIView):
             return Response({"error": f"An internal error occurred: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class FunnelEventBatchView(APIView):
+    """
+    Endpoint público para recibir varios eventos de ejecución en una sola petición.
+    Acepta un array de eventos (o {"events": [...]}) y devuelve un resultado por evento.
+    No requiere autenticación.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        events = request.data if isinstance(request.data, list) else request.data.get('events')
+        if not isinstance(events, list) or not events:
+            return Response(
+                {"error": "A non-empty array of events is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_batch_size = getattr(settings, 'FUNNEL_RUNTIME_MAX_BATCH_SIZE', 500)
+        if len(events) > max_batch_size:
+            return Response(
+                {"error": f"A batch cannot contain more than {max_batch_size} events."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            results = process_events_batch(events)
+            return Response({"results": results}, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            # Captura de errores inesperados del motor
+            return Response({"error": f"An internal error occurred: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class LeadDetailView(APIView):
     """
     Endpoint para consultar el estado de un Lead.
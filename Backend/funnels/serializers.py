@@ -1,16 +1,49 @@
+from django.db.models import OuterRef, Prefetch, Subquery
 from rest_framework import serializers
 from .models import Funnel, FunnelVersion
 
 class FunnelVersionSerializer(serializers.ModelSerializer):
+    schema_json = serializers.JSONField(source='get_schema', read_only=True)
+
     class Meta:
         model = FunnelVersion
         fields = ['id', 'version_number', 'schema_json', 'created_at', 'is_active']
 
 class FunnelSerializer(serializers.ModelSerializer):
     # Mostramos la última versión para simplificar la respuesta del listado
-    latest_version = FunnelVersionSerializer(source='versions.first', read_only=True)
+    latest_version = serializers.SerializerMethodField()
 
     class Meta:
         model = Funnel
         fields = ['id', 'name', 'status', 'created_at', 'updated_at', 'latest_version']
         read_only_fields = ['status', 'created_at', 'updated_at']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Plan de consultas del listado: precarga solo la última versión de cada
+        embudo (una subconsulta correlacionada), no todo su historial. Las
+        versiones guardadas como delta se reconstruyen juntas, con una consulta
+        más para todas sus cadenas. Número de consultas constante, sin importar cuántos embudos o versiones haya.
+        """
+        latest_version_id = (
+            FunnelVersion.objects.filter(funnel=OuterRef('funnel'))
+            .order_by('-version_number')
+            .values('pk')[:1]
+        )
+        return queryset.prefetch_related(
+            Prefetch(
+                'versions',
+                queryset=FunnelVersion.objects.filter(pk=Subquery(latest_version_id)).with_schemas(),
+                to_attr='latest_versions'
+            )
+        )
+
+    def get_latest_version(self, funnel):
+        latest_versions = getattr(funnel, 'latest_versions', None)
+        if latest_versions is None:
+            # Instancia sin plan de consultas (ej. recién creada)
+            version = funnel.versions.first()
+        else:
+            version = latest_versions[0] if latest_versions else None
+        return FunnelVersionSerializer(version).data if version else None
@@ -2,9 +2,15 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from infrastructure.models import Tenant
  
-from .models import Funnel, FunnelVersion, FunnelPublication, FunnelPage
+from .models import Funnel, FunnelVersion, FunnelPublication, FunnelPage, FunnelEvent
+from .buffers import funnel_event_buffer
+from .versioning import create_funnel_version, schema_cache
 from shared.models import DomainEvent
  
 
@@ -12,6 +18,9 @@ User = get_user_model()
 
 class FunnelsAPITests(APITestCase):
     def setUp(self):
+        # La caché de schemas es por id de versión y los ids se reutilizan entre tests.
+        schema_cache.clear()
+        cache.clear()
         self.tenant = Tenant.objects.create(name="Funnel Tenant")
         self.user = User.objects.create_user(email='funnel_user@example.com', password='password', tenant=self.tenant)
         self.client.force_authenticate(user=self.user)
@@ -43,6 +52,36 @@ class FunnelsAPITests(APITestCase):
         self.assertEqual(funnel.versions.count(), 2)
         self.assertEqual(funnel.versions.first().version_number, 2)
 
+    def test_create_version_inserts_pages_in_bulk(self):
+        funnel = Funnel.objects.create(tenant=self.tenant, name="Bulk Pages Funnel")
+        url = reverse('funnel-create-version', kwargs={'pk': funnel.pk})
+
+        def save(page_count):
+            pages = [{"id": f"tmp-{i}", "page_type": "form", "page_schema_json": {"n": i}} for i in range(page_count)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, {"schema_json": {"pages": []}, "pages": pages}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(save(1), save(40))
+        pages = FunnelPage.objects.filter(funnel_version=funnel.versions.first())
+        self.assertEqual(pages.count(), 40)
+        self.assertEqual(pages.last().get_page_schema(), {"n": 39})
+
+    def test_page_schemas_are_stored_in_the_version_delta(self):
+        funnel = Funnel.objects.create(tenant=self.tenant, name="Page Delta Funnel")
+        url = reverse('funnel-create-version', kwargs={'pk': funnel.pk})
+        pages = [{"page_type": "form", "page_schema_json": {"blocks": ["x" * 200], "n": i}} for i in range(5)]
+        self.client.post(url, {"schema_json": {"pages": []}, "pages": pages}, format='json')
+        pages[3]["page_schema_json"] = {"blocks": ["x" * 200], "n": "editada"}
+        self.client.post(url, {"schema_json": {"pages": []}, "pages": pages}, format='json')
+
+        latest = funnel.versions.first()
+        self.assertFalse(latest.is_snapshot)
+        self.assertEqual(len(latest.schema_delta), 1)  # solo la página editada
+        self.assertTrue(all(page.page_schema_json is None for page in latest.pages.all()))
+        self.assertEqual([page.get_page_schema()["n"] for page in latest.pages.all()], [0, 1, 2, "editada", 4])
+
     def test_publish_version(self):
         funnel = Funnel.objects.create(tenant=self.tenant, name="Publish Test Funnel")
         version = FunnelVersion.objects.create(funnel=funnel, version_number=1)
@@ -75,4 +114,163 @@ class FunnelsAPITests(APITestCase):
         event = DomainEvent.objects.first()
         self.assertEqual(event.event_type, 'lead.created')
         self.assertEqual(event.payload['form_data']['email'], 'test@example.com')
- 
+
+    @override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+    def test_funnel_event_is_written_behind(self):
+        funnel = Funnel.objects.create(tenant=self.tenant, name="Event Buffer Funnel")
+        version = FunnelVersion.objects.create(funnel=funnel, version_number=1)
+
+        url = reverse('funnel-event')
+        data = {"funnel_id": funnel.id, "version_id": version.id, "event_type": "page_view"}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(FunnelEvent.objects.count(), 0)
+        self.assertEqual(funnel_event_buffer.flush(), 1)
+        self.assertEqual(FunnelEvent.objects.filter(funnel=funnel).count(), 1)
+
+    @override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
+    def test_funnel_event_with_unknown_ids_is_rejected_before_buffering(self):
+        funnel = Funnel.objects.create(tenant=self.tenant, name="Event Funnel")
+        other = Funnel.objects.create(tenant=self.tenant, name="Other Funnel")
+        version = FunnelVersion.objects.create(funnel=other, version_number=1)
+        url = reverse('funnel-event')
+
+        for funnel_id, version_id in ((funnel.id, version.id), (funnel.id, 999999), ("x", version.id)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    url, {"funnel_id": funnel_id, "version_id": version_id, "event_type": "page_view"}, format='json'
+                )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(funnel_event_buffer.pending_count(), 0)
+
+        # Un par válido se comprueba una vez y luego se sirve de la caché.
+        data = {"funnel_id": other.id, "version_id": version.id, "event_type": "page_view"}
+        self.assertEqual(self.client.post(url, data, format='json').status_code, status.HTTP_202_ACCEPTED)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(url, data, format='json').status_code, status.HTTP_202_ACCEPTED)
+
+    def test_public_funnel_is_served_pre_rendered_with_etag(self):
+        funnel = Funnel.objects.create(tenant=self.tenant, name="Public Funnel")
+        version = FunnelVersion.objects.create(funnel=funnel, version_number=1, schema_json={"pages": [{"id": "p1"}]})
+        publish_url = reverse('funnel-publish', kwargs={'pk': funnel.pk})
+        self.client.post(publish_url, {"version_id": version.id}, format='json')
+        publication = FunnelPublication.objects.get(funnel=funnel, is_active=True)
+        self.assertTrue(publication.payload_etag)
+
+        url = reverse('public-funnel', kwargs={'slug': publication.public_url_slug})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], publication.payload_etag)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(response.json()['schema_json'], {"pages": [{"id": "p1"}]})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=publication.payload_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def _create_funnels(self, count, versions_per_funnel):
+        for i in range(count):
+            funnel = Funnel.objects.create(tenant=self.tenant, name=f"Listed Funnel {i}")
+            for number in range(1, versions_per_funnel + 1):
+                FunnelVersion.objects.create(funnel=funnel, version_number=number, schema_json={"v": number})
+
+    def test_list_funnels_uses_constant_number_of_queries(self):
+        url = reverse('funnel-list')
+        self._create_funnels(2, versions_per_funnel=3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+
+        self._create_funnels(10, versions_per_funnel=5)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+
+        self.assertEqual(len(large), len(small))
+        # Presupuesto: tenant del usuario, embudos y últimas versiones.
+        self.assertLessEqual(len(large), 3)
+        self.assertEqual(len(response.data), 12)
+        self.assertEqual(response.data[-1]['latest_version']['version_number'], 5)
+
+    def test_list_funnels_rebuilds_delta_versions_in_one_query(self):
+        url = reverse('funnel-list')
+
+        def create_delta_funnels(count):
+            for i in range(count):
+                funnel = Funnel.objects.create(tenant=self.tenant, name=f"Delta Funnel {i}")
+                for number in range(4):
+                    create_funnel_version(funnel, _builder_schema(f"{i}-{number}"))
+
+        create_delta_funnels(1)
+        schema_cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+
+        create_delta_funnels(10)
+        schema_cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+
+        self.assertEqual(len(large), len(small))
+        # Presupuesto: tenant, embudos, últimas versiones y sus cadenas delta.
+        self.assertLessEqual(len(large), 4)
+        self.assertEqual(response.data[-1]['latest_version']['schema_json'], _builder_schema("9-3"))
+
+
+def _builder_schema(title):
+    return {"pages": [
+        {"id": "page-1", "blocks": [{"id": "hero", "title": title}] + [{"id": f"b{i}", "text": "x" * 50} for i in range(20)]},
+        {"id": "page-2", "blocks": []},
+    ]}
+
+
+class FunnelVersionDeltaStorageTests(APITestCase):
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name="Delta Tenant")
+        self.funnel = Funnel.objects.create(tenant=self.tenant, name="Delta Funnel")
+        schema_cache.clear()
+
+    def test_autosaves_are_stored_as_deltas_and_reconstructed(self):
+        versions = [create_funnel_version(self.funnel, _builder_schema(f"Title {n}")) for n in range(5)]
+
+        self.assertTrue(versions[0].is_snapshot)
+        for version in versions[1:]:
+            version.refresh_from_db()
+            self.assertIsNone(version.schema_json)
+            self.assertEqual(len(version.schema_delta), 1)
+
+        schema_cache.clear()
+        latest = FunnelVersion.objects.get(id=versions[-1].id)
+        with self.assertNumQueries(1):
+            self.assertEqual(latest.get_schema(), _builder_schema("Title 4"))
+        # Los schemas intermedios quedaron en la caché de reconstrucción.
+        self.assertEqual(schema_cache.get(versions[2].id), _builder_schema("Title 2"))
+
+    @override_settings(FUNNEL_VERSION_SNAPSHOT_INTERVAL=3)
+    def test_snapshot_is_taken_every_interval(self):
+        versions = [create_funnel_version(self.funnel, _builder_schema(f"Title {n}")) for n in range(7)]
+        self.assertEqual([v.is_snapshot for v in versions], [True, False, False, True, False, False, True])
+
+    def test_publishing_materializes_the_full_schema(self):
+        create_funnel_version(self.funnel, _builder_schema("Draft"))
+        version = create_funnel_version(self.funnel, _builder_schema("Final"))
+        following = create_funnel_version(self.funnel, _builder_schema("After publish"))
+        self.assertFalse(version.is_snapshot)
+
+        user = User.objects.create_user(email='delta@example.com', password='password', tenant=self.tenant)
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            reverse('funnel-publish', kwargs={'pk': self.funnel.pk}), {"version_id": version.id}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        version.refresh_from_db()
+        self.assertEqual(version.schema_json, _builder_schema("Final"))
+        schema_cache.clear()
+        self.assertEqual(FunnelVersion.objects.get(id=following.id).get_schema(), _builder_schema("After publish"))
+
+    def test_deleting_a_funnel_removes_its_delta_chain(self):
+        for n in range(3):
+            create_funnel_version(self.funnel, _builder_schema(f"Title {n}"))
+        self.funnel.delete()
+        self.assertFalse(FunnelVersion.objects.exists())
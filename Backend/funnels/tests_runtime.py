@@ -3,13 +3,23 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from infrastructure.models import Tenant
 from .models import Funnel, FunnelVersion, FunnelPublication, Lead, LeadEvent, LeadState
+from .runtime.cache import compiled_funnel_cache
+from .buffers import lead_event_buffer
 
 User = get_user_model()
 
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0})
 class FunnelRuntimeEngineTests(APITestCase):
     def setUp(self):
+        compiled_funnel_cache.clear()
+        lead_event_buffer.clear()
+        cache.clear()
         self.tenant = Tenant.objects.create(name="Runtime Tenant")
         self.user = User.objects.create_user(email='runtime@example.com', password='password', tenant=self.tenant)
         self.client.force_authenticate(user=self.user)
@@ -41,7 +51,9 @@ class FunnelRuntimeEngineTests(APITestCase):
             }
         }
 
-        response = self.client.post(self.events_url, event_data, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.events_url, event_data, format='json')
+        lead_event_buffer.flush()
 
         self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         self.assertEqual(Lead.objects.count(), 1)
@@ -54,7 +66,175 @@ class FunnelRuntimeEngineTests(APITestCase):
         # Verificar estado y evento
         self.assertEqual(LeadState.objects.count(), 1)
         self.assertEqual(LeadEvent.objects.count(), 1)
-        self.assertEqual(lead.state.current_page_id, "page-1")
+        # El FORM_SUBMIT de page-1 transiciona a page-2, que es terminal.
+        self.assertEqual(lead.state.current_page_id, "page-2")
+        self.assertEqual(lead.state.current_status, "completed")
+        self.assertEqual(lead.state.execution_context['submitted_page_id'], "page-1")
+
+    def test_hot_events_do_not_query_publications(self):
+        event_data = {
+            "publication_slug": str(self.publication.public_url_slug),
+            "event_type": "FORM_SUBMIT",
+            "payload": {"page_id": "page-1", "form_data": {"email": "first@example.com"}}
+        }
+        self.client.post(self.events_url, event_data, format='json')
+
+        event_data['payload']['form_data']['email'] = 'second@example.com'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.events_url, event_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Lead.objects.count(), 2)
+        self.assertFalse(any('funnels_funnelpublication' in q['sql'] for q in ctx.captured_queries))
+
+    def test_compiled_funnel_indexes_schema(self):
+        compiled = compiled_funnel_cache.get(self.publication.public_url_slug)
+        self.assertEqual(compiled.start_page_id, "page-1")
+        self.assertEqual(compiled.transition("page-1", "FORM_SUBMIT", {}), "page-2")
+        self.assertIsNone(compiled.transition("page-2", "FORM_SUBMIT", {}))
+        self.assertTrue(compiled.is_terminal("page-2"))
+        self.assertEqual(compiled.tenant_id, self.tenant.id)
+
+    def test_publish_invalidates_compiled_cache(self):
+        old_slug = str(self.publication.public_url_slug)
+        compiled_funnel_cache.get(old_slug)
+
+        url = reverse('funnel-publish', kwargs={'pk': self.funnel.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {"version_id": self.version.id}, format='json')
+
+        event_data = {
+            "publication_slug": old_slug,
+            "event_type": "FORM_SUBMIT",
+            "payload": {"page_id": "page-1", "form_data": {}}
+        }
+        response = self.client.post(self.events_url, event_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_events_persist_in_bulk(self):
+        slug = str(self.publication.public_url_slug)
+        events = [
+            {"publication_slug": slug, "event_type": "FORM_SUBMIT",
+             "payload": {"page_id": "page-1", "form_data": {"email": "a@example.com"}}},
+            {"publication_slug": slug, "event_type": "PAGE_VIEW", "payload": {"page_id": "page-1"}},
+            {"publication_slug": "invalid-slug", "event_type": "FORM_SUBMIT", "payload": {"page_id": "page-1"}},
+            {"publication_slug": slug, "event_type": "FORM_SUBMIT",
+             "payload": {"page_id": "page-2", "form_data": {"email": "b@example.com"}}},
+        ]
+
+        # Calentar la caché para medir solo el coste de persistencia
+        compiled_funnel_cache.get(slug)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('runtime-event-batch'), events, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['processed', 'received', 'error', 'processed'])
+        self.assertEqual(Lead.objects.count(), 2)
+        self.assertEqual(LeadState.objects.count(), 2)
+        self.assertEqual(LeadEvent.objects.count(), 2)
+        self.assertEqual(Lead.objects.get(id=results[3]['lead_id']).state.current_page_id, 'page-2')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_batch_requires_events(self):
+        response = self.client.post(reverse('runtime-event-batch'), {"events": []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _post_event(self, event_type, payload):
+        event_data = {
+            "publication_slug": str(self.publication.public_url_slug),
+            "event_type": event_type,
+            "payload": payload
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.events_url, event_data, format='json')
+
+    def test_page_view_advances_lead_state_by_session(self):
+        response = self._post_event("FORM_SUBMIT", {
+            "page_id": "page-1", "session_key": "visitor-1", "form_data": {"email": "s@example.com"}
+        })
+        lead_id = response.data['lead_id']
+
+        response = self._post_event("PAGE_VIEW", {"page_id": "page-2", "session_key": "visitor-1"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(str(response.data['lead_id']), str(lead_id))
+        self.assertEqual(LeadState.objects.get(lead_id=lead_id).current_page_id, "page-2")
+
+        # La sesión se resuelve desde la caché: solo se actualiza el estado.
+        with CaptureQueriesContext(connection) as ctx:
+            self._post_event("PAGE_VIEW", {"page_id": "page-1", "session_key": "visitor-1"})
+        self.assertFalse(any('FROM "funnels_lead"' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(LeadState.objects.get(lead_id=lead_id).current_page_id, "page-1")
+
+    def test_page_view_without_lead_is_only_received(self):
+        response = self._post_event("PAGE_VIEW", {"page_id": "page-1", "session_key": "anonymous"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotIn('lead_id', response.data)
+
+    def test_page_view_unknown_page_fails(self):
+        response = self._post_event("PAGE_VIEW", {"page_id": "missing", "session_key": "visitor-1"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_page_view_follows_submit_in_same_batch(self):
+        slug = str(self.publication.public_url_slug)
+        events = [
+            {"publication_slug": slug, "event_type": "FORM_SUBMIT",
+             "payload": {"page_id": "page-1", "session_key": "batch-visitor", "form_data": {}}},
+            {"publication_slug": slug, "event_type": "PAGE_VIEW",
+             "payload": {"page_id": "page-2", "session_key": "batch-visitor"}},
+        ]
+        response = self.client.post(reverse('runtime-event-batch'), events, format='json')
+
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['processed', 'processed'])
+        self.assertEqual(Lead.objects.get().state.current_page_id, "page-2")
+
+    def test_conditional_transition_from_published_table(self):
+        version = FunnelVersion.objects.create(
+            funnel=self.funnel,
+            version_number=2,
+            schema_json={
+                "pages": [
+                    {"id": "form", "transitions": [
+                        {"event": "FORM_SUBMIT", "to": "vip", "conditions": [{"field": "form_data.plan", "op": "eq", "value": "pro"}]},
+                        {"event": "FORM_SUBMIT", "to": "upsell"},
+                    ]},
+                    {"id": "upsell", "next_page_id": "thanks"},
+                    {"id": "vip", "next_page_id": "thanks"},
+                    {"id": "thanks"},
+                ]
+            }
+        )
+        url = reverse('funnel-publish', kwargs={'pk': self.funnel.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {"version_id": version.id}, format='json')
+
+        version.refresh_from_db()
+        self.assertEqual(version.transition_table['pages']['form']['FORM_SUBMIT'][1]['to'], 'upsell')
+        self.assertEqual(version.transition_table['terminal'], ['thanks'])
+
+        publication = FunnelPublication.objects.get(funnel=self.funnel, is_active=True)
+        for plan, expected_page in [("pro", "vip"), ("basic", "upsell")]:
+            response = self.client.post(self.events_url, {
+                "publication_slug": str(publication.public_url_slug),
+                "event_type": "FORM_SUBMIT",
+                "payload": {"page_id": "form", "form_data": {"plan": plan}}
+            }, format='json')
+            state = LeadState.objects.get(lead_id=response.data['lead_id'])
+            self.assertEqual(state.current_page_id, expected_page)
+            self.assertEqual(state.current_status, "active")
+
+    def test_publish_rejects_transition_to_unknown_page(self):
+        version = FunnelVersion.objects.create(
+            funnel=self.funnel,
+            version_number=2,
+            schema_json={"pages": [{"id": "a", "transitions": [{"event": "FORM_SUBMIT", "to": "missing"}]}]}
+        )
+        url = reverse('funnel-publish', kwargs={'pk': self.funnel.pk})
+        response = self.client.post(url, {"version_id": version.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(FunnelPublication.objects.get(pk=self.publication.pk).is_active)
 
     def test_unsupported_event_type_fails(self):
         event_data = {
@@ -7,7 +7,8 @@ router.register(r'', FunnelViewSet, basename='funnel')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # 'public/events/' debe ir antes que 'public/<slug:slug>/', que también lo captura.
+    path('public/events/', FunnelEventView.as_view(), name='funnel-event'),
     path('public/<slug:slug>/', PublicFunnelView.as_view(), name='public-funnel'),
     path('public/<slug:slug>/leads/', LeadCaptureView.as_view(), name='lead-capture'),
-    path('public/events/', FunnelEventView.as_view(), name='funnel-event'),
 ]
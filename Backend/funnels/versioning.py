@@ -0,0 +1,195 @@
+# funnels/versioning.py
+"""
+Almacenamiento delta de FunnelVersion.
+
+Cada guardado del constructor crea una versión nueva. En lugar de copiar el
+schema completo, la versión guarda un JSON Patch respecto de la versión
+anterior (schema_delta + base_version) y solo cada FUNNEL_VERSION_SNAPSHOT_INTERVAL
+versiones, o cuando el delta no compensa, un snapshot completo en schema_json.
+
+Leer una versión delta implica partir del snapshot más cercano y aplicar los
+parches hasta ella; los schemas reconstruidos se guardan en una caché LRU en
+memoria. Las versiones publicadas se materializan en schema_json para que el
+runtime y la API pública nunca tengan que reconstruir.
+
+El schema de cada FunnelPage forma parte del de su versión (PAGE_SCHEMAS_KEY),
+así que editar una página solo añade al delta los cambios de esa página.
+"""
+import json
+import operator
+import threading
+from collections import OrderedDict
+from functools import reduce
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from shared.jsonpatch import apply_patch, make_patch
+from .models import Funnel, FunnelVersion
+
+DEFAULT_SNAPSHOT_INTERVAL = 20
+DEFAULT_CACHE_SIZE = 256
+
+
+class SchemaReconstructionCache:
+    """
+    Caché LRU, por proceso, de schemas completos indexada por id de versión.
+    El contenido de una versión no cambia una vez creada, así que no requiere
+    invalidación. Los schemas devueltos se comparten: no deben mutarse.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        return getattr(settings, 'FUNNEL_SCHEMA_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+
+    def get(self, version_id: int):
+        with self._lock:
+            schema = self._entries.get(version_id)
+            if schema is not None:
+                self._entries.move_to_end(version_id)
+            return schema
+
+    def set(self, version_id: int, schema: dict):
+        with self._lock:
+            self._entries[version_id] = schema
+            self._entries.move_to_end(version_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instancia global compartida por FunnelVersion.get_schema()
+schema_cache = SchemaReconstructionCache()
+
+
+def _snapshot_interval() -> int:
+    return getattr(settings, 'FUNNEL_VERSION_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)
+
+
+_CHAIN_FIELDS = ('id', 'funnel_id', 'version_number', 'delta_depth', 'schema_json', 'schema_delta', 'base_version_id')
+
+
+def _chain_filter(version: FunnelVersion) -> Q:
+    # Cada delta se calcula respecto de la versión anterior, así que la cadena
+    # completa está dentro de las últimas delta_depth versiones.
+    return Q(
+        funnel_id=version.funnel_id,
+        version_number__gte=version.version_number - version.delta_depth,
+        version_number__lte=version.version_number,
+    )
+
+
+def _rebuild(version: FunnelVersion, chain: dict) -> dict:
+    """Aplica los parches desde el snapshot (o schema cacheado) más cercano, con las filas de `chain`."""
+    pending = []
+    current = version
+    while True:
+        cached = schema_cache.get(current.id)
+        if cached is not None:
+            schema = cached
+            break
+        if current.schema_json is not None:
+            schema = current.schema_json
+            break
+        pending.append(current)
+        current = chain.get(current.base_version_id) or FunnelVersion.objects.get(id=current.base_version_id)
+
+    for delta_version in reversed(pending):
+        schema = apply_patch(schema, delta_version.schema_delta)
+        schema_cache.set(delta_version.id, schema)
+    return schema
+
+
+def reconstruct_schema(version: FunnelVersion) -> dict:
+    """
+    Reconstruye el schema de una versión guardada como delta. Trae en una sola
+    consulta la cadena de versiones hasta el snapshot y aplica los parches en
+    orden, cacheando cada schema intermedio.
+    """
+    cached = schema_cache.get(version.id)
+    if cached is not None:
+        return cached
+    chain = {row.id: row for row in FunnelVersion.objects.filter(_chain_filter(version)).only(*_CHAIN_FIELDS)}
+    return _rebuild(version, chain)
+
+
+def _needs_rows(version: FunnelVersion, known: dict) -> bool:
+    current = version
+    while current.schema_json is None and schema_cache.get(current.id) is None:
+        current = known.get(current.base_version_id)
+        if current is None:
+            return True
+    return False
+
+
+def preload_schemas(versions) -> None:
+    """
+    Reconstruye de una vez los schemas de varias versiones delta (un listado).
+    Las filas de sus cadenas que no estén ya entre `versions` se traen en una
+    sola consulta para todas. Cada versión guarda su schema en la instancia,
+    así get_schema() no consulta aunque la caché LRU lo haya desalojado.
+    """
+    pending = [version for version in versions if version.schema_json is None]
+    if not pending:
+        return
+    known = {version.id: version for version in versions}
+    missing = [version for version in pending if _needs_rows(version, known)]
+    if missing:
+        chains = reduce(operator.or_, (_chain_filter(version) for version in missing))
+        for row in FunnelVersion.objects.filter(chains).only(*_CHAIN_FIELDS):
+            known.setdefault(row.id, row)
+    for version in pending:
+        version._reconstructed_schema = _rebuild(version, known)
+
+
+@transaction.atomic
+def create_funnel_version(funnel: Funnel, schema_json: dict, **fields) -> FunnelVersion:
+    """
+    Crea la siguiente versión de un embudo. Se guarda como delta respecto de la
+    última versión salvo que toque snapshot (primera versión, cadena demasiado
+    larga o un parche mayor que el propio schema).
+    """
+    schema_json = schema_json if schema_json is not None else {}
+    latest = funnel.versions.select_for_update().order_by('-version_number').first()
+    version = FunnelVersion(
+        funnel=funnel,
+        version_number=(latest.version_number + 1) if latest else 1,
+        schema_json=schema_json,
+        **fields
+    )
+
+    if latest is not None and latest.delta_depth + 1 < _snapshot_interval():
+        patch = make_patch(latest.get_schema(), schema_json)
+        if len(json.dumps(patch)) < len(json.dumps(schema_json)):
+            version.schema_json = None
+            version.schema_delta = patch
+            version.base_version = latest
+            version.delta_depth = latest.delta_depth + 1
+
+    version.save()
+    # Quien guarda ya tiene el schema completo: lo dejamos cacheado para la
+    # próxima versión (o lectura) sin reconstruir.
+    transaction.on_commit(lambda: schema_cache.set(version.id, schema_json))
+    return version
+
+
+def materialize_version(version: FunnelVersion) -> FunnelVersion:
+    """
+    Convierte una versión delta en snapshot. Se usa al publicar: las versiones
+    publicadas se leen en cada petición pública y no deben pagar la reconstrucción.
+    Las versiones posteriores que la usan como base siguen siendo válidas.
+    """
+    if version.is_snapshot:
+        return version
+    version.schema_json = version.get_schema()
+    version.schema_delta = None
+    version.delta_depth = 0
+    version.save(update_fields=['schema_json', 'schema_delta', 'delta_depth'])
+    return version
@@ -1,14 +1,20 @@
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
-from .models import Funnel, FunnelVersion, FunnelPage, FunnelPublication
+from .models import PAGE_SCHEMAS_KEY, Funnel, FunnelVersion, FunnelPage, FunnelPublication
 from .serializers import FunnelSerializer, FunnelVersionSerializer
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.core.cache import cache
 from django.db import transaction
 from rest_framework.views import APIView
 from .models import LeadCapture, FunnelEvent
  
 from shared.services import event_dispatcher
+from .publishing import publish_version, render_public_payload
+from .versioning import create_funnel_version
+from shared.http import etag_json_response
+from shared.bulk import TempIdMap, bulk_create_level
+from .buffers import funnel_event_buffer
  
 
 
@@ -47,13 +53,37 @@ class LeadCaptureView(APIView):
                 'version_id': lead.version.id,
                 'tenant_id': lead.funnel.tenant_id,
                 'form_data': lead.form_data,
-            }
+            },
+            aggregate_id=f"lead:{lead.id}"
         )
 
  
         return Response({"status": "Lead capturado exitosamente."}, status=201)
 
 
+# Segundos que se recuerda un par (embudo, versión) válido para FunnelEventView
+EVENT_TARGET_CACHE_TTL = 300
+
+
+def event_target_exists(funnel_id, version_id) -> bool:
+    """
+    Comprueba que la versión existe y pertenece al embudo antes de aceptar un
+    evento: el buffer lo inserta más tarde y una fila inválida se descartaría
+    sin que el cliente lo sepa. Solo se cachean los pares válidos.
+    """
+    try:
+        funnel_id, version_id = int(funnel_id), int(version_id)
+    except (TypeError, ValueError):
+        return False
+    key = f'funnels:event-target:{funnel_id}:{version_id}'
+    if cache.get(key):
+        return True
+    exists = FunnelVersion.objects.filter(id=version_id, funnel_id=funnel_id).exists()
+    if exists:
+        cache.set(key, True, EVENT_TARGET_CACHE_TTL)
+    return exists
+
+
 class FunnelEventView(APIView):
     authentication_classes = []
     permission_classes = []
@@ -66,13 +96,15 @@ class FunnelEventView(APIView):
 
         if not all([funnel_id, version_id, event_type]):
             return Response({"error": "Los campos 'funnel_id', 'version_id', y 'event_type' son requeridos."}, status=400)
+        if not event_target_exists(funnel_id, version_id):
+            return Response({"error": "Embudo o versión no válidos."}, status=400)
 
-        FunnelEvent.objects.create(
+        funnel_event_buffer.add(FunnelEvent(
             funnel_id=funnel_id,
             version_id=version_id,
             event_type=event_type,
             metadata_json=metadata
-        )
+        ))
         return Response(status=202)
 
 
@@ -81,26 +113,37 @@ class PublicFunnelView(APIView):
     permission_classes = []
 
     def get(self, request, slug, *args, **kwargs):
-        try:
-            publication = FunnelPublication.objects.select_related('version').get(public_url_slug=slug, is_active=True)
-            serializer = FunnelVersionSerializer(publication.version)
-            return Response(serializer.data)
-        except FunnelPublication.DoesNotExist:
+        # La respuesta se renderizó al publicar: solo leemos el cuerpo y su ETag.
+        row = (
+            FunnelPublication.objects.filter(public_url_slug=slug, is_active=True)
+            .values_list('id', 'payload_etag', 'rendered_payload')
+            .first()
+        )
+        if row is None:
             return Response({"error": "Funnel no encontrado o no está publicado."}, status=404)
 
+        publication_id, etag, body = row
+        if not etag:
+            # Publicaciones anteriores a la materialización: se renderizan una vez.
+            publication = FunnelPublication.objects.select_related('version').get(id=publication_id)
+            body, etag = render_public_payload(publication.version)
+            FunnelPublication.objects.filter(id=publication_id).update(rendered_payload=body, payload_etag=etag)
+
+        return etag_json_response(request, body, etag)
+
 
 class FunnelViewSet(viewsets.ModelViewSet):
-    queryset = Funnel.objects.all().prefetch_related('versions')
+    queryset = Funnel.objects.all()
     serializer_class = FunnelSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return self.queryset.filter(tenant=self.request.user.tenant)
+        return FunnelSerializer.setup_eager_loading(self.queryset.filter(tenant=self.request.user.tenant))
 
     def perform_create(self, serializer):
         funnel = serializer.save(tenant=self.request.user.tenant)
         # Al crear un funnel, creamos una primera versión vacía
-        FunnelVersion.objects.create(funnel=funnel, version_number=1, schema_json={}, is_active=True)
+        create_funnel_version(funnel, {}, is_active=True)
 
     @action(detail=True, methods=['post'], url_path='versions')
     @transaction.atomic
@@ -112,25 +155,24 @@ class FunnelViewSet(viewsets.ModelViewSet):
         if not schema_json:
             return Response({"error": "El campo 'schema_json' es requerido."}, status=400)
 
-        # Calculamos el nuevo número de versión
-        latest_version = funnel.versions.first()
-        new_version_number = (latest_version.version_number + 1) if latest_version else 1
+        # El schema de cada página viaja dentro del de la versión, así también se
+        # guarda como delta y una página sin cambios no vuelve a ocupar espacio.
+        if pages_data:
+            schema_json = {**schema_json, PAGE_SCHEMAS_KEY: [page_data.get('page_schema_json', {}) for page_data in pages_data]}
 
-        # Creamos la nueva versión
-        new_version = FunnelVersion.objects.create(
-            funnel=funnel,
-            version_number=new_version_number,
-            schema_json=schema_json
-        )
+        # Creamos la nueva versión (guardada como delta respecto de la anterior)
+        new_version = create_funnel_version(funnel, schema_json)
 
-        # Creamos las páginas asociadas
-        for index, page_data in enumerate(pages_data):
-            FunnelPage.objects.create(
-                funnel_version=new_version,
-                page_type=page_data.get('page_type', 'default'),
-                page_schema_json=page_data.get('page_schema_json', {}),
-                order_index=index
-            )
+        # Creamos las páginas asociadas en una sola inserción
+        bulk_create_level(FunnelPage, [
+            {
+                'id': page_data.get('id'),
+                'funnel_version': new_version,
+                'page_type': page_data.get('page_type', 'default'),
+                'order_index': index,
+            }
+            for index, page_data in enumerate(pages_data)
+        ], TempIdMap())
 
         serializer = FunnelVersionSerializer(new_version)
         return Response(serializer.data, status=201)
@@ -149,19 +191,11 @@ class FunnelViewSet(viewsets.ModelViewSet):
         except FunnelVersion.DoesNotExist:
             return Response({"error": "La versión especificada no existe para este funnel."}, status=404)
 
-        # Desactivar publicaciones anteriores de este funnel
-        funnel.publications.update(is_active=False)
-
-        # Crear la nueva publicación
-        publication = FunnelPublication.objects.create(
-            funnel=funnel,
-            version=version_to_publish,
-            is_active=True
-        )
-
-        # Actualizar el estado del funnel
-        funnel.status = 'published'
-        funnel.save()
+        try:
+            publication = publish_version(funnel, version_to_publish)
+        except ValueError as e:
+            # La tabla de transiciones no compila: el schema no es publicable.
+            return Response({"error": str(e)}, status=400)
 
         return Response({
             "status": "Funnel publicado exitosamente.",
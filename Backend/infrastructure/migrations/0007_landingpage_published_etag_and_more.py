@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("infrastructure", "0006_alter_user_options_alter_user_managers_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="landingpage",
+            name="published_etag",
+            field=models.CharField(blank=True, default="", max_length=66),
+        ),
+        migrations.AddField(
+            model_name="landingpage",
+            name="published_payload",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 6.0 on 2026-10-18 07:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("infrastructure", "0007_landingpage_published_etag_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="desde_cache",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="endpoint",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="latencia_ms",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="modelo",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="tokens_estimados",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="tokens_prompt",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="aiinteraction",
+            name="tokens_respuesta",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="desde_cache",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="endpoint",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="latencia_ms",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="modelo",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="tokens_estimados",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="tokens_prompt",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="historicalaiinteraction",
+            name="tokens_respuesta",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="AIUsageDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fecha", models.DateField()),
+                ("endpoint", models.CharField(blank=True, max_length=100)),
+                ("proveedor", models.CharField(max_length=100)),
+                ("modelo", models.CharField(blank=True, max_length=100)),
+                ("llamadas", models.PositiveIntegerField(default=0)),
+                ("llamadas_cache", models.PositiveIntegerField(default=0)),
+                ("errores", models.PositiveIntegerField(default=0)),
+                ("tokens_prompt", models.PositiveBigIntegerField(default=0)),
+                ("tokens_respuesta", models.PositiveBigIntegerField(default=0)),
+                (
+                    "costo",
+                    models.DecimalField(decimal_places=6, default=0, max_digits=14),
+                ),
+                (
+                    "tenant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ai_usage_daily",
+                        to="infrastructure.tenant",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tenant", "fecha", "endpoint", "proveedor", "modelo"),
+                        name="unique_ai_usage_daily",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 08:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("infrastructure", "0008_ai_usage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="aiinteraction",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="historicalaiinteraction",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,5 +1,6 @@
 # infrastructure/models.py
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from simple_history.models import HistoricalRecords
 
@@ -63,6 +64,9 @@ class LandingPage(models.Model):
     subcategoria = models.ForeignKey(Subcategoria, on_delete=models.CASCADE, related_name='landing_pages')
     slug = models.SlugField(unique=True)
     estado = models.CharField(max_length=10, choices=[('borrador', 'Borrador'), ('publicado', 'Publicado')], default='borrador')
+    # Respuesta pública renderizada al publicar, servida sin pasar por los serializadores
+    published_payload = models.TextField(blank=True, default='')
+    published_etag = models.CharField(max_length=66, blank=True, default='')
     def __str__(self):
         return self.slug
 
@@ -106,12 +110,49 @@ class AIInteraction(models.Model):
     resultado = models.TextField(blank=True)
     errores = models.TextField(blank=True)
     costo_estimado = models.DecimalField(max_digits=10, decimal_places=6, default=0.0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Consumo de la llamada (ver ai/services/ai_manager/usage.py)
+    modelo = models.CharField(max_length=100, blank=True)
+    endpoint = models.CharField(max_length=100, blank=True)  # funcionalidad que originó la llamada
+    tokens_prompt = models.PositiveIntegerField(default=0)
+    tokens_respuesta = models.PositiveIntegerField(default=0)
+    tokens_estimados = models.BooleanField(default=False)  # el proveedor no informó el conteo
+    desde_cache = models.BooleanField(default=False)
+    latencia_ms = models.PositiveIntegerField(default=0)
+    # La fila se escribe en diferido (ai/buffers.py): guarda el instante de la
+    # llamada, no el del vaciado o el de la reinserción de un volcado.
+    created_at = models.DateTimeField(default=timezone.now)
     history = HistoricalRecords()
 
     def __str__(self):
         return f"Interaction {self.id} by {self.user.username if self.user else 'System'}"
 
+class AIUsageDaily(models.Model):
+    """
+    Consumo de IA agregado por tenant, día, endpoint, proveedor y modelo. Se
+    actualiza al vaciar el buffer de AIInteraction (ai/buffers.py).
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='ai_usage_daily')
+    fecha = models.DateField()
+    endpoint = models.CharField(max_length=100, blank=True)
+    proveedor = models.CharField(max_length=100)
+    modelo = models.CharField(max_length=100, blank=True)
+    llamadas = models.PositiveIntegerField(default=0)
+    llamadas_cache = models.PositiveIntegerField(default=0)
+    errores = models.PositiveIntegerField(default=0)
+    tokens_prompt = models.PositiveBigIntegerField(default=0)
+    tokens_respuesta = models.PositiveBigIntegerField(default=0)
+    costo = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tenant', 'fecha', 'endpoint', 'proveedor', 'modelo'], name='unique_ai_usage_daily'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.tenant_id} {self.fecha} {self.endpoint}: {self.tokens_prompt + self.tokens_respuesta} tokens"
+
 class ContentAsset(models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, related_name='content_assets')
     ai_interaction = models.ForeignKey(AIInteraction, on_delete=models.SET_NULL, null=True, blank=True)
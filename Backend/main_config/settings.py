@@ -135,6 +135,99 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Buffer write-behind para filas append-only (LeadEvent, FunnelEvent, AIInteraction).
+# Ver shared/buffers.py
+WRITE_BEHIND_BUFFER = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 10000,
+    'SPILL_DIR': BASE_DIR / 'var' / 'spill',
+}
+
+# Relay del outbox de DomainEvent (shared/relay.py)
+DOMAIN_EVENT_RELAY = {
+    'BATCH_SIZE': 500,
+    'LEASE_SECONDS': 60,
+    'MAX_BATCHES_PER_RUN': 20,
+    'MAX_WORKERS': 8,
+    'DEFAULT_CONCURRENCY': 4,
+    'CONCURRENCY': {},
+    # Despertar al confirmar eventos: 'celery', 'local' (hilo en proceso), None (solo poller)
+    # o 'auto' (Celery si hay CELERY_BROKER_URL, si no 'local')
+    'WAKEUP': 'auto',
+}
+
+# Archivo de eventos procesados (shared/archiving.py)
+DOMAIN_EVENT_ARCHIVE = {
+    'AFTER_DAYS': 7,
+    'BATCH_SIZE': 5000,
+    'MAX_BATCHES_PER_RUN': 50,
+    'RETENTION_MONTHS': None,
+}
+
+# Caché de respuestas de texto de la IA (ai/services/ai_manager/response_cache.py).
+# SHARED_ALIAS debe apuntar a un alias con RedisCache en producción.
+AI_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'LOCAL_MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 300,
+    'SHARED_ALIAS': 'default',
+    'SHARED_TTL': 3600,
+}
+
+# Deduplicación de generaciones idénticas concurrentes (ai/services/ai_manager/single_flight.py).
+# SHARED_LOCK extiende la deduplicación entre procesos usando SHARED_ALIAS de AI_RESPONSE_CACHE.
+AI_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'SHARED_LOCK': False,
+    'LOCK_TIMEOUT': 120,
+    'WAIT_TIMEOUT': 60,
+}
+
+# Límites de uso de IA por tenant y por proveedor (ai/services/ai_manager/rate_limit.py).
+# El estado se comparte si SHARED_ALIAS usa RedisCache; si no, cada proceso lleva el suyo.
+AI_RATE_LIMITS = {
+    'ENABLED': True,
+    'MODE': 'reject',  # 'wait' espera hasta MAX_WAIT segundos a que haya cupo
+    'MAX_WAIT': 10,
+    'SHARED_ALIAS': 'default',
+    'TENANT': {'REQUESTS_PER_MINUTE': 60, 'TOKENS_PER_MINUTE': 60000, 'MAX_CONCURRENT': 8},
+    'TENANT_OVERRIDES': {},
+    'PROVIDERS': {
+        # 'GeminiProvider': {'REQUESTS_PER_MINUTE': 300, 'TOKENS_PER_MINUTE': 1000000},
+    },
+}
+
+# Salud de proveedores de IA y circuit breaker (ai/services/ai_manager/health.py).
+AI_PROVIDER_HEALTH = {
+    'WINDOW': 50,
+    'FAILURE_THRESHOLD': 5,
+    'OPEN_SECONDS': 30,
+}
+
+# Consumo y coste de IA (ai/services/ai_manager/usage.py). Los precios por
+# defecto (USD por 1000 tokens) están en usage.DEFAULTS; PRICES los sustituye.
+# DAILY_BUDGET (USD por tenant y día) corta las generaciones con un 429 hasta
+# el día siguiente; None lo desactiva.
+AI_USAGE = {
+    'DAILY_BUDGET': None,
+    'TENANT_BUDGETS': {},
+    'BUDGET_CHECK_TTL': 60,
+}
+
+CELERY_BEAT_SCHEDULE = {
+    # Red de seguridad: los eventos se procesan al confirmarse (shared/wakeup.py)
+    'process-pending-domain-events': {
+        'task': 'shared.tasks.process_pending_events',
+        'schedule': 10.0,
+    },
+    'archive-processed-domain-events': {
+        'task': 'shared.tasks.archive_processed_events',
+        'schedule': 3600.0,
+    },
+}
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
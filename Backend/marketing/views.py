@@ -4,7 +4,9 @@ from rest_framework.permissions import IsAuthenticated
 from django.template import Template, Context
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from ai.buffers import record_interaction
 from ai.services.ai_manager.ai_manager import ai_manager
+from ai.http import provider_error_response
 from ai.services.sanitizers import sanitize_plain_text
 from .models import Campaign
 from .serializers import CampaignSerializer
@@ -63,11 +65,22 @@ class AIRewriteEmailView(APIView):
             return Response({"error": "El campo 'text' es requerido."}, status=status.HTTP_400_BAD_REQUEST)
         prompt = f"Reescribe el siguiente texto para un email de marketing, optimizando su claridad y poder de conversión:\n\n{base_text}"
         try:
-            raw_text, provider_name = ai_manager.execute_text_generation(prompt=prompt, model='default-text-model')
+            raw_text, provider_name, usage = ai_manager.execute_text_generation(
+                prompt=prompt, model='default-text-model', tenant_id=request.user.tenant_id
+            )
             sanitized_text = sanitize_plain_text(raw_text)
+            record_interaction(
+                request.user,
+                proveedor_usado=provider_name,
+                modelo='default-text-model',
+                endpoint=request.resolver_match.url_name,
+                prompt_original=prompt,
+                resultado=sanitized_text,
+                usage=usage
+            )
             return Response({"rewritten_text": sanitized_text}, status=status.HTTP_200_OK)
         except RuntimeError as e:
-            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return provider_error_response(e)
         except Exception as e:
             return Response({"error": f"Ocurrió un error inesperado durante la reescritura con IA: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
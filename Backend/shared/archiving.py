@@ -0,0 +1,88 @@
+# shared/archiving.py
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DomainEvent, DomainEventArchive
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'AFTER_DAYS': 7,
+    'BATCH_SIZE': 5000,
+    'MAX_BATCHES_PER_RUN': 50,
+    'RETENTION_MONTHS': None,  # None conserva el archivo indefinidamente
+}
+
+
+def get_archive_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'DOMAIN_EVENT_ARCHIVE', {})}
+
+
+def _month_start(value):
+    return value.date().replace(day=1)
+
+
+def archive_batch(cutoff, batch_size: int) -> int:
+    """
+    Mueve al archivo un lote de eventos procesados antes de cutoff.
+    Copia y borrado van en la misma transacción: un evento nunca queda en las
+    dos tablas ni en ninguna.
+    """
+    with transaction.atomic():
+        events = list(
+            DomainEvent.objects.filter(status='processed', processed_at__lt=cutoff)
+            .order_by('processed_at', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+        DomainEventArchive.objects.bulk_create([
+            DomainEventArchive(
+                original_id=event.id,
+                event_type=event.event_type,
+                aggregate_id=event.aggregate_id,
+                payload=event.payload,
+                status=event.status,
+                attempts=event.attempts,
+                error_message=event.error_message,
+                created_at=event.created_at,
+                processed_at=event.processed_at,
+                archive_month=_month_start(event.processed_at),
+            )
+            for event in events
+        ], batch_size=1000)
+        DomainEvent.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
+
+
+def purge_archive(retention_months: int) -> int:
+    """Elimina los meses de archivo más antiguos que retention_months."""
+    today = timezone.now().date().replace(day=1)
+    year, month = divmod(today.year * 12 + today.month - 1 - retention_months, 12)
+    deleted, _ = DomainEventArchive.objects.filter(archive_month__lt=today.replace(year=year, month=month + 1)).delete()
+    return deleted
+
+
+def archive_processed_events(after_days: int = None, batch_size: int = None, max_batches: int = None) -> dict:
+    """Archiva eventos procesados hace más de after_days, lote a lote."""
+    config = get_archive_settings()
+    after_days = config['AFTER_DAYS'] if after_days is None else after_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    max_batches = max_batches or config['MAX_BATCHES_PER_RUN']
+    cutoff = timezone.now() - timedelta(days=after_days)
+
+    archived = 0
+    for _ in range(max_batches):
+        moved = archive_batch(cutoff, batch_size)
+        archived += moved
+        if moved < batch_size:
+            break
+
+    purged = purge_archive(config['RETENTION_MONTHS']) if config['RETENTION_MONTHS'] else 0
+    if archived or purged:
+        logger.info(f"Archived {archived} processed domain events; purged {purged} archived rows.")
+    return {'archived': archived, 'purged': purged}
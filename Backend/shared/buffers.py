@@ -0,0 +1,233 @@
+# shared/buffers.py
+import atexit
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.db import IntegrityError, connection, transaction
+from simple_history.utils import bulk_create_with_history
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,  # segundos; 0 desactiva el hilo de vaciado en segundo plano
+    'MAX_PENDING': 10000,
+    'SPILL_DIR': None,
+}
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def get_buffer_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'WRITE_BEHIND_BUFFER', {})}
+
+
+class WriteBehindBuffer:
+    """
+    Buffer write-behind para filas append-only (telemetría, auditoría).
+
+    Las instancias se encolan en memoria (una cola acotada por proceso) y se
+    insertan con bulk_create cuando se alcanza BATCH_SIZE o pasa FLUSH_INTERVAL.
+    Al apagar el proceso lo pendiente se vacía en la base de datos o, si no es
+    posible, se vuelca a un fichero de spill que se reinyecta al arrancar.
+
+    Con with_history=True (modelos con HistoricalRecords) el historial también
+    se escribe en bloque: bulk_create no emite las señales que lo generan.
+    """
+    def __init__(self, model_label: str, with_history: bool = False):
+        self.model_label = model_label
+        self.with_history = with_history
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._worker = None
+        with _registry_lock:
+            _registry.append(self)
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def add(self, obj):
+        """
+        Registra una instancia sin guardar. Si hay una transacción abierta, la
+        fila solo se encola cuando ésta se confirma.
+        """
+        config = get_buffer_settings()
+        if not config['ENABLED']:
+            self._insert_one(obj)
+            return
+        transaction.on_commit(lambda: self._enqueue(obj, config))
+
+    async def aadd(self, obj):
+        """Versión async de add: on_commit consulta la conexión, que no es async-safe."""
+        await sync_to_async(self.add)(obj)
+
+    def _enqueue(self, obj, config):
+        self._ensure_worker(config)
+        with self._lock:
+            self._pending.append(obj)
+            size = len(self._pending)
+
+        if size >= config['MAX_PENDING']:
+            # Contrapresión: la cola está llena, vaciamos en el hilo del llamante
+            # en lugar de descartar filas.
+            self.flush()
+        elif size >= config['BATCH_SIZE']:
+            if self._worker:
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def _ensure_worker(self, config):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        # Primer uso en este proceso (o tras un fork): la cola heredada pertenece al padre.
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pending = []
+            self._worker = None
+            if config['FLUSH_INTERVAL'] > 0:
+                self._worker = threading.Thread(
+                    target=self._run, args=(config['FLUSH_INTERVAL'],),
+                    name=f"write-behind-{self.model_label}", daemon=True
+                )
+                self._worker.start()
+        self.replay_spilled()
+
+    def _run(self, interval: float):
+        while True:
+            self._wakeup.wait(timeout=interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                connection.close_if_unusable_or_obsolete()
+
+    def _insert_one(self, obj):
+        obj.save(force_insert=True)
+
+    def _bulk_insert(self, objs):
+        batch_size = get_buffer_settings()['BATCH_SIZE']
+        if self.with_history:
+            # El usuario del historial sale de obj._history_user, si lo tiene.
+            bulk_create_with_history(objs, self.model, batch_size=batch_size)
+        else:
+            self.model.objects.bulk_create(objs, batch_size=batch_size)
+
+    def flush(self) -> int:
+        """Inserta todo lo pendiente con bulk_create. Devuelve el número de filas escritas."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self._bulk_insert(batch)
+                return len(batch)
+            except Exception as e:
+                logger.warning(f"Write-behind bulk flush of {len(batch)} {self.model_label} rows failed, retrying row by row: {e}")
+                return self._flush_individually(batch)
+
+    def _flush_individually(self, batch) -> int:
+        """
+        Aísla las filas inválidas (ej. una FK inexistente) para que no bloqueen
+        el lote completo. Si la base de datos no está disponible, vuelca el resto.
+        """
+        written = 0
+        for index, obj in enumerate(batch):
+            try:
+                with transaction.atomic():
+                    self._insert_one(obj)
+                written += 1
+            except IntegrityError as e:
+                logger.error(f"Discarding invalid {self.model_label} row: {e}")
+            except Exception as e:
+                logger.error(f"Write-behind flush of {self.model_label} failed: {e}", exc_info=True)
+                self.spill(batch[index:])
+                break
+        return written
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def clear(self):
+        """Descarta lo pendiente sin escribirlo."""
+        with self._lock:
+            self._pending = []
+
+    def _spill_dir(self):
+        spill_dir = get_buffer_settings()['SPILL_DIR']
+        return Path(spill_dir) if spill_dir else None
+
+    def spill(self, batch=None):
+        """Vuelca filas a un fichero JSON duradero para reinyectarlas más tarde."""
+        if batch is None:
+            with self._lock:
+                batch, self._pending = self._pending, []
+        if not batch:
+            return None
+        spill_dir = self._spill_dir()
+        if spill_dir is None:
+            logger.error(f"Dropping {len(batch)} {self.model_label} rows: no SPILL_DIR configured.")
+            return None
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        path = spill_dir / f"{self.model_label}.{os.getpid()}.{time.time_ns()}.json"
+        path.write_text(serializers.serialize('json', batch))
+        logger.warning(f"Spilled {len(batch)} {self.model_label} rows to {path}")
+        return path
+
+    def replay_spilled(self) -> int:
+        """Reinyecta en la base de datos las filas volcadas por procesos anteriores."""
+        spill_dir = self._spill_dir()
+        if spill_dir is None or not spill_dir.exists():
+            return 0
+        replayed = 0
+        for path in sorted(spill_dir.glob(f"{self.model_label}.*.json")):
+            # Reclamamos el fichero con un rename atómico para que otro worker no lo duplique.
+            claimed = path.with_suffix(f".replaying-{os.getpid()}")
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                objs = [item.object for item in serializers.deserialize('json', claimed.read_text())]
+                self._bulk_insert(objs)
+                claimed.unlink()
+                replayed += len(objs)
+            except Exception as e:
+                logger.error(f"Replaying spill file {path} failed: {e}", exc_info=True)
+                os.rename(claimed, path.with_suffix('.failed'))
+        return replayed
+
+    def shutdown(self):
+        """Vacía lo pendiente al apagar el proceso; si la base de datos falla, lo vuelca a disco."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            has_pending = bool(self._pending)
+        if has_pending:
+            self.flush()
+
+
+@atexit.register
+def _shutdown_buffers():
+    for buffer in list(_registry):
+        try:
+            buffer.shutdown()
+        except Exception as e:
+            logger.error(f"Write-behind shutdown of {buffer.model_label} failed: {e}", exc_info=True)
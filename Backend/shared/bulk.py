@@ -0,0 +1,79 @@
+# shared/bulk.py
+"""
+Persistencia en bloque de grafos anidados enviados por los constructores
+(páginas y bloques de embudos, nodos y aristas de workflows).
+
+El cliente identifica cada elemento con un id temporal y lo usa para referenciar
+a otros elementos (una arista a sus nodos, un bloque a su página). Cada nivel se
+escribe con un único bulk_create y los ids temporales se traducen a las
+instancias creadas antes de escribir el nivel siguiente.
+"""
+from django.db import connections, router
+
+
+class TempIdMap:
+    """Registro id temporal del cliente -> instancia guardada, separado por modelo."""
+    def __init__(self):
+        self._ids = {}
+
+    def register(self, model, temp_id, instance):
+        self._ids.setdefault(model._meta.label, {})[temp_id] = instance
+
+    def resolve(self, model, temp_id):
+        return self._ids.get(model._meta.label, {}).get(temp_id)
+
+
+def _insert(model, objs, batch_size=None):
+    """
+    Inserta con bulk_create. En backends que no devuelven las claves primarias
+    de un INSERT múltiple se guarda fila a fila, porque los niveles siguientes
+    necesitan esas claves.
+    """
+    if not objs:
+        return objs
+    db = router.db_for_write(model)
+    if connections[db].features.can_return_rows_from_bulk_insert:
+        return model.objects.using(db).bulk_create(objs, batch_size=batch_size)
+    for obj in objs:
+        obj.save(force_insert=True, using=db)
+    return objs
+
+
+def bulk_create_level(model, rows, temp_ids: TempIdMap, *, references=None, skip_unresolved=False,
+                      temp_id_field='id', batch_size=None) -> list:
+    """
+    Crea un nivel del grafo en una sola inserción y devuelve las instancias en orden.
+
+    rows: diccionarios con los valores de los campos del modelo. El valor de
+        temp_id_field (si lo hay) se registra en temp_ids y no se guarda.
+    references: {campo: modelo} para los campos cuyo valor es un id temporal de
+        un nivel ya creado; se sustituye por la instancia correspondiente.
+    skip_unresolved: descarta las filas con referencias desconocidas en lugar de
+        lanzar ValueError.
+    """
+    references = references or {}
+    objs = []
+    pending_ids = []
+    for row in rows:
+        row = dict(row)
+        temp_id = row.pop(temp_id_field, None)
+        resolved = True
+        for field, target_model in references.items():
+            instance = temp_ids.resolve(target_model, row.get(field))
+            if instance is None:
+                if skip_unresolved:
+                    resolved = False
+                    break
+                raise ValueError(f"Unknown {target_model.__name__} id '{row.get(field)}' in {model.__name__}.{field}.")
+            row[field] = instance
+        if not resolved:
+            continue
+        objs.append(model(**row))
+        pending_ids.append(temp_id)
+
+    _insert(model, objs, batch_size=batch_size)
+
+    for temp_id, obj in zip(pending_ids, objs):
+        if temp_id is not None:
+            temp_ids.register(model, temp_id, obj)
+    return objs
@@ -0,0 +1,61 @@
+# shared/http.py
+import hashlib
+import json
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+DEFAULT_PUBLIC_MAX_AGE = 60
+
+
+def materialize_json(data) -> tuple:
+    """
+    Renderiza una sola vez la respuesta JSON y calcula su ETag fuerte.
+    Devuelve (cuerpo, etag) listos para guardarse junto al recurso publicado.
+    """
+    body = JSONRenderer().render(data).decode('utf-8')
+    etag = '"%s"' % hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+    return body, etag
+
+
+def etag_json_response(request, body: str, etag: str) -> HttpResponse:
+    """
+    Sirve un cuerpo JSON ya renderizado con ETag y Cache-Control.
+    Responde 304 si el cliente ya tiene esa representación (If-None-Match).
+    """
+    max_age = getattr(settings, 'PUBLIC_PAYLOAD_MAX_AGE', DEFAULT_PUBLIC_MAX_AGE)
+    cache_control = f"public, max-age={max_age}"
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if '*' in etags or etag in etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = cache_control
+            return response
+
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def sse_event(data, event: str = None) -> str:
+    """Formatea un mensaje server-sent events con data JSON."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events) -> StreamingHttpResponse:
+    """
+    Respuesta text/event-stream a partir de un iterable de mensajes ya
+    formateados con sse_event. Desactiva el buffering de proxies para que cada
+    fragmento llegue al cliente en cuanto se genera.
+    """
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
@@ -0,0 +1,105 @@
+# shared/jsonpatch.py
+"""
+Subconjunto de JSON Patch (RFC 6902) suficiente para versionar documentos JSON:
+make_patch genera operaciones add/remove/replace y apply_patch las aplica sin
+modificar el documento original.
+"""
+import copy
+
+
+def _escape(token) -> str:
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def _diff(source, target, path: str, ops: list):
+    if type(source) is not type(target):
+        ops.append({"op": "replace", "path": path, "value": target})
+    elif isinstance(source, dict):
+        for key in source:
+            if key not in target:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in target.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in source:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                _diff(source[key], value, child, ops)
+    elif isinstance(source, list):
+        common = min(len(source), len(target))
+        for index in range(common):
+            _diff(source[index], target[index], f"{path}/{index}", ops)
+        # Los elementos sobrantes se eliminan desde el final para que los índices sigan siendo válidos.
+        for index in range(len(source) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{index}"})
+        for index in range(common, len(target)):
+            ops.append({"op": "add", "path": f"{path}/{index}", "value": target[index]})
+    elif source != target:
+        ops.append({"op": "replace", "path": path, "value": target})
+
+
+def make_patch(source, target) -> list:
+    """Devuelve la lista de operaciones que transforma source en target."""
+    ops = []
+    _diff(source, target, '', ops)
+    return ops
+
+
+def _split(path: str) -> list:
+    if path == '':
+        return []
+    if not path.startswith('/'):
+        raise ValueError(f"Invalid JSON pointer '{path}'.")
+    return [_unescape(token) for token in path[1:].split('/')]
+
+
+def _child(container, token):
+    if isinstance(container, list):
+        return container[int(token)]
+    return container[token]
+
+
+def apply_patch(document, patch: list):
+    """
+    Aplica las operaciones sobre una copia de document y la devuelve.
+    Lanza ValueError si una operación no es aplicable.
+    """
+    document = copy.deepcopy(document)
+    for op in patch:
+        tokens = _split(op['path'])
+        value = copy.deepcopy(op.get('value'))
+        if not tokens:
+            if op['op'] == 'remove':
+                raise ValueError("Cannot remove the document root.")
+            document = value
+            continue
+        try:
+            parent = document
+            for token in tokens[:-1]:
+                parent = _child(parent, token)
+            last = tokens[-1]
+            if isinstance(parent, list):
+                index = len(parent) if last == '-' else int(last)
+                if op['op'] == 'add':
+                    parent.insert(index, value)
+                elif op['op'] == 'remove':
+                    del parent[index]
+                elif op['op'] == 'replace':
+                    parent[index] = value
+                else:
+                    raise ValueError(f"Unsupported patch operation '{op['op']}'.")
+            else:
+                if op['op'] == 'add' or op['op'] == 'replace':
+                    if op['op'] == 'replace' and last not in parent:
+                        raise KeyError(last)
+                    parent[last] = value
+                elif op['op'] == 'remove':
+                    del parent[last]
+                else:
+                    raise ValueError(f"Unsupported patch operation '{op['op']}'.")
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"Cannot apply '{op['op']}' at '{op['path']}': {e}")
+    return document
@@ -0,0 +1,21 @@
+# shared/management/commands/archive_domain_events.py
+from django.core.management.base import BaseCommand
+from shared.archiving import archive_processed_events
+
+class Command(BaseCommand):
+    help = 'Moves processed domain events older than N days into the archive table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, help='Archive events processed more than N days ago.')
+        parser.add_argument('--batch-size', type=int, help='Rows moved per transaction.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches.')
+
+    def handle(self, *args, **options):
+        result = archive_processed_events(
+            after_days=options['older_than_days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result['archived']} events, purged {result['purged']} archived rows."
+        ))
@@ -0,0 +1,14 @@
+# shared/management/commands/requeue_dead_letters.py
+from django.core.management.base import BaseCommand
+from shared.relay import requeue_dead_letters
+
+class Command(BaseCommand):
+    help = 'Returns dead-lettered domain events to the relay queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-type', help='Only requeue events of this type.')
+        parser.add_argument('--id', type=int, action='append', dest='ids', help='Only requeue this event id (repeatable).')
+
+    def handle(self, *args, **options):
+        count = requeue_dead_letters(event_type=options['event_type'], ids=options['ids'])
+        self.stdout.write(self.style.SUCCESS(f'Requeued {count} dead-lettered events.'))
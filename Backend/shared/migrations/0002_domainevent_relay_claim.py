@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="domainevent",
+            name="claim_token",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="domainevent",
+            name="claimed_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="domainevent",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("processed", "Processed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=50,
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-18 07:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0002_domainevent_relay_claim"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="domainevent",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="domainevent",
+            name="dead_lettered_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="domainevent",
+            name="next_attempt_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="domainevent",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("processed", "Processed"),
+                    ("failed", "Failed"),
+                    ("dead_letter", "Dead Letter"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=50,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="domainevent",
+            index=models.Index(
+                fields=["status", "next_attempt_at"], name="shared_event_poll_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="domainevent",
+            index=models.Index(
+                fields=["status", "dead_lettered_at"],
+                name="shared_event_dead_letter_idx",
+            ),
+        ),
+    ]
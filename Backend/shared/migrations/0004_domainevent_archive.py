@@ -0,0 +1,55 @@
+# Generated by Django 6.0 on 2026-10-18 07:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0003_domainevent_retries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DomainEventArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("original_id", models.BigIntegerField(db_index=True)),
+                ("event_type", models.CharField(max_length=255)),
+                ("payload", models.JSONField(default=dict)),
+                ("status", models.CharField(max_length=50)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("error_message", models.TextField(blank=True, null=True)),
+                ("created_at", models.DateTimeField()),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "archived_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("archive_month", models.DateField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="domainevent",
+            index=models.Index(
+                fields=["status", "processed_at"], name="shared_event_archive_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="domainevent",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["next_attempt_at", "id"],
+                name="shared_event_pending_idx",
+            ),
+        ),
+    ]
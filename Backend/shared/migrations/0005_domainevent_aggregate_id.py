@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0004_domainevent_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="domainevent",
+            name="aggregate_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="domainevent",
+            index=models.Index(
+                fields=["aggregate_id", "id"], name="shared_event_aggregate_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-18 07:59
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Now
+
+
+def failed_to_dead_letter(apps, schema_editor):
+    # Antes de 0003 el relay dejaba los eventos fallidos en 'failed'; ahora
+    # ese estado es 'dead_letter' y requeue_dead_letters solo mira ahí.
+    DomainEvent = apps.get_model('shared', 'DomainEvent')
+    DomainEvent.objects.filter(status='failed').update(
+        status='dead_letter',
+        dead_lettered_at=Coalesce('processed_at', Now()),
+        claim_token=None,
+        claimed_until=None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0005_domainevent_aggregate_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(failed_to_dead_letter, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="domainevent",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("processed", "Processed"),
+                    ("dead_letter", "Dead Letter"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=50,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shared", "0006_domainevent_failed_to_dead_letter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="domaineventarchive",
+            name="aggregate_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -1,17 +1,65 @@
 from django.db import models
+from django.utils import timezone
 
 class DomainEvent(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('processing', 'Processing'),
         ('processed', 'Processed'),
-        ('failed', 'Failed'),
+        ('dead_letter', 'Dead Letter'),
     ]
     event_type = models.CharField(max_length=255, db_index=True)
     payload = models.JSONField(default=dict)
+    # Entidad a la que pertenece el evento (ej. 'lead:42'): el relay procesa en
+    # orden de id los eventos de un mismo agregado.
+    aggregate_id = models.CharField(max_length=255, null=True, blank=True)
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='pending', db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True, null=True)
+    # Reclamo del relay (ver shared/relay.py): quién procesa el evento y hasta cuándo
+    claim_token = models.CharField(max_length=32, null=True, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    # Reintentos: el relay solo reclama eventos cuyo next_attempt_at ya pasó
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    dead_lettered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='shared_event_poll_idx'),
+            models.Index(fields=['status', 'dead_lettered_at'], name='shared_event_dead_letter_idx'),
+            models.Index(fields=['status', 'processed_at'], name='shared_event_archive_idx'),
+            models.Index(fields=['aggregate_id', 'id'], name='shared_event_aggregate_idx'),
+            # Índice parcial de la cola caliente: solo las filas pendientes, sin
+            # importar cuántos millones de procesadas acumule la tabla. En backends
+            # sin índices parciales Django lo omite y queda shared_event_poll_idx.
+            models.Index(fields=['next_attempt_at', 'id'], condition=models.Q(status='pending'),
+                         name='shared_event_pending_idx'),
+        ]
 
     def __str__(self):
         return f"Event {self.id}: {self.event_type} - {self.status}"
+
+
+class DomainEventArchive(models.Model):
+    """
+    Eventos procesados movidos fuera de DomainEvent (ver shared/archiving.py)
+    para mantener pequeña la tabla de la cola. archive_month está indexado para
+    que los meses antiguos se purguen con un único DELETE por rango.
+    """
+    original_id = models.BigIntegerField(db_index=True)
+    event_type = models.CharField(max_length=255)
+    aggregate_id = models.CharField(max_length=255, null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=50)
+    attempts = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    processed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    archive_month = models.DateField(db_index=True)
+
+    def __str__(self):
+        return f"Archived event {self.original_id}: {self.event_type}"
+
@@ -0,0 +1,358 @@
+# shared/relay.py
+"""
+Relay del outbox de DomainEvent.
+
+Cada ciclo reclama un lote de eventos marcándolos como 'processing' con un
+token y un lease (claimed_until). El reclamo es la única sección bloqueante:
+los handlers se ejecutan fuera de cualquier transacción y, si el proceso muere,
+el lease expira y otro relay vuelve a reclamar los eventos (entrega
+at-least-once). Los estados finales se escriben en bloque.
+
+Un evento cuyo handler falla vuelve a 'pending' con next_attempt_at aplazado
+con backoff exponencial (con jitter, para no reintentar todos a la vez). Tras
+MAX_ATTEMPTS reclamos pasa a 'dead_letter' y solo se reactiva a mano
+(requeue_dead_letters).
+
+Cada handler suscrito (shared/subscribers.py) recibe sus eventos repartidos en
+carriles secuenciales, tantos como su límite de concurrencia, que se ejecutan
+en un pool de hilos (o en el hilo del relay si el handler no es run_async).
+Los eventos con el mismo aggregate_id comparten carril y se procesan en orden
+de id; si uno falla, los siguientes de su agregado se aplazan hasta que aquél
+se resuelva.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import DomainEvent
+from .subscribers import get_subscriptions_for_event
+
+logger = logging.getLogger(__name__)
+
+# Marca de _run_lane para eventos no ejecutados porque uno anterior de su agregado falló
+DEFERRED = object()
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'LEASE_SECONDS': 60,
+    'MAX_BATCHES_PER_RUN': 20,
+    'MAX_WORKERS': 8,  # 1 ejecuta los handlers en el hilo del relay
+    'DEFAULT_CONCURRENCY': 4,
+    'CONCURRENCY': {},  # patrón suscrito -> número de carriles, si el handler no fija el suyo
+    'MAX_ATTEMPTS': 8,
+    'RETRY_BASE_SECONDS': 5,
+    'RETRY_MAX_SECONDS': 3600,
+    'WAKEUP': 'auto',  # 'auto', 'celery', 'local' o None (ver shared/wakeup.py)
+}
+
+
+def get_relay_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'DOMAIN_EVENT_RELAY', {})}
+
+
+class RelayMetrics:
+    """Contadores acumulados del relay en este proceso."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.claimed = 0
+        self.processed = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.busy_seconds = 0.0
+
+    def record(self, claimed: int, processed: int, failed: int, dead_lettered: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.claimed += claimed
+            self.processed += processed
+            self.failed += failed
+            self.dead_lettered += dead_lettered
+            self.busy_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'claimed': self.claimed,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dead_lettered': self.dead_lettered,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'events_per_second': round(self.claimed / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+            }
+
+
+relay_metrics = RelayMetrics()
+
+
+def _claimable(now):
+    # Pendientes cuyo próximo intento ya venció, o en proceso con el lease
+    # vencido (el relay que los tenía murió).
+    return Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', claimed_until__lt=now)
+
+
+def _not_blocked_by_aggregate(now):
+    # Un evento espera si un evento anterior de su agregado sigue en curso o
+    # aguardando un reintento; así el orden por agregado se mantiene entre lotes.
+    earlier_unfinished = DomainEvent.objects.filter(
+        aggregate_id=OuterRef('aggregate_id'), id__lt=OuterRef('id')
+    ).filter(Q(status='pending', next_attempt_at__gt=now) | Q(status='processing', claimed_until__gte=now))
+    return Q(aggregate_id__isnull=True) | ~Exists(earlier_unfinished)
+
+
+def retry_delay(attempts: int, config) -> float:
+    """Segundos hasta el siguiente intento: exponencial, acotado y con jitter."""
+    delay = min(config['RETRY_MAX_SECONDS'], config['RETRY_BASE_SECONDS'] * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_events(batch_size: int, lease_seconds: float):
+    """
+    Reclama hasta batch_size eventos en orden de próximo intento. Cada reclamo
+    cuenta como intento, así un evento que tumba al proceso también se agota.
+    Devuelve (token, eventos); solo se devuelven los eventos que este token ganó.
+    """
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            DomainEvent.objects.filter(_claimable(now), _not_blocked_by_aggregate(now))
+            .order_by('next_attempt_at', 'id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return token, []
+        # La condición se repite en el UPDATE: en backends sin SKIP LOCKED otro
+        # relay pudo reclamar alguno de estos ids entre la lectura y la escritura.
+        DomainEvent.objects.filter(_claimable(now), id__in=ids).update(
+            status='processing', claim_token=token, claimed_until=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1
+        )
+    events = list(DomainEvent.objects.filter(id__in=ids, claim_token=token).order_by('next_attempt_at', 'id'))
+    return token, events
+
+
+class HandlerTimeout(Exception):
+    pass
+
+
+def _call_handler(subscription, payload):
+    if not subscription.timeout:
+        subscription.handler(payload)
+        return
+    # Un hilo no se puede interrumpir: al vencer el plazo el relay deja de
+    # esperar y da el evento por fallido; el hilo termina por su cuenta.
+    outcome = {}
+
+    def target():
+        try:
+            subscription.handler(payload)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=target, name=f"event-handler-{subscription.name}", daemon=True)
+    thread.start()
+    thread.join(subscription.timeout)
+    if thread.is_alive():
+        raise HandlerTimeout(f"Handler {subscription.name} timed out after {subscription.timeout}s")
+    if 'error' in outcome:
+        raise outcome['error']
+
+
+def _run_lane(subscription, events, close_connections: bool) -> dict:
+    """
+    Ejecuta en orden un handler sobre los eventos de su carril.
+    Devuelve {event_id: error o DEFERRED}.
+    """
+    errors = {}
+    failed_aggregates = set()
+    try:
+        for event in events:
+            if event.aggregate_id is not None and event.aggregate_id in failed_aggregates:
+                errors[event.id] = DEFERRED
+                continue
+            try:
+                _call_handler(subscription, event.payload)
+            except Exception as e:
+                logger.error(f"Error processing event {event.id} in {subscription.name}: {e}", exc_info=True)
+                errors[event.id] = str(e)
+                if event.aggregate_id is not None:
+                    failed_aggregates.add(event.aggregate_id)
+    finally:
+        if close_connections:
+            connections.close_all()
+    return errors
+
+
+def _build_lanes(events, config) -> list:
+    """
+    Reparte el lote en carriles (subscription, eventos). Cada handler recibe
+    tantos carriles como su límite de concurrencia; los eventos de un mismo
+    agregado van siempre al mismo carril, aunque el handler esté suscrito a
+    varios tipos, y se ejecutan en orden de id.
+    """
+    subscriptions_by_type = {}
+    for event_type in {event.event_type for event in events}:
+        subscriptions_by_type[event_type] = get_subscriptions_for_event(event_type)
+        if not subscriptions_by_type[event_type]:
+            # Se marca como procesado aunque no haya suscriptores
+            logger.warning(f"No subscribers found for event type: {event_type}")
+
+    by_handler = {}  # handler -> (primera suscripción, eventos)
+    for event in sorted(events, key=lambda event: event.id):
+        for subscription in subscriptions_by_type[event.event_type]:
+            by_handler.setdefault(subscription.handler, (subscription, []))[1].append(event)
+
+    lanes = []
+    for subscription, matched in by_handler.values():
+        concurrency = subscription.concurrency or config['CONCURRENCY'].get(
+            subscription.pattern, config['DEFAULT_CONCURRENCY']
+        )
+        typed_lanes = [[] for _ in range(max(1, min(concurrency, len(matched))))]
+        for index, event in enumerate(matched):
+            key = index if event.aggregate_id is None else hash(event.aggregate_id)
+            typed_lanes[key % len(typed_lanes)].append(event)
+        lanes.extend((subscription, lane) for lane in typed_lanes if lane)
+    return lanes
+
+
+def dispatch_handlers(events, config) -> dict:
+    """
+    Ejecuta los handlers de un lote y devuelve el resultado por id de evento:
+    un error si algún handler falló, DEFERRED si solo se aplazó.
+    """
+    lanes = _build_lanes(events, config)
+    pooled = [lane for lane in lanes if lane[0].run_async]
+    inline = [lane for lane in lanes if not lane[0].run_async]
+    if config['MAX_WORKERS'] <= 1 or len(pooled) <= 1:
+        inline, pooled = pooled + inline, []
+
+    results = []
+    if pooled:
+        with ThreadPoolExecutor(max_workers=min(config['MAX_WORKERS'], len(pooled)), thread_name_prefix='event-relay') as pool:
+            futures = [pool.submit(_run_lane, subscription, lane, True) for subscription, lane in pooled]
+            # Los handlers síncronos corren en el hilo del relay mientras el pool trabaja.
+            results.extend(_run_lane(subscription, lane, False) for subscription, lane in inline)
+            results.extend(future.result() for future in futures)
+    else:
+        results.extend(_run_lane(subscription, lane, False) for subscription, lane in inline)
+
+    errors = {}
+    for lane_errors in results:
+        for event_id, error in lane_errors.items():
+            # Un error real prevalece sobre un aplazamiento de otro handler.
+            if errors.get(event_id) is None or errors[event_id] is DEFERRED:
+                errors[event_id] = error
+    return errors
+
+
+def _finalize(token: str, events, errors: dict, config) -> int:
+    """
+    Escribe los estados finales en bloque, solo para los eventos que este token
+    sigue poseyendo. Devuelve cuántos eventos pasaron a dead letter.
+    """
+    now = timezone.now()
+    processed_ids = [event.id for event in events if event.id not in errors]
+    if processed_ids:
+        DomainEvent.objects.filter(id__in=processed_ids, claim_token=token).update(
+            status='processed', processed_at=now, claimed_until=None, error_message=None
+        )
+    if not errors:
+        return 0
+
+    owned = set(DomainEvent.objects.filter(id__in=list(errors), claim_token=token).values_list('id', flat=True))
+    failed = []
+    for event in events:
+        if event.id not in owned:
+            continue
+        event.claimed_until = None
+        if errors[event.id] is DEFERRED:
+            # No llegó a ejecutarse: vuelve a la cola sin consumir un intento.
+            event.status = 'pending'
+            event.attempts -= 1
+            failed.append(event)
+            continue
+        event.error_message = errors[event.id]
+        if event.attempts >= config['MAX_ATTEMPTS']:
+            event.status = 'dead_letter'
+            event.dead_lettered_at = now
+        else:
+            event.status = 'pending'
+            event.next_attempt_at = now + timedelta(seconds=retry_delay(event.attempts, config))
+        failed.append(event)
+    DomainEvent.objects.bulk_update(
+        failed, ['status', 'attempts', 'error_message', 'claimed_until', 'next_attempt_at', 'dead_lettered_at']
+    )
+    dead_lettered = sum(1 for event in failed if event.status == 'dead_letter')
+    if dead_lettered:
+        logger.error(f"{dead_lettered} domain events moved to dead letter after {config['MAX_ATTEMPTS']} attempts.")
+    return dead_lettered
+
+
+def process_batch(config=None) -> dict:
+    """Reclama, procesa y cierra un lote. Devuelve un resumen del lote."""
+    config = config or get_relay_settings()
+    started = time.monotonic()
+    token, events = claim_events(config['BATCH_SIZE'], config['LEASE_SECONDS'])
+    if not events:
+        return {'claimed': 0, 'processed': 0, 'failed': 0, 'dead_lettered': 0, 'seconds': 0.0}
+
+    errors = dispatch_handlers(events, config)
+    dead_lettered = _finalize(token, events, errors, config)
+
+    seconds = time.monotonic() - started
+    deferred = sum(1 for error in errors.values() if error is DEFERRED)
+    summary = {
+        'claimed': len(events), 'processed': len(events) - len(errors), 'failed': len(errors) - deferred,
+        'dead_lettered': dead_lettered, 'seconds': seconds,
+    }
+    relay_metrics.record(summary['claimed'], summary['processed'], summary['failed'], dead_lettered, seconds)
+    logger.info(
+        f"Relayed {summary['claimed']} domain events in {seconds:.3f}s "
+        f"({summary['processed']} processed, {summary['failed']} failed)."
+    )
+    return summary
+
+
+def relay_pending_events(max_batches: int = None) -> dict:
+    """Procesa lotes hasta vaciar la cola o alcanzar max_batches."""
+    config = get_relay_settings()
+    max_batches = max_batches or config['MAX_BATCHES_PER_RUN']
+    totals = {'batches': 0, 'claimed': 0, 'processed': 0, 'failed': 0, 'dead_lettered': 0}
+    for _ in range(max_batches):
+        summary = process_batch(config)
+        if not summary['claimed']:
+            break
+        totals['batches'] += 1
+        for key in ('claimed', 'processed', 'failed', 'dead_lettered'):
+            totals[key] += summary[key]
+        if summary['claimed'] < config['BATCH_SIZE']:
+            break
+    return totals
+
+
+def requeue_dead_letters(event_type: str = None, ids=None) -> int:
+    """Devuelve eventos en dead letter a la cola con los intentos a cero."""
+    queryset = DomainEvent.objects.filter(status='dead_letter')
+    if event_type:
+        queryset = queryset.filter(event_type=event_type)
+    if ids:
+        queryset = queryset.filter(id__in=ids)
+    return queryset.update(status='pending', attempts=0, next_attempt_at=timezone.now(), dead_lettered_at=None)
+
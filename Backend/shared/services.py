@@ -1,12 +1,36 @@
 from .models import DomainEvent
+from .wakeup import schedule_relay_wakeup
 
 class EventDispatcher:
     @staticmethod
-    def dispatch(event_type: str, payload: dict):
+    def dispatch(event_type: str, payload: dict, aggregate_id: str = None):
         """
         Crea un nuevo DomainEvent en la base de datos para ser procesado asíncronamente.
+        Al confirmarse la transacción se despierta al relay (ver shared/wakeup.py),
+        sin esperar al siguiente ciclo del poller.
         """
-        DomainEvent.objects.create(event_type=event_type, payload=payload)
+        DomainEvent.objects.create(event_type=event_type, payload=payload, aggregate_id=aggregate_id)
+        schedule_relay_wakeup()
+
+    @staticmethod
+    def dispatch_many(events, batch_size: int = 1000) -> list:
+        """
+        Crea varios DomainEvent con un solo bulk_create dentro de la transacción
+        del llamante. Cada elemento es un dict con event_type, payload y,
+        opcionalmente, aggregate_id. Los ids siguen el orden de la lista, que es
+        el orden en que el relay procesará los eventos de un mismo agregado.
+        """
+        created = DomainEvent.objects.bulk_create([
+            DomainEvent(
+                event_type=event['event_type'],
+                payload=event.get('payload') or {},
+                aggregate_id=event.get('aggregate_id'),
+            )
+            for event in events
+        ], batch_size=batch_size)
+        if created:
+            schedule_relay_wakeup()
+        return created
 
 # Instancia global para ser usada por otros módulos
 event_dispatcher = EventDispatcher()
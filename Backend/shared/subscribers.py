@@ -1,18 +1,110 @@
 # Registro de suscriptores a eventos de dominio
-# Mapea event_type -> lista de funciones handler
+#
+# Los patrones se separan por puntos: 'lead.created' es un tipo concreto,
+# 'lead.*' encaja con exactamente un segmento y '**' con cualquier número de
+# segmentos (incluido ninguno), al final o en medio: 'lead.**' o 'lead.**.created'.
+# Los patrones se compilan en un trie al
+# suscribirse y la lista de handlers de cada tipo concreto se cachea, así el
+# relay no recorre patrones por evento.
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
 
-EVENT_SUBSCRIBERS = {}
 
-def subscribe(event_type: str, handler_func):
+@dataclass(frozen=True)
+class Subscription:
+    """Un handler suscrito a un patrón, con sus opciones de ejecución en el relay."""
+    pattern: str
+    handler: Callable
+    # False: el relay lo ejecuta en su propio hilo, nunca en el pool
+    run_async: bool = True
+    # Segundos; al superarlos el evento cuenta como fallido y se reintenta
+    timeout: Optional[float] = None
+    # Máximo de carriles concurrentes para este handler (None: el de la configuración del relay)
+    concurrency: Optional[int] = None
+    order: int = 0  # orden de suscripción, para devolver los handlers de forma estable
+
+    @property
+    def name(self) -> str:
+        return getattr(self.handler, '__name__', repr(self.handler))
+
+
+class _TrieNode:
+    __slots__ = ('children', 'subscriptions')
+
+    def __init__(self):
+        self.children = {}
+        self.subscriptions = []
+
+
+class SubscriberRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._root = _TrieNode()
+            self._resolved = {}
+            self._count = 0
+
+    def subscribe(self, pattern: str, handler, **options) -> Subscription:
+        with self._lock:
+            subscription = Subscription(pattern=pattern, handler=handler, order=self._count, **options)
+            self._count += 1
+            node = self._root
+            for segment in pattern.split('.'):
+                node = node.children.setdefault(segment, _TrieNode())
+            node.subscriptions.append(subscription)
+            # Un patrón nuevo puede afectar a cualquier tipo ya resuelto.
+            self._resolved = {}
+        return subscription
+
+    def _match(self, node, segments, index, found):
+        globstar = node.children.get('**')
+        if globstar is not None:
+            # '**' consume desde cero hasta todos los segmentos restantes
+            for rest in range(index, len(segments) + 1):
+                self._match(globstar, segments, rest, found)
+        if index == len(segments):
+            found.extend(node.subscriptions)
+            return
+        for key in (segments[index], '*'):
+            child = node.children.get(key)
+            if child is not None:
+                self._match(child, segments, index + 1, found)
+
+    def resolve(self, event_type: str) -> tuple:
+        """Suscripciones que aplican a un tipo de evento concreto, en orden de suscripción."""
+        resolved = self._resolved.get(event_type)
+        if resolved is not None:
+            return resolved
+        with self._lock:
+            found = []
+            self._match(self._root, event_type.split('.'), 0, found)
+            resolved = tuple(sorted(set(found), key=lambda subscription: subscription.order))
+            self._resolved[event_type] = resolved
+        return resolved
+
+    def __len__(self):
+        return self._count
+
+
+# Instancia global: automation.subscribers registra aquí sus handlers al arrancar
+EVENT_SUBSCRIBERS = SubscriberRegistry()
+
+def subscribe(event_type: str, handler_func, **options):
     """
-    Añade un handler a la lista de suscriptores para un tipo de evento.
+    Añade un handler para un tipo de evento o un patrón con comodines.
+    Opciones: run_async, timeout, concurrency (ver Subscription).
     """
-    if event_type not in EVENT_SUBSCRIBERS:
-        EVENT_SUBSCRIBERS[event_type] = []
-    EVENT_SUBSCRIBERS[event_type].append(handler_func)
+    return EVENT_SUBSCRIBERS.subscribe(event_type, handler_func, **options)
+
+def get_subscriptions_for_event(event_type: str) -> tuple:
+    return EVENT_SUBSCRIBERS.resolve(event_type)
 
 def get_subscribers_for_event(event_type: str):
     """
     Obtiene todos los handlers suscritos a un tipo de evento.
     """
-    return EVENT_SUBSCRIBERS.get(event_type, [])
+    return [subscription.handler for subscription in get_subscriptions_for_event(event_type)]
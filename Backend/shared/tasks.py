@@ -1,45 +1,28 @@
 import logging
 from celery import shared_task
-from django.utils import timezone
-from django.db import transaction
-from .models import DomainEvent
-from .subscribers import get_subscribers_for_event
+from .relay import relay_pending_events
+from .archiving import archive_processed_events as archive_events
 
 logger = logging.getLogger(__name__)
 
 @shared_task
-def process_pending_events():
+def process_pending_events(max_batches: int = None):
     """
-    Procesa todos los eventos de dominio pendientes.
-    Esta tarea debería ser llamada periódicamente (ej. cada 10 segundos).
+    Procesa los eventos de dominio pendientes a través del relay del outbox
+    (ver shared/relay.py). Se encola al confirmarse cada transacción que emite
+    eventos (shared/wakeup.py) y además periódicamente, como red de seguridad;
+    cada ejecución drena hasta MAX_BATCHES_PER_RUN lotes.
     """
-    pending_events = DomainEvent.objects.filter(status='pending').order_by('created_at')
+    totals = relay_pending_events(max_batches)
+    if totals['claimed']:
+        logger.info(f"Relay run finished: {totals}")
+    return totals
 
-    with transaction.atomic():
-        # Bloqueamos los eventos para evitar procesamiento duplicado por workers concurrentes
-        events_to_process = list(pending_events.select_for_update(skip_locked=True)[:10]) # Procesar en lotes de 10
-
-    logger.info(f"Processing {len(events_to_process)} pending domain events.")
-
-    for event in events_to_process:
-        handlers = get_subscribers_for_event(event.event_type)
-        if not handlers:
-            logger.warning(f"No subscribers found for event type: {event.event_type}")
-            event.status = 'processed' # Marcar como procesado aunque no haya suscriptores
-            event.processed_at = timezone.now()
-            event.save()
-            continue
-
-        try:
-            for handler in handlers:
-                logger.info(f"Executing handler {handler.__name__} for event {event.id}")
-                handler(event.payload)
+@shared_task
+def archive_processed_events():
+    """
+    Mueve los eventos ya procesados a DomainEventArchive para que la cola del
+    relay no crezca sin límite. Pensada para ejecutarse periódicamente (ej. cada hora).
+    """
+    return archive_events()
 
-            event.status = 'processed'
-            event.processed_at = timezone.now()
-        except Exception as e:
-            logger.error(f"Error processing event {event.id}: {e}", exc_info=True)
-            event.status = 'failed'
-            event.error_message = str(e)
-        finally:
-            event.save()
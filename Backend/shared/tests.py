@@ -1,8 +1,26 @@
-from django.test import TestCase
-from unittest.mock import MagicMock
-from .models import DomainEvent
-from .subscribers import subscribe, EVENT_SUBSCRIBERS
+import importlib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+from django.apps import apps as django_apps
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .archiving import archive_processed_events
+from .buffers import WriteBehindBuffer
+from .jsonpatch import apply_patch, make_patch
+from .models import DomainEvent, DomainEventArchive
+from .relay import claim_events, relay_metrics, requeue_dead_letters
+from .services import event_dispatcher
+from .subscribers import subscribe, EVENT_SUBSCRIBERS, SubscriberRegistry, get_subscribers_for_event
 from .tasks import process_pending_events
+from .wakeup import LocalRelayWorker, wake_relay
+
 
 class EventProcessorTests(TestCase):
     def tearDown(self):
@@ -29,3 +47,372 @@ class EventProcessorTests(TestCase):
         # Verificamos que el evento fue marcado como procesado
         event = DomainEvent.objects.first()
         self.assertEqual(event.status, 'processed')
+
+
+@override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0, 'BATCH_SIZE': 2})
+class WriteBehindBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = WriteBehindBuffer('shared.DomainEvent')
+
+    def test_flushes_when_batch_size_is_reached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buffer.add(DomainEvent(event_type='test.buffered'))
+        self.assertEqual(DomainEvent.objects.count(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buffer.add(DomainEvent(event_type='test.buffered'))
+        self.assertEqual(DomainEvent.objects.count(), 2)
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+    def test_rows_are_not_enqueued_before_commit(self):
+        self.buffer.add(DomainEvent(event_type='test.buffered'))
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+    def test_spill_and_replay(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            with override_settings(WRITE_BEHIND_BUFFER={'FLUSH_INTERVAL': 0, 'BATCH_SIZE': 10, 'SPILL_DIR': spill_dir}):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.buffer.add(DomainEvent(event_type='test.spilled', payload={'n': 1}))
+                    self.buffer.add(DomainEvent(event_type='test.spilled', payload={'n': 2}))
+
+                self.assertIsNotNone(self.buffer.spill())
+                self.assertEqual(DomainEvent.objects.count(), 0)
+
+                self.assertEqual(self.buffer.replay_spilled(), 2)
+                self.assertEqual(DomainEvent.objects.filter(event_type='test.spilled').count(), 2)
+
+
+class JsonPatchTests(TestCase):
+    def test_patch_round_trip(self):
+        source = {"pages": [{"id": "a", "blocks": [1, 2, 3]}, {"id": "b"}], "title": "x", "a/b": {"~": 1}}
+        target = {"pages": [{"id": "a", "blocks": [1, 5]}], "title": "y", "a/b": {"~": 2}, "new": None}
+
+        patch = make_patch(source, target)
+
+        self.assertEqual(apply_patch(source, patch), target)
+        self.assertEqual(source["pages"][0]["blocks"], [1, 2, 3])
+        self.assertEqual(make_patch(target, target), [])
+
+    def test_invalid_patch_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            apply_patch({}, [{"op": "remove", "path": "/missing"}])
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        relay_metrics.reset()
+
+    def tearDown(self):
+        EVENT_SUBSCRIBERS.clear()
+
+    def _fail_on_odd(self, payload):
+        if payload['n'] % 2:
+            raise RuntimeError(f"odd {payload['n']}")
+
+    def test_batch_is_processed_with_bulk_status_updates(self):
+        seen = []
+        subscribe('lead.created', lambda payload: seen.append(payload['n']))
+        subscribe('lead.updated', self._fail_on_odd)
+        DomainEvent.objects.bulk_create(
+            [DomainEvent(event_type='lead.created', payload={'n': n}) for n in range(40)]
+            + [DomainEvent(event_type='lead.updated', payload={'n': n}) for n in range(10)]
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            totals = process_pending_events()
+
+        self.assertEqual(totals, {'batches': 1, 'claimed': 50, 'processed': 45, 'failed': 5, 'dead_lettered': 0})
+        self.assertEqual(sorted(seen), list(range(40)))
+        self.assertEqual(DomainEvent.objects.filter(status='processed').count(), 45)
+        # Los fallos quedan programados para reintento, no fallidos para siempre.
+        failed = DomainEvent.objects.filter(status='pending').order_by('id')
+        self.assertEqual([e.error_message for e in failed], [f"odd {n}" for n in (1, 3, 5, 7, 9)])
+        self.assertTrue(all(e.attempts == 1 and e.next_attempt_at > timezone.now() for e in failed))
+        # Reclamo + estados finales, sin escrituras por evento.
+        self.assertLess(len(queries), 15)
+        self.assertEqual(relay_metrics.snapshot()['claimed'], 50)
+
+    @override_settings(DOMAIN_EVENT_RELAY={'BATCH_SIZE': 10})
+    def test_batch_size_bounds_each_claim(self):
+        DomainEvent.objects.bulk_create([DomainEvent(event_type='test.event') for _ in range(25)])
+        totals = process_pending_events()
+        self.assertEqual(totals['batches'], 3)
+        self.assertEqual(DomainEvent.objects.filter(status='processed').count(), 25)
+
+    def test_only_expired_leases_are_reclaimed(self):
+        now = timezone.now()
+        held = DomainEvent.objects.create(event_type='test.event', status='processing',
+                                          claim_token='other', claimed_until=now + timedelta(minutes=1))
+        expired = DomainEvent.objects.create(event_type='test.event', status='processing',
+                                             claim_token='dead', claimed_until=now - timedelta(seconds=1))
+
+        token, events = claim_events(batch_size=10, lease_seconds=60)
+
+        self.assertEqual([event.id for event in events], [expired.id])
+        held.refresh_from_db()
+        self.assertEqual(held.claim_token, 'other')
+        self.assertEqual(events[0].claim_token, token)
+
+    @override_settings(DOMAIN_EVENT_RELAY={'MAX_ATTEMPTS': 3, 'RETRY_BASE_SECONDS': 10})
+    def test_failed_events_back_off_and_end_in_dead_letter(self):
+        calls = []
+
+        def flaky(payload):
+            calls.append(payload)
+            raise RuntimeError("downstream unavailable")
+
+        subscribe('lead.created', flaky)
+        event = DomainEvent.objects.create(event_type='lead.created', payload={'n': 1})
+
+        delays = []
+        for attempt in range(1, 4):
+            process_pending_events()
+            # Mientras no venza next_attempt_at el relay no lo vuelve a reclamar.
+            self.assertEqual(process_pending_events()['claimed'], 0)
+            event.refresh_from_db()
+            self.assertEqual(event.attempts, attempt)
+            if attempt < 3:
+                delays.append((event.next_attempt_at - timezone.now()).total_seconds())
+                DomainEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+
+        self.assertEqual(len(calls), 3)
+        # Backoff exponencial con jitter: 10s * [0.5, 1.0] y luego 20s * [0.5, 1.0].
+        self.assertTrue(4 < delays[0] <= 10)
+        self.assertTrue(9 < delays[1] <= 20)
+        self.assertEqual(event.status, 'dead_letter')
+        self.assertIsNotNone(event.dead_lettered_at)
+        self.assertEqual(relay_metrics.snapshot()['dead_lettered'], 1)
+
+        self.assertEqual(requeue_dead_letters(event_type='lead.created'), 1)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 0))
+
+    def test_legacy_failed_events_are_migrated_to_dead_letter(self):
+        migration = importlib.import_module('shared.migrations.0006_domainevent_failed_to_dead_letter')
+        failed_at = timezone.now() - timedelta(days=2)
+        legacy = DomainEvent.objects.create(event_type='lead.created', status='failed', processed_at=failed_at)
+        never_processed = DomainEvent.objects.create(event_type='lead.created', status='failed')
+
+        migration.failed_to_dead_letter(django_apps, None)
+
+        legacy.refresh_from_db()
+        never_processed.refresh_from_db()
+        self.assertEqual((legacy.status, legacy.dead_lettered_at), ('dead_letter', failed_at))
+        self.assertEqual(never_processed.status, 'dead_letter')
+        self.assertIsNotNone(never_processed.dead_lettered_at)
+        self.assertEqual(requeue_dead_letters(), 2)
+
+
+class DomainEventArchiveTests(TestCase):
+    def test_old_processed_events_are_moved_in_batches(self):
+        now = timezone.now()
+        old = now - timedelta(days=30)
+        DomainEvent.objects.bulk_create(
+            [DomainEvent(event_type='lead.created', status='processed', processed_at=old, payload={'n': n},
+                         aggregate_id=f'lead:{n}') for n in range(7)]
+            + [DomainEvent(event_type='lead.created', status='processed', processed_at=now),
+               DomainEvent(event_type='lead.created', status='pending'),
+               DomainEvent(event_type='lead.created', status='dead_letter', dead_lettered_at=old)]
+        )
+
+        result = archive_processed_events(after_days=7, batch_size=3)
+
+        self.assertEqual(result, {'archived': 7, 'purged': 0})
+        self.assertEqual(DomainEvent.objects.count(), 3)
+        self.assertFalse(DomainEvent.objects.filter(processed_at=old).exists())
+        archived = DomainEventArchive.objects.order_by('original_id')
+        self.assertEqual([row.payload['n'] for row in archived], list(range(7)))
+        self.assertEqual(archived[3].aggregate_id, 'lead:3')
+        self.assertEqual(archived[0].archive_month, old.date().replace(day=1))
+
+    @override_settings(DOMAIN_EVENT_ARCHIVE={'RETENTION_MONTHS': 3})
+    def test_archive_months_beyond_retention_are_purged(self):
+        today = timezone.now().date().replace(day=1)
+        DomainEventArchive.objects.bulk_create([
+            DomainEventArchive(original_id=1, event_type='x', status='processed', created_at=timezone.now(),
+                               archive_month=today.replace(year=today.year - 1)),
+            DomainEventArchive(original_id=2, event_type='x', status='processed', created_at=timezone.now(),
+                               archive_month=today),
+        ])
+        self.assertEqual(archive_processed_events()['purged'], 1)
+        self.assertEqual(list(DomainEventArchive.objects.values_list('original_id', flat=True)), [2])
+
+
+class RelayWakeupTests(TestCase):
+    def test_one_wakeup_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                for n in range(5):
+                    event_dispatcher.dispatch('lead.created', {'n': n})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(DomainEvent.objects.count(), 5)
+
+    def test_rolled_back_wakeup_does_not_swallow_the_next_one(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        event_dispatcher.dispatch('lead.created', {})
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                event_dispatcher.dispatch('lead.created', {})
+        self.assertEqual(len(callbacks), 1)
+
+    def test_each_committed_transaction_wakes_the_relay(self):
+        with patch('shared.wakeup.wake_relay') as wake:
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        event_dispatcher.dispatch('lead.created', {})
+        self.assertEqual(wake.call_count, 2)
+
+    @override_settings(DOMAIN_EVENT_RELAY={'WAKEUP': None})
+    def test_wakeup_can_be_disabled(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            event_dispatcher.dispatch('lead.created', {})
+        self.assertEqual(callbacks, [])
+
+    @override_settings(DOMAIN_EVENT_RELAY={'WAKEUP': 'celery'})
+    def test_celery_wakeup_enqueues_the_relay_task(self):
+        with patch('shared.tasks.process_pending_events.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                event_dispatcher.dispatch('lead.created', {})
+        apply_async.assert_called_once_with(retry=False)
+
+    def test_auto_wakeup_uses_celery_only_with_a_broker(self):
+        with patch('shared.wakeup.broker_configured', return_value=False), \
+                patch('shared.wakeup.local_relay_worker') as worker, \
+                patch('shared.tasks.process_pending_events.apply_async') as apply_async:
+            wake_relay()
+        worker.wake.assert_called_once_with()
+        apply_async.assert_not_called()
+
+        with patch('shared.wakeup.broker_configured', return_value=True), \
+                patch('shared.tasks.process_pending_events.apply_async') as apply_async:
+            wake_relay()
+        apply_async.assert_called_once_with(retry=False)
+
+    def test_local_worker_runs_the_relay_when_woken(self):
+        ran = threading.Event()
+        with patch('shared.wakeup.relay_pending_events', side_effect=lambda: ran.set()):
+            LocalRelayWorker().wake()
+            self.assertTrue(ran.wait(timeout=5))
+
+
+class DispatchManyTests(TestCase):
+    def tearDown(self):
+        EVENT_SUBSCRIBERS.clear()
+
+    def test_dispatch_many_inserts_with_a_single_query(self):
+        events = [{'event_type': 'lead.imported', 'payload': {'n': n}, 'aggregate_id': f'lead:{n}'} for n in range(50)]
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(1):
+                created = event_dispatcher.dispatch_many(events)
+        self.assertEqual(len(created), 50)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(DomainEvent.objects.order_by('id').values_list('payload__n', flat=True)), list(range(50)))
+
+    def test_events_of_an_aggregate_are_handled_in_order(self):
+        seen = []
+        lock = threading.Lock()
+
+        def record(payload):
+            with lock:
+                seen.append((payload['lead'], payload['step']))
+
+        subscribe('lead.created', record)
+        subscribe('lead.updated', record)
+        event_dispatcher.dispatch_many([
+            {'event_type': 'lead.created' if step == 0 else 'lead.updated',
+             'payload': {'lead': lead, 'step': step}, 'aggregate_id': f'lead:{lead}'}
+            for step in range(5) for lead in range(6)
+        ])
+
+        process_pending_events()
+
+        for lead in range(6):
+            self.assertEqual([step for seen_lead, step in seen if seen_lead == lead], list(range(5)))
+
+    def test_failure_defers_the_rest_of_its_aggregate(self):
+        seen = []
+
+        def handler(payload):
+            if payload['step'] == 1 and not seen.count((payload['step'], 'failed')):
+                seen.append((payload['step'], 'failed'))
+                raise RuntimeError("transient")
+            seen.append((payload['step'], 'ok'))
+
+        subscribe('lead.updated', handler)
+        event_dispatcher.dispatch_many([
+            {'event_type': 'lead.updated', 'payload': {'step': step}, 'aggregate_id': 'lead:1'} for step in range(3)
+        ])
+
+        process_pending_events()
+        self.assertEqual(seen, [(0, 'ok'), (1, 'failed')])
+        deferred = DomainEvent.objects.get(payload__step=2)
+        self.assertEqual((deferred.status, deferred.attempts), ('pending', 0))
+        # El evento aplazado no adelanta al que espera su reintento.
+        self.assertEqual(process_pending_events()['claimed'], 0)
+
+        DomainEvent.objects.filter(payload__step=1).update(next_attempt_at=timezone.now())
+        process_pending_events()
+        self.assertEqual(seen[2:], [(1, 'ok'), (2, 'ok')])
+
+
+class SubscriberRegistryTests(TestCase):
+    def tearDown(self):
+        EVENT_SUBSCRIBERS.clear()
+
+    def test_wildcard_patterns_resolve_in_subscription_order(self):
+        registry = SubscriberRegistry()
+        exact, one, deep, other = (MagicMock(name=n) for n in ('exact', 'one', 'deep', 'other'))
+        registry.subscribe('lead.created', exact)
+        registry.subscribe('lead.*', one)
+        registry.subscribe('lead.**', deep)
+        registry.subscribe('sale.*', other)
+
+        self.assertEqual([s.handler for s in registry.resolve('lead.created')], [exact, one, deep])
+        self.assertEqual([s.handler for s in registry.resolve('lead')], [deep])
+        self.assertEqual([s.handler for s in registry.resolve('lead.stage.changed')], [deep])
+        self.assertEqual(registry.resolve('campaign.sent'), ())
+
+    def test_double_wildcard_in_the_middle_of_a_pattern(self):
+        registry = SubscriberRegistry()
+        handler = MagicMock()
+        registry.subscribe('lead.**.created', handler)
+
+        for event_type in ('lead.created', 'lead.stage.created', 'lead.stage.won.created'):
+            self.assertEqual([s.handler for s in registry.resolve(event_type)], [handler], event_type)
+        for event_type in ('lead', 'lead.updated', 'lead.created.updated', 'sale.created'):
+            self.assertEqual(registry.resolve(event_type), (), event_type)
+
+    def test_resolution_is_cached_until_a_new_subscription(self):
+        registry = SubscriberRegistry()
+        registry.subscribe('lead.*', MagicMock())
+        first = registry.resolve('lead.created')
+        self.assertIs(registry.resolve('lead.created'), first)
+
+        late = MagicMock()
+        registry.subscribe('*.created', late)
+        self.assertEqual(registry.resolve('lead.created')[-1].handler, late)
+
+    def test_relay_honours_handler_options(self):
+        relay_thread = threading.current_thread()
+        sync_threads = []
+        subscribe('lead.*', lambda payload: sync_threads.append(threading.current_thread()), run_async=False)
+        subscribe('lead.created', lambda payload: time.sleep(1), timeout=0.05)
+        subscribe('lead.updated', MagicMock(__name__='pooled'), concurrency=2)
+        event_dispatcher.dispatch_many(
+            [{'event_type': 'lead.created', 'payload': {}}] + [{'event_type': 'lead.updated', 'payload': {}}] * 4
+        )
+
+        totals = process_pending_events()
+
+        self.assertEqual(set(sync_threads), {relay_thread})
+        self.assertEqual(len(sync_threads), 5)
+        self.assertEqual((totals['processed'], totals['failed']), (4, 1))
+        timed_out = DomainEvent.objects.get(event_type='lead.created')
+        self.assertIn('timed out', timed_out.error_message)
+        self.assertEqual(get_subscribers_for_event('lead.updated')[-1].__name__, 'pooled')
+
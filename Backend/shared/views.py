@@ -1,3 +1,40 @@
-from django.shortcuts import render
+import inspect
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView con handlers async (async def post, ...).
+
+    DRF solo despacha handlers síncronos. Aquí la autenticación, los permisos y
+    el throttling, que pueden consultar la BD, se ejecutan con sync_to_async y
+    el handler se espera en el event loop: bajo ASGI la petición no ocupa un
+    hilo mientras espera a un servicio externo. Bajo WSGI Django la ejecuta con
+    async_to_sync, así que sigue funcionando (sin esa ventaja).
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
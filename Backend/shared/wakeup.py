@@ -0,0 +1,109 @@
+# shared/wakeup.py
+"""
+Despertar del relay al confirmar eventos.
+
+EventDispatcher programa un único despertar por transacción con
+transaction.on_commit. Según DOMAIN_EVENT_RELAY['WAKEUP'] el despertar encola la
+tarea de Celery process_pending_events ('celery') o avisa a un hilo relay
+dentro del propio proceso ('local', útil sin broker). 'auto' (por defecto) usa
+Celery solo si hay un broker configurado: sin él, apply_async bloquearía la
+petición varios segundos intentando conectar. Con None no hay despertar y solo
+queda el poller periódico, que en cualquier caso sigue como red de seguridad
+si un despertar se pierde.
+"""
+import logging
+import os
+import threading
+import weakref
+
+from celery import current_app
+from django.db import connection, transaction
+
+from .relay import get_relay_settings, relay_pending_events
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRelayWorker:
+    """Hilo por proceso que ejecuta el relay cada vez que se le despierta."""
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def wake(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pid = pid
+                    threading.Thread(target=self._run, name='event-relay-wakeup', daemon=True).start()
+        self._wakeup.set()
+
+    def _run(self):
+        from django.db import connections
+        while True:
+            self._wakeup.wait()
+            # Los despertares que lleguen mientras drenamos dejan el evento
+            # activado y provocan otra pasada, así no se pierde ninguno.
+            self._wakeup.clear()
+            try:
+                relay_pending_events()
+            except Exception as e:
+                logger.error(f"Local relay wakeup failed: {e}", exc_info=True)
+            finally:
+                connections.close_all()
+
+
+local_relay_worker = LocalRelayWorker()
+
+# Despertar ya programado en la transacción en curso de cada hilo (ver schedule_relay_wakeup).
+_pending = threading.local()
+
+
+def broker_configured() -> bool:
+    return bool(current_app.conf.broker_url or os.environ.get('CELERY_BROKER_URL'))
+
+
+def get_wakeup_mode():
+    """Modo efectivo del despertar: resuelve 'auto' según haya o no broker."""
+    mode = get_relay_settings()['WAKEUP']
+    if mode == 'auto':
+        return 'celery' if broker_configured() else 'local'
+    return mode
+
+
+def wake_relay():
+    mode = get_wakeup_mode()
+    if mode == 'local':
+        local_relay_worker.wake()
+    elif mode == 'celery':
+        from .tasks import process_pending_events
+        try:
+            # Sin reintentos de publicación: si el broker no responde, el poller lo recogerá.
+            process_pending_events.apply_async(retry=False)
+        except Exception as e:
+            logger.warning(f"Could not enqueue relay wakeup, falling back to the poller: {e}")
+
+
+def schedule_relay_wakeup():
+    """
+    Programa el despertar para cuando la transacción actual se confirme.
+    Varios dispatch en la misma transacción comparten un solo despertar: el
+    hilo guarda una referencia débil al ya programado. Django suelta la
+    callback al ejecutarla o al descartarla en un rollback, así que en ambos
+    casos el siguiente dispatch vuelve a programar el suyo.
+    """
+    if get_wakeup_mode() is None:
+        return
+    scheduled = getattr(_pending, 'wakeup', None)
+    if connection.in_atomic_block and scheduled is not None and scheduled() is not None:
+        return
+
+    def wakeup():
+        _pending.wakeup = None
+        wake_relay()
+
+    if connection.in_atomic_block:
+        _pending.wakeup = weakref.ref(wakeup)
+    transaction.on_commit(wakeup)